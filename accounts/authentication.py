@@ -0,0 +1,89 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def _get_authenticators():
+    return [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+
+def initial(request, view, throttle_classes):
+    """
+    与 DRF 的 APIView.initial 加上 IsAuthenticated 等价：按 DEFAULT_AUTHENTICATION_CLASSES 认证，要求已登录，再按 throttle_classes 限流。
+    认证前先包装成 DRF 的 Request，SessionAuthentication 等需要读取原始请求和 CSRF 状态的认证方式才能用。
+    通过时 user、auth 会设置到 Django 的 request 上，否则抛出 APIException。
+    """
+    drf_request = Request(request, authenticators=_get_authenticators())
+    if not drf_request.user or not drf_request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+
+    waits = [throttle.wait() for throttle in (throttle_class() for throttle_class in throttle_classes) if not throttle.allow_request(drf_request, view)]
+    if waits:
+        raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+def handle_exception(exc, request, view, args, kwargs):
+    """与 DRF 的 APIView.handle_exception 等价：交给 EXCEPTION_HANDLER 生成 JSON 响应，它处理不了的异常继续抛出"""
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        authenticators = _get_authenticators()
+        auth_header = authenticators[0].authenticate_header(request) if authenticators else None
+        if auth_header:
+            exc.auth_header = auth_header
+        else:
+            exc.status_code = status.HTTP_403_FORBIDDEN
+
+    context = {'view': view, 'args': args, 'kwargs': kwargs, 'request': request}
+    response = api_settings.EXCEPTION_HANDLER(exc, context)
+    if response is None:
+        raise exc
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = JSONRenderer.media_type
+    response.renderer_context = context
+    return response.render()
+
+
+async def _dispatch(view, handler, throttle_classes, request, *args, **kwargs):
+    try:
+        await sync_to_async(initial)(request, view, throttle_classes)
+        return await handler(request, *args, **kwargs)
+    except Exception as exc:
+        return await sync_to_async(handle_exception)(exc, request, view, args, kwargs)
+
+
+def async_api_view(http_method_names, throttle_classes=None):
+    """
+    DRF 的 @api_view 不支持 async 视图，需要登录的原生 async 函数视图改用这个装饰器，
+    相当于 @api_view(http_method_names) 加上 @permission_classes([IsAuthenticated]) 和 @throttle_classes(throttle_classes)。
+    throttle_classes 默认为 DEFAULT_THROTTLE_CLASSES。
+    """
+    def decorator(view):
+        async def handler(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                raise exceptions.MethodNotAllowed(request.method)
+            return await view(request, *args, **kwargs)
+
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            classes = api_settings.DEFAULT_THROTTLE_CLASSES if throttle_classes is None else throttle_classes
+            return await _dispatch(wrapper, handler, classes, request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class AsyncAPIView(View):
+    """
+    DRF 的 APIView 不支持 async，需要登录的原生 async 类视图继承这个类，处理方法写成 async def。
+    和 APIView 一样可以用 throttle_classes 指定限流。
+    """
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await _dispatch(self, super().dispatch, self.throttle_classes, request, *args, **kwargs)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed(request.method)
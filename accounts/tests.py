@@ -1,3 +1,81 @@
-from django.test import TestCase
+import json
+
+from django.http import Http404, JsonResponse
+from django.test import AsyncRequestFactory, TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.throttling import BaseThrottle
+
+from .authentication import AsyncAPIView, async_api_view
+from .models import CustomUser
+
+
+class DenyThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        return False
+
+    def wait(self):
+        return 30
+
+
+@async_api_view(['GET'])
+async def whoami(request):
+    return JsonResponse({"username": request.user.username, "auth": str(request.auth)})
+
+
+@async_api_view(['GET'], throttle_classes=[DenyThrottle])
+async def throttled(request):
+    return JsonResponse({})
+
+
+@async_api_view(['GET'])
+async def missing(request):
+    raise Http404
+
+
+class WhoAmIView(AsyncAPIView):
+    async def get(self, request):
+        return JsonResponse({"username": request.user.username})
+
 
 # Create your tests here.
+class AsyncAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.factory = AsyncRequestFactory()
+
+    def _get(self, token=None, method='get'):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        return getattr(self.factory, method)('/', headers=headers)
+
+    async def test_token_authentication(self):
+        response = await whoami(self._get(self.token.key))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"username": "student", "auth": self.token.key})
+
+        response = await whoami(self._get())
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        response = await whoami(self._get('wrong'))
+        self.assertEqual((response.status_code, list(json.loads(response.content))), (401, ["detail"]))
+
+    async def test_session_authentication(self):
+        with self.settings(REST_FRAMEWORK={'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.SessionAuthentication']}):
+            request = self._get()
+            # AuthenticationMiddleware 设置的登录用户
+            request.user = self.user
+            response = await WhoAmIView.as_view()(request)
+            self.assertEqual((response.status_code, json.loads(response.content)), (200, {"username": "student"}))
+
+            # SessionAuthentication 没有 WWW-Authenticate，和 DRF 一样返回 403
+            response = await WhoAmIView.as_view()(self._get())
+            self.assertEqual(response.status_code, 403)
+
+    async def test_drf_errors(self):
+        response = await throttled(self._get(self.token.key))
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+        response = await missing(self._get(self.token.key))
+        self.assertEqual((response.status_code, list(json.loads(response.content))), (404, ["detail"]))
+        for view in (whoami, WhoAmIView.as_view()):
+            response = await view(self._get(self.token.key, method='post'))
+            self.assertEqual((response.status_code, response['Content-Type']), (405, 'application/json'))
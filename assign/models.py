@@ -3,6 +3,7 @@ from django.conf import settings
 from django.db import models
 
 from design.models import ProblemList
+from judge.models import Submission
 from pdf.models import PDF
 from chat.models import ConversationTemplate, Conversation
 
@@ -90,6 +91,24 @@ class Homework(models.Model):
         
         self.set_problems(problems)
     
+    def refresh_best_submissions(self):
+        """重新判题后提交的结果变了，按最新结果重新挑选每道题的最佳提交"""
+        problems = self.get_problems()
+        submission_ids = [submission_id for problem in problems.values() for submission_id in problem.get('submissions', [])]
+        submissions = Submission.objects.only('id', 'total_count', 'success_count').in_bulk(submission_ids)
+        for problem in problems.values():
+            best_submission = None
+            for submission_id in problem.get('submissions', []):
+                submission = submissions.get(submission_id)
+                if submission and (best_submission is None or submission.success_count > best_submission.success_count):
+                    best_submission = submission
+            problem['best_submission'] = {
+                'id': best_submission.id,
+                'total_count': best_submission.total_count,
+                'success_count': best_submission.success_count,
+            } if best_submission else None
+        self.set_problems(problems)
+    
     def _update_todo_count(self):
         self.todo_count = self.assignment.problem_list.problems.count()
     
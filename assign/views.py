@@ -155,6 +155,8 @@ class HomeworkView(APIView):
             return Response({"error": "Problem List Item ID is required"}, status=status.HTTP_400_BAD_REQUEST)
         problem_list_item = get_object_or_404(ProblemListItem, id=problem_list_item_id, problem_list=assignment.problem_list)
         submission = get_object_or_404(Submission, id=submission_id, user=request.user, problem=problem_list_item.problem)
+        if submission.judge_status != Submission.JudgeStatus.FINISHED:
+            return Response({"error": "Submission is still being judged"}, status=status.HTTP_409_CONFLICT)
 
         try:
             with transaction.atomic():
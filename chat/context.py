@@ -0,0 +1,19 @@
+from .models import Message
+
+
+def get_window_ids(conversation_id, available_tokens):
+    """
+    从最新的消息往前取，直到 token 数之和超过 available_tokens 为止，返回取到的消息 id（从新到旧）。
+    Message.cumulative_tokens 是会话内 token 数的前缀和，总数减去预算就是窗口的起点，
+    因此只读取窗口内消息的 (id, tokens)，不读 content，耗时只与窗口大小有关，与会话的长短无关。
+    """
+    total = Message.get_total_tokens(conversation_id)
+    rows = Message.objects.filter(conversation_id=conversation_id, cumulative_tokens__gte=total - available_tokens).order_by('-created_at', '-id').values_list('id', 'tokens')
+    # 前缀和只用来缩小范围，窗口内仍然逐条累加，前缀和有偏差（如删除过消息）时也不会超出预算
+    ids = []
+    for message_id, tokens in rows:
+        available_tokens -= tokens
+        if available_tokens < 0:
+            break
+        ids.append(message_id)
+    return ids
@@ -0,0 +1,368 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+from .models import Message
+from .tokenizer import TOKENIZER
+
+# Load environment variables from .env file
+load_dotenv(override=True)
+
+
+class LLMBusyError(Exception):
+    """等了 LLM_QUEUE_TIMEOUT 秒仍然没有空闲的名额，调用方应返回 503"""
+    pass
+
+
+class ModelLimiter:
+    """
+    限制同时发往同一个模型的请求数。同步和异步调用共用一个计数，
+    同步调用在条件变量上等待，异步调用轮询等待，不阻塞事件循环。
+    """
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def _try_acquire(self):
+        with self._condition:
+            if self.capacity > 0 and self.in_use >= self.capacity:
+                return False
+            self.in_use += 1
+            return True
+
+    def acquire(self, timeout):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.capacity <= 0 or self.in_use < self.capacity, timeout=timeout):
+                raise LLMBusyError("Too many requests to the language model, please try again later")
+            self.in_use += 1
+
+    async def acquire_async(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self._try_acquire():
+            if time.monotonic() >= deadline:
+                raise LLMBusyError("Too many requests to the language model, please try again later")
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    def release(self):
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+
+class LLMStream:
+    """
+    包装流式响应：流读完、关闭或被回收时归还并发名额，名额只会归还一次。
+    视图里用 `with stream:` 包住遍历，客户端中途断开时也能及时归还。
+    """
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release:
+            try:
+                self._stream.close()
+            finally:
+                release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class AsyncLLMStream:
+    """LLMStream 的异步版本"""
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        release, self._release = self._release, None
+        if release:
+            try:
+                await self._stream.close()
+            finally:
+                release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def __del__(self):
+        # 没来得及 aclose 时至少把名额还回去，底层连接交给 httpx 回收
+        release, self._release = self._release, None
+        if release:
+            release()
+
+
+class LLMGateway:
+    """
+    所有对大语言模型的调用都经过这里：
+    同步、异步各共用一个带连接池的 HTTP 客户端，每个请求都有超时；
+    每个模型单独限制并发数，排队超过 queue_timeout 秒抛出 LLMBusyError；
+    遇到 429、5xx 和连接错误时按指数退避加随机抖动重试，429 带 Retry-After 时以它为准。
+    """
+    def __init__(self, api_key, base_url, model, timeout=60, connect_timeout=5, max_retries=2, retry_backoff=0.5, retry_backoff_max=8,
+                 pool_size=32, concurrency=16, model_concurrency=None, queue_timeout=10, transport=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.queue_timeout = queue_timeout
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._client = None
+        # httpx.AsyncClient 不能跨事件循环使用，每个事件循环各建一个
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _limits(self):
+        return httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    http_client = httpx.Client(limits=self._limits(), timeout=self.timeout, transport=self._transport)
+                    # 重试由网关自己做，关掉 SDK 内置的重试
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0, http_client=http_client)
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                http_client = httpx.AsyncClient(limits=self._limits(), timeout=self.timeout, transport=self._transport)
+                client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0, http_client=http_client)
+                self._async_clients[loop] = client
+        return client
+
+    def limiter(self, model):
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = ModelLimiter(self.model_concurrency.get(model, self.concurrency))
+            return self._limiters[model]
+
+    @staticmethod
+    def is_retryable(error):
+        return isinstance(error, (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError))
+
+    def get_retry_delay(self, error, attempt):
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.retry_backoff_max)
+        except ValueError:
+            pass
+        # full jitter：在 [0, 退避上限] 里随机取，避免一起重试又一起撞上限流
+        return random.uniform(0, min(self.retry_backoff * 2 ** attempt, self.retry_backoff_max))
+
+    def _create(self, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            except openai.APIError as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                time.sleep(self.get_retry_delay(e, attempt))
+
+    async def _acreate(self, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.async_client.chat.completions.create(**kwargs)
+            except openai.APIError as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                await asyncio.sleep(self.get_retry_delay(e, attempt))
+
+    def chat(self, messages, model=None, stream=False, **kwargs):
+        """
+        同 client.chat.completions.create；stream=True 时返回 LLMStream，
+        并发名额一直占用到流读完或关闭为止。流开始之后出错不再重试。
+        """
+        model = model or self.model
+        limiter = self.limiter(model)
+        limiter.acquire(self.queue_timeout)
+        try:
+            response = self._create(model=model, messages=messages, stream=stream, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+        if stream:
+            return LLMStream(response, limiter.release)
+        limiter.release()
+        return response
+
+    async def achat(self, messages, model=None, stream=False, **kwargs):
+        """chat 的异步版本，stream=True 时返回 AsyncLLMStream"""
+        model = model or self.model
+        limiter = self.limiter(model)
+        await limiter.acquire_async(self.queue_timeout)
+        try:
+            response = await self._acreate(model=model, messages=messages, stream=stream, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+        if stream:
+            return AsyncLLMStream(response, limiter.release)
+        limiter.release()
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {model: {"in_use": limiter.in_use, "capacity": limiter.capacity} for model, limiter in self._limiters.items()}
+
+
+LLM = LLMGateway(
+    api_key=os.getenv("API_KEY"),
+    base_url=os.getenv("BASE_URL"),
+    model=os.getenv("MODEL"),
+    timeout=settings.LLM_TIMEOUT,
+    connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+    max_retries=settings.LLM_MAX_RETRIES,
+    retry_backoff=settings.LLM_RETRY_BACKOFF,
+    retry_backoff_max=settings.LLM_RETRY_BACKOFF_MAX,
+    pool_size=settings.LLM_POOL_SIZE,
+    concurrency=settings.LLM_CONCURRENCY,
+    model_concurrency=settings.LLM_MODEL_CONCURRENCY,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+)
+
+
+class AnswerAccumulator:
+    """
+    流式输出时只累积文本增量，不保留 chunk 对象。每隔 checkpoint_interval 秒把已经生成的部分写入数据库，
+    输出结束、客户端断开或模型服务出错时以相应的状态做最后一次保存，已经生成（并计费）的内容不会丢失。
+    create(content, tokens, status) 在第一次保存时创建回答并返回对应的 Message，之后的保存都更新这条消息。
+    """
+    def __init__(self, create, checkpoint_interval=None):
+        self.create = create
+        self.checkpoint_interval = settings.LLM_ANSWER_CHECKPOINT_INTERVAL if checkpoint_interval is None else checkpoint_interval
+        self.message = None
+        self.usage = None
+        self._parts = []
+        self._last_checkpoint = time.monotonic()
+
+    def add(self, chunk):
+        """记下一个 chunk，返回其中的文本增量（可能为空字符串）"""
+        if chunk.usage:
+            self.usage = chunk.usage
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            self._parts.append(text)
+        return text or ''
+
+    def should_checkpoint(self):
+        return time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+
+    def save(self, status):
+        if self.message is None and not self._parts and status != Message.Status.COMPLETE:
+            # 还没有生成任何内容就断开或出错，不留下空的回答
+            return
+        content = ''.join(self._parts)
+        # 只有正常结束时才有 usage，其余情况按已生成的文本估算
+        tokens = self.usage.completion_tokens if self.usage else TOKENIZER.count_tokens(content)
+        if self.message is None:
+            self.message = self.create(content, tokens, status)
+        else:
+            self.message.update_answer(content, tokens, status)
+        self._last_checkpoint = time.monotonic()
+
+
+async def stream_answer(request, messages, create):
+    """
+    流式调用大模型，返回给 StreamingHttpResponse 的迭代器，逐段输出回答，并用 AnswerAccumulator 保存回答，
+    create(content, tokens, status) 创建回答对应的 Message 并返回。
+    ASGI 下用异步客户端，等待输出时不占用线程；WSGI 下（如 runserver）Django 会在另一个事件循环里消费异步迭代器，
+    而异步客户端的连接不能跨事件循环使用，所以退回同步客户端和同步的生成器。
+    """
+    accumulator = AnswerAccumulator(create)
+
+    if not isinstance(request, ASGIRequest):
+        response = await sync_to_async(LLM.chat, thread_sensitive=False)(messages, stream=True)
+
+        def stream_response():
+            status = Message.Status.FAILED
+            try:
+                with response:
+                    for chunk in response:
+                        text = accumulator.add(chunk)
+                        if text:
+                            yield text
+                        if accumulator.should_checkpoint():
+                            accumulator.save(Message.Status.STREAMING)
+                status = Message.Status.COMPLETE
+            except GeneratorExit:
+                # 客户端断开时 WSGI 服务器会关闭迭代器
+                status = Message.Status.INTERRUPTED
+                raise
+            finally:
+                accumulator.save(status)
+
+        return stream_response()
+
+    response = await LLM.achat(messages, stream=True)
+
+    async def astream_response():
+        status = Message.Status.FAILED
+        try:
+            async with response:
+                async for chunk in response:
+                    text = accumulator.add(chunk)
+                    if text:
+                        yield text
+                    if accumulator.should_checkpoint():
+                        await sync_to_async(accumulator.save)(Message.Status.STREAMING)
+            status = Message.Status.COMPLETE
+        except (GeneratorExit, asyncio.CancelledError):
+            status = Message.Status.INTERRUPTED
+            raise
+        finally:
+            await sync_to_async(accumulator.save)(status)
+
+    return astream_response()
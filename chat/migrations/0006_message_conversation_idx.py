@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0005_conversation_starters_conversation_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "created_at"], name="message_conversation_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+def fill_cumulative_tokens(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    batch = []
+    conversation_id, total = None, 0
+    messages = Message.objects.only("id", "conversation_id", "tokens").order_by(
+        "conversation_id", "created_at", "id"
+    )
+    for message in messages.iterator(chunk_size=500):
+        if message.conversation_id != conversation_id:
+            conversation_id, total = message.conversation_id, 0
+        total += message.tokens
+        message.cumulative_tokens = total
+        batch.append(message)
+        if len(batch) >= 500:
+            Message.objects.bulk_update(batch, ["cumulative_tokens"])
+            batch = []
+    Message.objects.bulk_update(batch, ["cumulative_tokens"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0006_message_conversation_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="cumulative_tokens",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_cumulative_tokens, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "cumulative_tokens"],
+                name="message_cumulative_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0007_message_cumulative_tokens"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="status",
+            field=models.CharField(default="complete", max_length=20),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.conf import settings
-from django.db import models
-import tiktoken
+from django.db import models, transaction
+
+from .tokenizer import TOKENIZER
 
 # Create your models here.
 class ConversationTemplate(models.Model):
@@ -25,24 +26,68 @@ class Conversation(models.Model):
         return f'{self.title} - {self.user.username} - {self.created_at.strftime("%Y-%m-%d %H:%M:%S")}'
 
 class Message(models.Model):
+    class Status:
+        COMPLETE = 'complete'
+        STREAMING = 'streaming'  # 回答还在输出中，content 是最近一次保存的部分
+        INTERRUPTED = 'interrupted'  # 客户端中途断开，content 是已经生成的部分
+        FAILED = 'failed'  # 模型服务中途出错，content 是已经生成的部分
+
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     role = models.CharField(max_length=10)  # 'system', 'user', or 'assistant'
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     tokens = models.IntegerField(default=0)  # Token count for the message
+    # 会话中截至这条消息（含）的 token 数之和，即按时间顺序的前缀和，见 chat.context
+    cumulative_tokens = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, default=Status.COMPLETE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+            models.Index(fields=['conversation', 'cumulative_tokens'], name='message_cumulative_idx'),
+        ]
 
     def __str__(self):
         return f'{self.role}: {self.content}'
 
     @staticmethod
     def count_tokens(text):
-        """粗略计算消息内容的 token 数量"""
-        if not hasattr(Message.count_tokens, "encoding"):
-            Message.count_tokens.encoding = tiktoken.encoding_for_model("gpt-4")
-        tokens = Message.count_tokens.encoding.encode(text)
-        return len(tokens)
+        """粗略计算消息内容的 token 数量，结果有缓存，见 chat.tokenizer"""
+        return TOKENIZER.count_tokens(text)
+
+    @staticmethod
+    def get_total_tokens(conversation_id):
+        """会话中所有消息的 token 数之和，即最新一条消息的 cumulative_tokens"""
+        return Message.objects.filter(conversation_id=conversation_id).order_by('-created_at', '-id').values_list('cumulative_tokens', flat=True).first() or 0
+
+    @staticmethod
+    def lock_conversation(conversation_id):
+        """
+        在事务里锁住会话，同一会话里计算和修改 cumulative_tokens 的操作依次进行，避免两条并发插入的消息算出相同的前缀和。
+        用一次不改变任何值的 UPDATE 加锁：SQLite 不支持 SELECT ... FOR UPDATE，但写操作会拿到整个数据库的写锁。
+        """
+        Conversation.objects.filter(id=conversation_id).update(updated_at=models.F('updated_at'))
+
+    def update_answer(self, content, tokens, status):
+        """流式输出过程中更新回答，token 数变化时同步修正这条及之后所有消息的 cumulative_tokens"""
+        delta = tokens - self.tokens
+        self.content, self.tokens, self.status = content, tokens, status
+        with transaction.atomic():
+            if delta:
+                self.lock_conversation(self.conversation_id)
+                later = Message.objects.filter(conversation_id=self.conversation_id).filter(
+                    models.Q(created_at__gt=self.created_at) | models.Q(created_at=self.created_at, id__gt=self.id))
+                later.update(cumulative_tokens=models.F('cumulative_tokens') + delta)
+                self.cumulative_tokens = Message.objects.filter(id=self.id).values_list('cumulative_tokens', flat=True).get() + delta
+            self.save(update_fields=['content', 'tokens', 'cumulative_tokens', 'status'])
 
     def save(self, *args, **kwargs):
         if self.tokens == 0:
             self.tokens = self.count_tokens(self.content)
+        if self._state.adding and not self.cumulative_tokens:
+            with transaction.atomic():
+                self.lock_conversation(self.conversation_id)
+                self.cumulative_tokens = self.get_total_tokens(self.conversation_id) + self.tokens
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
\ No newline at end of file
@@ -1,3 +1,205 @@
-from django.test import TestCase
+import json
+import threading
+from unittest import mock
+
+import httpx
+import openai
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from accounts.models import CustomUser
+from .context import get_window_ids
+from .llm import LLMGateway, LLMBusyError
+from .tokenizer import Tokenizer
+from .models import Conversation, Message
+from .views import _get_context
+
+
+def completion(content):
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "test",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+def stream_chunks(*contents):
+    lines = [json.dumps({
+        "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "test",
+        "choices": [{"index": 0, "finish_reason": None, "delta": {"content": content}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": len(contents), "total_tokens": len(contents) + 1} if i == len(contents) - 1 else None,
+    }) for i, content in enumerate(contents)]
+    return ''.join(f'data: {line}\n\n' for line in lines + ['[DONE]'])
+
 
 # Create your tests here.
+class LLMGatewayTests(SimpleTestCase):
+    def _gateway(self, handler, **kwargs):
+        kwargs.setdefault('retry_backoff', 0)
+        return LLMGateway(api_key='key', base_url='http://llm.test/v1', model='test', transport=httpx.MockTransport(handler), **kwargs)
+
+    def test_retries_rate_limit_and_server_errors(self):
+        statuses = [429, 503, 200]
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            code = statuses[len(calls) - 1]
+            return httpx.Response(code, json=completion('hi') if code == 200 else {"error": {"message": "busy"}})
+
+        response = self._gateway(handler, max_retries=2).chat([{"role": "user", "content": "hello"}])
+        self.assertEqual(response.choices[0].message.content, 'hi')
+        self.assertEqual(len(calls), 3)
+
+        calls.clear()
+        statuses[:] = [400]
+        with self.assertRaises(openai.BadRequestError):
+            self._gateway(handler, max_retries=2).chat([{"role": "user", "content": "hello"}])
+        self.assertEqual(len(calls), 1)
+
+    def test_stream_holds_model_slot_until_closed(self):
+        def handler(request):
+            return httpx.Response(200, text=stream_chunks('a', 'b'), headers={"content-type": "text/event-stream"})
+
+        gateway = self._gateway(handler, concurrency=1, queue_timeout=0)
+        stream = gateway.chat([{"role": "user", "content": "hello"}], stream=True)
+        with self.assertRaises(LLMBusyError):
+            gateway.chat([{"role": "user", "content": "hello"}])
+
+        with stream:
+            self.assertEqual(''.join(chunk.choices[0].delta.content for chunk in stream), 'ab')
+        self.assertEqual(gateway.stats(), {"test": {"in_use": 0, "capacity": 1}})
+
+        # 名额释放后，排队的请求可以继续
+        stream = gateway.chat([{"role": "user", "content": "hello"}], stream=True)
+        waiter = threading.Thread(target=lambda: gateway.chat([{"role": "user", "content": "hello"}], stream=True).close())
+        gateway.queue_timeout = 5
+        waiter.start()
+        stream.close()
+        waiter.join(timeout=5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(gateway.stats()["test"]["in_use"], 0)
+
+
+class TokenizerTests(SimpleTestCase):
+    def setUp(self):
+        self.encoding = mock.Mock()
+        self.encoding.encode.side_effect = lambda text: text.split()
+        self.encoding.encode_batch.side_effect = lambda texts: [text.split() for text in texts]
+        self.tokenizer = Tokenizer(cache_size=2, encoding=self.encoding)
+
+    def test_counts_are_cached_by_content(self):
+        self.assertEqual(self.tokenizer.count_tokens('a b c'), 3)
+        self.assertEqual(self.tokenizer.count_tokens('a b c'), 3)
+        self.assertEqual(self.encoding.encode.call_count, 1)
+
+        # 超出容量时淘汰最久没有用到的
+        self.tokenizer.count_tokens('d')
+        self.tokenizer.count_tokens('e f')
+        self.tokenizer.count_tokens('a b c')
+        self.assertEqual(self.encoding.encode.call_count, 4)
+        self.assertEqual(self.tokenizer.stats(), {"size": 2, "capacity": 2, "hits": 1, "misses": 4})
+
+    def test_count_many_encodes_misses_in_one_batch(self):
+        self.tokenizer.count_tokens('a')
+        self.assertEqual(self.tokenizer.count_tokens_many(['b c', 'a', 'b c', '']), [2, 1, 2, 0])
+        self.encoding.encode_batch.assert_called_once_with(['b c', ''])
+
+
+class AnswerStreamingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=self.conversation, role='user', content='hello', tokens=1)
+        self.url = f'/chat/conversations/{self.conversation.id}/answer/'
+
+        def handler(request):
+            return httpx.Response(200, text=stream_chunks('Hi', ' there'), headers={"content-type": "text/event-stream"})
+
+        self._patch_llm(handler)
+
+    def _patch_llm(self, handler):
+        gateway = LLMGateway(api_key='key', base_url='http://llm.test/v1', model='test', transport=httpx.MockTransport(handler))
+        patcher = mock.patch('chat.llm.LLM', gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _answer(self, *fields):
+        return Message.objects.filter(conversation=self.conversation, role='assistant').values_list(*(fields or ('content', 'tokens'))).first()
+
+    async def test_streams_asynchronously_under_asgi(self):
+        response = await self.async_client.get(self.url, headers={'Authorization': f'Token {self.token.key}'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, b'Hi there')
+        self.assertEqual(await sync_to_async(self._answer)(), ('Hi there', 2))
+
+    def test_answer_saved_after_stream(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(b''.join(response.streaming_content), b'Hi there')
+        self.assertEqual(self._answer(), ('Hi there', 2))
+        self.assertEqual(self.client.get('/chat/conversations/0/answer/', HTTP_AUTHORIZATION=f'Token {self.token.key}').status_code, 404)
+
+
+    @override_settings(LLM_ANSWER_CHECKPOINT_INTERVAL=0)
+    def test_partial_answer_kept_when_client_disconnects(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b'Hi')
+        self.assertEqual(next(chunks), b' there')
+        self.assertEqual(self._answer('content', 'status'), ('Hi', Message.Status.STREAMING))
+        response.close()
+        self.assertEqual(self._answer('content', 'tokens', 'status', 'cumulative_tokens'), ('Hi there', 2, Message.Status.INTERRUPTED, 3))
+
+    def test_partial_answer_kept_when_provider_fails(self):
+        def handler(request):
+            body = stream_chunks('Hi').replace('data: [DONE]', 'data: {"error": {"message": "overloaded"}}')
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+        self._patch_llm(handler)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        with self.assertRaises(openai.APIError):
+            b''.join(response.streaming_content)
+        self.assertEqual(self._answer('content', 'status'), ('Hi', Message.Status.FAILED))
+
+
+class ContextWindowTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def test_cumulative_tokens(self):
+        for i in range(1, 4):
+            Message.objects.create(conversation=self.conversation, role='user', content=f'message {i}', tokens=i)
+        self.assertEqual(list(Message.objects.filter(conversation=self.conversation).order_by('created_at', 'id').values_list('cumulative_tokens', flat=True)), [1, 3, 6])
+        self.assertEqual(Message.get_total_tokens(self.conversation.id), 6)
+        self.assertEqual(Message.get_total_tokens(0), 0)
+
+    def test_growing_answer_shifts_later_totals(self):
+        Message.objects.create(conversation=self.conversation, role='user', content='question', tokens=3)
+        answer = Message.objects.create(conversation=self.conversation, role='assistant', content='partial', tokens=2, status=Message.Status.STREAMING)
+        # 回答还在输出时，又来了一条提问
+        Message.objects.create(conversation=self.conversation, role='user', content='another question', tokens=4)
+        answer.update_answer('full answer', 10, Message.Status.COMPLETE)
+        self.assertEqual(list(Message.objects.filter(conversation=self.conversation).order_by('created_at', 'id').values_list('cumulative_tokens', flat=True)), [3, 13, 17])
+        self.assertEqual(answer.cumulative_tokens, 13)
+        self.assertEqual(Message.get_total_tokens(self.conversation.id), 17)
+
+    def test_window_of_long_conversation(self):
+        messages = [Message.objects.create(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant', content=f'message {i}', tokens=10) for i in range(200)]
+        self.assertEqual(get_window_ids(self.conversation.id, 35), [messages[-1].id, messages[-2].id, messages[-3].id])
+        self.assertEqual(get_window_ids(self.conversation.id, 5), [])
+
+        # 只取窗口内的消息，查询数与会话长短无关
+        with CaptureQueriesContext(connection) as queries:
+            context = _get_context(self.conversation.id, 30)
+        self.assertEqual([message["content"] for message in context], ['message 197', 'message 198', 'message 199'])
+        self.assertEqual(len(queries), 3)
+
+        # 删除消息之后前缀和不再连续，窗口内逐条累加，仍然不会超出预算
+        messages[-2].delete()
+        self.assertEqual(get_window_ids(self.conversation.id, 35), [messages[-1].id, messages[-3].id, messages[-4].id])
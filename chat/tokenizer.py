@@ -0,0 +1,84 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import tiktoken
+from django.conf import settings
+
+
+class Tokenizer:
+    """
+    带 LRU 缓存的 token 计数。同样的文本（提示词模板、题目描述、PDF 页面文本等）会被反复计数，
+    缓存以内容的 hash 为键，不在内存里保留原文；没有命中的文本用 encode_batch 一次编码。
+    """
+    def __init__(self, cache_size, model="gpt-4", encoding=None):
+        self.cache_size = cache_size
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._encoding = encoding
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            self._encoding = tiktoken.encoding_for_model(self.model)
+        return self._encoding
+
+    @staticmethod
+    def get_key(text):
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _get(self, key):
+        with self._lock:
+            count = self._cache.get(key)
+            if count is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            return count
+
+    def _put(self, key, count):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def count_tokens(self, text):
+        key = self.get_key(text)
+        count = self._get(key)
+        if count is None:
+            count = len(self.encoding.encode(text))
+            self._put(key, count)
+        return count
+
+    def count_tokens_many(self, texts):
+        """依次返回每段文本的 token 数，重复的文本只编码一次"""
+        keys = [self.get_key(text) for text in texts]
+        counts = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in counts or key in missing:
+                continue
+            count = self._get(key)
+            if count is None:
+                missing[key] = text
+            else:
+                counts[key] = count
+        if missing:
+            for key, tokens in zip(missing, self.encoding.encode_batch(list(missing.values()))):
+                counts[key] = len(tokens)
+                self._put(key, counts[key])
+        return [counts[key] for key in keys]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._cache), "capacity": self.cache_size, "hits": self.hits, "misses": self.misses}
+
+
+TOKENIZER = Tokenizer(settings.LLM_TOKEN_CACHE_SIZE)
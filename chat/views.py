@@ -1,21 +1,18 @@
 import json
+from asgiref.sync import sync_to_async
 from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.http import StreamingHttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from dotenv import load_dotenv
 import os
-from openai import OpenAI
 
 from .models import Conversation, Message, ConversationTemplate
-
-# Load environment variables from .env file
-load_dotenv(override=True)
-CLIENT = OpenAI(api_key=os.getenv("API_KEY"), base_url=os.getenv("BASE_URL"))
-MODEL = os.getenv("MODEL")
+from .llm import LLM, LLMBusyError, stream_answer
+from .context import get_window_ids
+from accounts.authentication import async_api_view
 
 # Load the prompt from the file
 with open(os.path.join(os.path.dirname(__file__), './prompts/recommendations.txt'), 'r', encoding='utf-8') as file:
@@ -41,7 +38,7 @@ def get_conversations(request):
 @permission_classes([IsAuthenticated])
 def get_messages(request, conversation_id):
     messages = Message.objects.filter(conversation_id=conversation_id).order_by('created_at')
-    message_list = [{"role": msg.role, "content": msg.content} for msg in messages]
+    message_list = [{"role": msg.role, "content": msg.content, "status": msg.status} for msg in messages]
     return Response({"messages": message_list}, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
@@ -66,23 +63,11 @@ def ask_question(request, conversation_id):
 
 def _get_context(conversation_id, available_tokens):
     # 在长度有限的前提下，尽可能多地放入之前的消息，作为上下文
-    conversation_messages = Message.objects.filter(conversation_id=conversation_id).order_by('-created_at')
-    context_messages = []
-    
-    for msg in conversation_messages:
-        available_tokens -= msg.tokens
-        if available_tokens < 0:
-            break
-        else:
-            context_messages.append({"role": msg.role, "content": msg.content})
-    
-    return context_messages[::-1]
+    ids = get_window_ids(conversation_id, available_tokens)
+    conversation_messages = Message.objects.filter(id__in=ids).order_by('created_at', 'id').only('role', 'content')
+    return [{"role": msg.role, "content": msg.content} for msg in conversation_messages]
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def get_answer(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id)
-    
+def _get_answer_messages(conversation):
     CONTEXT_WINDOW = 8192
     RESERVED_ANSWER_LENGTH = 1024
 
@@ -94,30 +79,24 @@ def get_answer(request, conversation_id):
     else:
         messages.append({"role": "system", "content": PROMPT_SYSTEM})
         tokens -= PROMPT_SYSTEM_TOKENS
-    messages += _get_context(conversation_id, tokens)
+    messages += _get_context(conversation.id, tokens)
+    return messages
+
+@async_api_view(['GET'])
+async def get_answer(request, conversation_id):
+    # 原生 async 视图：在 ASGI 下等待大模型输出时不占用线程
+    conversation = await sync_to_async(get_object_or_404)(Conversation, id=conversation_id)
+    messages = await sync_to_async(_get_answer_messages)(conversation)
+
+    def save_answer(assistant_content, tokens, answer_status):
+        return Message.objects.create(conversation=conversation, role='assistant', content=assistant_content, tokens=tokens, status=answer_status)
 
     try:
-        response = CLIENT.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            stream=True
-        )
-
-        def stream_response():
-            chunks = []
-            for chunk in response:
-                chunks.append(chunk)
-                yield chunk.choices[0].delta.content
-
-            assistant_content = "".join([chunk.choices[0].delta.content for chunk in chunks])
-            last_chunk = chunks[-1]
-            usage = last_chunk.usage
-            conversation = Conversation.objects.get(id=conversation_id)
-            Message.objects.create(conversation=conversation, role='assistant', content=assistant_content, tokens=usage.completion_tokens)
-
-        return StreamingHttpResponse(stream_response(), content_type='text/plain')
+        return StreamingHttpResponse(await stream_answer(request, messages, save_answer), content_type='text/plain')
+    except LLMBusyError as e:
+        return JsonResponse({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 def _get_recommendations_get_context(conversation_id, available_tokens):
     conversation = get_object_or_404(Conversation, id=conversation_id)
@@ -135,7 +114,9 @@ def _get_recommendations_get_context(conversation_id, available_tokens):
     tokens = available_tokens - PROMPT_RECOMMENDATIONS_TOKENS - Message.count_tokens(prompt) - Message.count_tokens(conclusion)
     user_overhead = Message.count_tokens(f'## user question:\n```\n...\n```\n\n')
     assistant_overhead = Message.count_tokens(f'## assistant answer:\n```\n...\n```\n\n')
-    conversation_messages = Message.objects.filter(conversation_id=conversation_id).order_by('-created_at')
+    # 每条消息还有格式上的开销，只按 tokens 取出的窗口一定能放下所有候选消息
+    ids = get_window_ids(conversation_id, max(tokens, 0))
+    conversation_messages = Message.objects.filter(id__in=ids).order_by('-created_at', '-id').only('role', 'content', 'tokens')
     context_messages = []
     for msg in conversation_messages:
         tokens -= msg.tokens
@@ -166,16 +147,14 @@ def get_recommendations(request, conversation_id):
         RESERVED_ANSWER_LENGTH = 256
         messages = _get_recommendations_get_context(conversation_id, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
         try:
-            response = CLIENT.chat.completions.create(
-                model=MODEL,
-                messages=messages,
-                response_format={'type': 'json_object'},
-            )
+            response = LLM.chat(messages, response_format={'type': 'json_object'})
             starters = response.choices[0].message.content
             starters = json.loads(starters)
             starters = "\n".join(starters)
             conversation.starters = starters
             conversation.save()
+        except LLMBusyError as e:
+            return Response({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -202,6 +181,7 @@ def start_conversation(request):
                         role=message.role,
                         content=message.content,
                         tokens=message.tokens,
+                        cumulative_tokens=message.cumulative_tokens,
                         created_at=message.created_at
                     )
                     for message in initial_messages
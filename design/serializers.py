@@ -1,10 +1,16 @@
 from rest_framework import serializers
 
 from .models import Problem, TestCase, ProblemDesign, ProblemList, ProblemListItem
-from judge.serializers import ProblemSerializer, TestCaseSerializer
+from judge.serializers import ProblemSerializer as BaseProblemSerializer, TestCaseSerializer
 from accounts.serializers import UserSerializer
 
 
+class ProblemSerializer(BaseProblemSerializer):
+    """出题时可以读写特判程序的源代码，学生看到的题目里不包含它"""
+    class Meta(BaseProblemSerializer.Meta):
+        fields = BaseProblemSerializer.Meta.fields + ['spj_src']
+
+
 class ProblemDesignSerializer(serializers.ModelSerializer):
     designer = UserSerializer(read_only=True)
     
@@ -24,7 +30,7 @@ class ProblemListSerializer(serializers.ModelSerializer):
 
 
 class ProblemListItemSerializer(serializers.ModelSerializer):
-    problem = ProblemSerializer(read_only=True)
+    problem = BaseProblemSerializer(read_only=True)
 
     class Meta:
         model = ProblemListItem
@@ -1,3 +1,101 @@
-from django.test import TestCase
+import io
+import json
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from judge.models import Submission, TestCaseResult
+from .models import Problem, TestCase as ProblemTestCase, ProblemDesign
 
 # Create your tests here.
+class ProblemTestCaseImportExportTests(TestCase):
+    def setUp(self):
+        self.teacher = CustomUser.objects.create_user(username='teacher', full_name='Teacher', password='password', is_teacher=True)
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        ProblemDesign.objects.create(problem=self.problem, designer=self.teacher)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+        self.url = f'/design/problems/{self.problem.id}/testcases/'
+
+    def _upload(self, name, content):
+        return self.client.put(self.url, {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def _cases(self):
+        return list(ProblemTestCase.objects.filter(problem=self.problem).order_by('ordinal').values_list('ordinal', 'input', 'output'))
+
+    def test_jsonl_import_and_export(self):
+        lines = [json.dumps({"input": f"{i} {i}", "output": str(2 * i)}) for i in range(1, 251)]
+        response = self._upload('cases.jsonl', '\n'.join(lines).encode('utf-8'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['testcases']['created'], 250)
+        self.assertEqual(self._cases()[-1], (250, '250 250', '500'))
+
+        response = self.client.get(self.url)
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(len(exported), 250)
+        self.assertEqual(exported[0], {"ordinal": 1, "title": "", "input": "1 1", "output": "2"})
+
+    def test_zip_round_trip(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as file:
+            for i in (10, 2, 1):
+                file.writestr(f'cases/{i}.in', f'{i} {i}')
+                file.writestr(f'cases/{i}.out', str(2 * i))
+        response = self._upload('cases.zip', archive.getvalue())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._cases(), [(1, '1 1', '2'), (2, '2 2', '4'), (3, '10 10', '20')])
+
+        response = self.client.get(self.url, {'type': 'zip'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as file:
+            self.assertEqual(sorted(file.namelist()), ['1.in', '1.out', '2.in', '2.out', '3.in', '3.out'])
+            self.assertEqual(file.read('3.out'), b'20')
+
+    @override_settings(JUDGE_TEST_CASE_MAX_SIZE=8)
+    def test_invalid_upload_keeps_existing_test_cases(self):
+        ProblemTestCase.objects.create(problem=self.problem, ordinal=1, input='1 1', output='2')
+        lines = [json.dumps({"input": "1 1", "output": "2"}), json.dumps({"input": "x" * 9, "output": "2"})]
+        response = self._upload('cases.jsonl', '\n'.join(lines).encode('utf-8'))
+        self.assertEqual(response.status_code, 400)
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as file:
+            file.writestr('1.in', '1 1')
+        response = self._upload('cases.zip', archive.getvalue())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._cases(), [(1, '1 1', '2')])
+
+
+class ProblemTestCaseUpdateTests(TestCase):
+    def setUp(self):
+        self.teacher = CustomUser.objects.create_user(username='teacher', full_name='Teacher', password='password', is_teacher=True)
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        ProblemDesign.objects.create(problem=self.problem, designer=self.teacher)
+        self.cases = [ProblemTestCase.objects.create(problem=self.problem, ordinal=i, input=f'{i} {i}', output=str(2 * i)) for i in range(1, 4)]
+        submission = Submission.objects.create(user=self.teacher, problem=self.problem, src='', lang='Python3')
+        for case in self.cases:
+            TestCaseResult.objects.create(submission=submission, test_case=case, result=TestCaseResult.ResultCode.SUCCESS,
+                                          cpu_time=1, real_time=1, memory=1, exit_code=0, signal=0, error=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def test_only_changed_test_cases_are_written(self):
+        testcases = [
+            {"input": "1 1", "output": "2"},
+            {"input": "2 2", "output": "4", "title": "renamed"},
+            {"input": "3 3", "output": "7"},
+            {"input": "4 4", "output": "8"},
+        ]
+        response = self.client.put(f'/design/problems/{self.problem.id}/', {"testcases": testcases}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['testcases'], {"created": 1, "updated": 2, "deleted": 0, "unchanged": 1})
+        stored = list(ProblemTestCase.objects.filter(problem=self.problem).order_by('ordinal'))
+        self.assertEqual([case.id for case in stored[:3]], [case.id for case in self.cases])
+        self.assertEqual((stored[1].title, stored[2].output), ('renamed', '7'))
+        self.assertEqual(TestCaseResult.objects.count(), 3)
+
+        response = self.client.put(f'/design/problems/{self.problem.id}/', {"testcases": testcases[:1]}, format='json')
+        self.assertEqual(response.data['testcases'], {"created": 0, "updated": 0, "deleted": 3, "unchanged": 1})
+        self.assertEqual(TestCaseResult.objects.count(), 1)
@@ -6,6 +6,7 @@ app_name = "design"
 urlpatterns = [
     path("problems/", views.ProblemView.as_view(), name="problems"),
     path("problems/<int:problem_id>/", views.ProblemView.as_view(), name="problem_detail"),
+    path("problems/<int:problem_id>/testcases/", views.ProblemTestCaseView.as_view(), name="problem_testcases"),
     path("problem-lists/", views.ProblemListView.as_view(), name="problem_lists"),
     path("problem-lists/<int:problem_list_id>/", views.ProblemListView.as_view(), name="problem_list_detail"),
 ]
\ No newline at end of file
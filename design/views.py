@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import transaction, models
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework.views import APIView
@@ -6,8 +8,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser, FormParser
 
 from accounts.permissions import IsTeacher
+from judge.judging import compile_spj
+from judge.testcases import TestCaseImportError, export_test_cases, update_test_cases, parse_test_cases_jsonl, parse_test_cases_zip, stream_test_cases_jsonl, stream_test_cases_zip
 from .models import Problem, TestCase, ProblemDesign, ProblemList, ProblemListItem
 from .serializers import ProblemSerializer, TestCaseSerializer, ProblemDesignSerializer, ProblemListSerializer, ProblemListItemSerializer
 
@@ -26,7 +31,7 @@ class ProblemView(APIView):
             }
             return Response(data, status=status.HTTP_200_OK)
         else:
-            problems = Problem.objects.filter(models.Q(design__isnull=True) | models.Q(design__is_public=True) | models.Q(design__designer=request.user))
+            problems = Problem.objects.select_related('stats').filter(models.Q(design__isnull=True) | models.Q(design__is_public=True) | models.Q(design__designer=request.user))
 
             if 'public' in request.query_params:
                 problems = problems.filter(models.Q(design__is_public=True))
@@ -84,17 +89,20 @@ class ProblemView(APIView):
             if not testcases_serializer.is_valid():
                 return Response({"error": "Invalid test cases data.", "details": testcases_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+        spj_src = problem_serializer.validated_data.get('spj_src')
+        if spj_src:
+            spj_error = compile_spj(spj_src)
+            if spj_error:
+                return Response({"error": "Failed to compile the special judge.", "details": spj_error}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
             with transaction.atomic():
                 problem_instance = problem_serializer.save()
                 design_serializer.save(problem=problem_instance, designer=request.user)
 
                 if testcases_data:
-                    testcases = [
-                        TestCase(problem=problem_instance, ordinal=index, **testcase_data)
-                        for index, testcase_data in enumerate(testcases_serializer.validated_data, start=1)
-                    ]
-                    TestCase.objects.bulk_create(testcases)
+                    update_test_cases(problem_instance, testcases_serializer.validated_data)
+                    export_test_cases(problem_instance)
 
         except Exception as e:
             return Response({"error": "An error occurred while creating problem, design, and test cases.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -108,6 +116,8 @@ class ProblemView(APIView):
         problem_data = request.data.get('problem')
         design_data = request.data.get('design')
         testcases_data = request.data.get('testcases')
+        testcases_changes = None
+        spj_version = problem.spj_version
         
         if design.designer != request.user and not request.user.is_superuser:
             return Response({"error": "You do not have permission to update this problem."}, status=status.HTTP_403_FORBIDDEN)
@@ -118,6 +128,11 @@ class ProblemView(APIView):
                     problem_serializer = ProblemSerializer(problem, data=problem_data, partial=True)
                     if not problem_serializer.is_valid():
                         return Response({"error": "Invalid problem data.", "details": problem_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+                    spj_src = problem_serializer.validated_data.get('spj_src')
+                    if spj_src and spj_src != problem.spj_src:
+                        spj_error = compile_spj(spj_src)
+                        if spj_error:
+                            return Response({"error": "Failed to compile the special judge.", "details": spj_error}, status=status.HTTP_400_BAD_REQUEST)
                     problem_serializer.save()
                 
                 if design_data:
@@ -131,13 +146,12 @@ class ProblemView(APIView):
                     if not testcases_serializer.is_valid():
                         return Response({"error": "Invalid test cases data.", "details": testcases_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
                     
-                    old_testcases = TestCase.objects.filter(problem=problem)
-                    old_testcases.delete()
-                    new_testcases = [
-                        TestCase(problem=problem, ordinal=index, **testcase_data)
-                        for index, testcase_data in enumerate(testcases_serializer.validated_data, start=1)
-                    ]
-                    TestCase.objects.bulk_create(new_testcases)
+                    # 只改动有变化的测试用例，没变的测试用例及其历史测试结果保持不变
+                    testcases_changes = update_test_cases(problem, testcases_serializer.validated_data)
+                    export_test_cases(problem)
+                elif problem.spj_version != spj_version:
+                    # 开关特判后，判题机上的测试用例目录也要跟着换
+                    export_test_cases(problem)
                 
                 problem.updated_at = timezone.now()
                 problem.save()
@@ -145,7 +159,7 @@ class ProblemView(APIView):
         except Exception as e:
             return Response({"error": "An error occurred while updating the problem.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        return Response({"message": "Problem, design, and test cases updated successfully."}, status=status.HTTP_200_OK)
+        return Response({"message": "Problem, design, and test cases updated successfully.", "testcases": testcases_changes}, status=status.HTTP_200_OK)
     
     def delete(self, request, problem_id):
         problem = get_object_or_404(Problem, id=problem_id)
@@ -163,6 +177,57 @@ class ProblemView(APIView):
         return Response({"message": "Problem deleted successfully."}, status=status.HTTP_200_OK)
 
 
+class ProblemTestCaseView(APIView):
+    """测试用例的批量导入导出，支持 zip（1.in、1.out、...）和 JSONL（每行一个测试用例）两种格式"""
+    permission_classes = [IsAuthenticated, IsTeacher]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def get(self, request, problem_id):
+        problem = get_object_or_404(Problem, id=problem_id)
+        test_cases = TestCase.objects.filter(problem=problem).order_by('ordinal')
+
+        if request.query_params.get('type') == 'zip':
+            response = StreamingHttpResponse(stream_test_cases_zip(test_cases), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="problem-{problem.id}-testcases.zip"'
+        else:
+            response = StreamingHttpResponse(stream_test_cases_jsonl(test_cases), content_type='application/x-ndjson')
+            response['Content-Disposition'] = f'attachment; filename="problem-{problem.id}-testcases.jsonl"'
+        return response
+
+    def put(self, request, problem_id):
+        problem = get_object_or_404(Problem, id=problem_id)
+        design = get_object_or_404(ProblemDesign, problem=problem)
+
+        if design.designer != request.user and not request.user.is_superuser:
+            return Response({"error": "You do not have permission to update this problem."}, status=status.HTTP_403_FORBIDDEN)
+
+        file = request.FILES.get('file')
+        if not file:
+            return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if file.size > settings.JUDGE_TEST_CASE_MAX_UPLOAD_SIZE:
+            return Response({"error": f"File is larger than {settings.JUDGE_TEST_CASE_MAX_UPLOAD_SIZE} bytes"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if file.name.endswith('.zip'):
+            test_cases = parse_test_cases_zip(file)
+        elif file.name.endswith(('.jsonl', '.ndjson')):
+            test_cases = parse_test_cases_jsonl(file)
+        else:
+            return Response({"error": "Only .zip and .jsonl files are supported"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                changes = update_test_cases(problem, test_cases)
+                export_test_cases(problem)
+                problem.save()
+
+        except TestCaseImportError as e:
+            return Response({"error": "Invalid test cases file.", "details": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": "An error occurred while importing test cases.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({"testcases": changes, "message": "Test cases imported successfully."}, status=status.HTTP_200_OK)
+
+
 class ProblemListView(APIView):
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -175,7 +240,7 @@ class ProblemListView(APIView):
             problem_list = get_object_or_404(ProblemList, id=problem_list_id)
             data = {
                 "problem_list": ProblemListSerializer(problem_list).data,
-                "items": ProblemListItemSerializer(ProblemListItem.objects.filter(problem_list=problem_list).order_by('ordinal'), many=True).data,
+                "items": ProblemListItemSerializer(ProblemListItem.objects.filter(problem_list=problem_list).select_related('problem__stats').order_by('ordinal'), many=True).data,
             }
             return Response(data, status=status.HTTP_200_OK)
         else:
@@ -205,7 +270,7 @@ class ProblemListView(APIView):
             data = [
                 {
                     "problem_list": ProblemListSerializer(problem_list).data,
-                    "items": ProblemListItemSerializer(ProblemListItem.objects.filter(problem_list=problem_list).order_by('ordinal'), many=True).data,
+                    "items": ProblemListItemSerializer(ProblemListItem.objects.filter(problem_list=problem_list).select_related('problem__stats').order_by('ordinal'), many=True).data,
                 }
                 for problem_list in paginated_problem_lists
             ]
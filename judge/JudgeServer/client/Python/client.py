@@ -3,12 +3,13 @@ Copyright (c) <Qingdao University Online Judge Dev Team> <info@qduoj.com>
 This file is derived from JudgeServer (https://github.com/QingdaoU/JudgeServer)
 Original License: The Star And Thank Author License (SATA)
 Referenced on: 2025-03-22
-Modifications: None
+Modifications: requests go through a pooled keep-alive session with timeouts
 """
 import hashlib
 import json
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .languages import c_lang_config, cpp_lang_config, java_lang_config, c_lang_spj_config, c_lang_spj_compile, py2_lang_config, py3_lang_config, go_lang_config, php_lang_config, js_lang_config
 
@@ -17,30 +18,23 @@ class JudgeServerClientError(Exception):
     pass
 
 
-class JudgeServerClient(object):
-    def __init__(self, token, server_base_url):
+class BaseJudgeServerClient(object):
+    def __init__(self, token, server_base_url, pool_size=10, timeout=None):
         self.token = hashlib.sha256(token.encode("utf-8")).hexdigest()
         self.server_base_url = server_base_url.rstrip("/")
-
-    def _request(self, url, data=None):
-        kwargs = {"headers": {"X-Judge-Server-Token": self.token,
-                              "Content-Type": "application/json"}}
-        if data:
-            kwargs["data"] = json.dumps(data)
-        try:
-            return requests.post(url, **kwargs).json()
-        except Exception as e:
-            raise JudgeServerClientError(str(e))
-
-    def ping(self):
-        return self._request(self.server_base_url + "/ping")
-
-    def judge(self, src, language_config, max_cpu_time, max_memory, test_case_id=None, test_case=None, spj_version=None, spj_config=None,
-              spj_compile_config=None, spj_src=None, output=False):
+        self.pool_size = pool_size
+        # (connect timeout, read timeout)，判题可能较慢，所以读超时要留足
+        self.timeout = timeout
+        self.headers = {"X-Judge-Server-Token": self.token,
+                        "Content-Type": "application/json"}
+
+    @staticmethod
+    def _judge_data(src, language_config, max_cpu_time, max_memory, test_case_id=None, test_case=None, spj_version=None, spj_config=None,
+                    spj_compile_config=None, spj_src=None, output=False):
         if not (test_case or test_case_id) or (test_case and test_case_id):
             raise ValueError("invalid parameter")
 
-        data = {"language_config": language_config,
+        return {"language_config": language_config,
                 "src": src,
                 "max_cpu_time": max_cpu_time,
                 "max_memory": max_memory,
@@ -51,13 +45,46 @@ class JudgeServerClient(object):
                 "spj_compile_config": spj_compile_config,
                 "spj_src": spj_src,
                 "output": output}
+
+    @staticmethod
+    def _compile_spj_data(src, spj_version, spj_compile_config):
+        return {"src": src, "spj_version": spj_version,
+                "spj_compile_config": spj_compile_config}
+
+
+class JudgeServerClient(BaseJudgeServerClient):
+    def __init__(self, token, server_base_url, pool_size=10, timeout=None):
+        super().__init__(token, server_base_url, pool_size=pool_size, timeout=timeout)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, url, data=None):
+        body = json.dumps(data) if data else None
+        try:
+            return self.session.post(url, data=body, timeout=self.timeout).json()
+        except Exception as e:
+            raise JudgeServerClientError(str(e))
+
+    def ping(self):
+        return self._request(self.server_base_url + "/ping")
+
+    def judge(self, src, language_config, max_cpu_time, max_memory, test_case_id=None, test_case=None, spj_version=None, spj_config=None,
+              spj_compile_config=None, spj_src=None, output=False):
+        data = self._judge_data(src, language_config, max_cpu_time, max_memory, test_case_id=test_case_id, test_case=test_case,
+                                spj_version=spj_version, spj_config=spj_config, spj_compile_config=spj_compile_config,
+                                spj_src=spj_src, output=output)
         return self._request(self.server_base_url + "/judge", data=data)
 
     def compile_spj(self, src, spj_version, spj_compile_config):
-        data = {"src": src, "spj_version": spj_version,
-                "spj_compile_config": spj_compile_config}
+        data = self._compile_spj_data(src, spj_version, spj_compile_config)
         return self._request(self.server_base_url + "/compile_spj", data=data)
 
+    def close(self):
+        self.session.close()
+
 
 if __name__ == "__main__":
     token = "YOUR_TOKEN_HERE"
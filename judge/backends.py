@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+from .JudgeServer.client.Python.client import JudgeServerClient, JudgeServerClientError
+
+logger = logging.getLogger(__name__)
+
+
+class SpjCompileError(Exception):
+    """特判程序本身编译失败，换哪台判题机都一样，不重试"""
+    pass
+
+
+class JudgeNode:
+    def __init__(self, client):
+        self.client = client
+        self.healthy = True
+        self.in_flight = 0
+        # 以下数据来自判题机的 /ping
+        self.cpu = 0  # 百分比
+        self.memory = 0  # 百分比
+        self.cpu_core = 1
+        # 已经在这台判题机上编译好的特判程序版本
+        self.spj_versions = set()
+
+    def __str__(self):
+        return self.client.server_base_url
+
+    @property
+    def load(self):
+        # 正在跑的任务按核数摊开，再叠加判题机自己报告的 CPU 和内存占用
+        return (self.in_flight + 1) / max(self.cpu_core, 1) + self.cpu / 100 + self.memory / 100
+
+    def update(self, ping):
+        if ping.get("err"):
+            raise JudgeServerClientError(ping.get("data"))
+        data = ping.get("data") or {}
+        self.cpu = data.get("cpu", 0) or 0
+        self.memory = data.get("memory", 0) or 0
+        self.cpu_core = data.get("cpu_core", 1) or 1
+        if not self.healthy:
+            # 判题机可能重启过，之前编译好的特判程序不一定还在
+            self.spj_versions.clear()
+        self.healthy = True
+
+    def to_dict(self):
+        return {
+            "url": str(self),
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "cpu": self.cpu,
+            "memory": self.memory,
+            "cpu_core": self.cpu_core,
+        }
+
+
+class JudgeBackendRegistry:
+    """
+    管理多台 JudgeServer：定时 ping 每一台，把请求派给最空闲的健康节点，
+    请求中途失败（连接错误、超时）时换一台节点重试。
+    对外提供与 JudgeServerClient 相同的 ping / judge / compile_spj 接口。
+    """
+    def __init__(self, token, server_base_urls, pool_size=10, timeout=None, health_check_interval=5, retries=1):
+        self.nodes = [JudgeNode(JudgeServerClient(token, url, pool_size=pool_size, timeout=timeout)) for url in server_base_urls]
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._health_checker = None
+
+    def check_health(self):
+        for node in self.nodes:
+            try:
+                node.update(node.client.ping())
+            except JudgeServerClientError as e:
+                if node.healthy:
+                    logger.warning("Judge server %s is unhealthy: %s", node, e)
+                node.healthy = False
+
+    def _run_health_checker(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_check_interval)
+
+    def _ensure_health_checker(self):
+        if self._health_checker or self.health_check_interval <= 0:
+            return
+        with self._lock:
+            if not self._health_checker:
+                self._health_checker = threading.Thread(target=self._run_health_checker, name='judge-health-checker', daemon=True)
+                self._health_checker.start()
+
+    def _acquire(self, exclude):
+        with self._lock:
+            candidates = [node for node in self.nodes if node not in exclude]
+            # 所有节点都不健康时，健康状态可能已经过时了，仍然尝试一下
+            candidates = [node for node in candidates if node.healthy] or candidates
+            if not candidates:
+                return None
+            node = min(candidates, key=lambda node: node.load)
+            node.in_flight += 1
+            return node
+
+    def _release(self, node):
+        with self._lock:
+            node.in_flight -= 1
+
+    def dispatch(self, method, *args, prepare=None, **kwargs):
+        """prepare(node) 会在选定节点之后、发出请求之前调用，用来在该节点上做准备工作"""
+        self._ensure_health_checker()
+        tried = []
+        last_error = None
+        for _ in range(self.retries + 1):
+            node = self._acquire(exclude=tried)
+            if node is None:
+                break
+            tried.append(node)
+            try:
+                if prepare:
+                    prepare(node)
+                return getattr(node.client, method)(*args, **kwargs)
+            except JudgeServerClientError as e:
+                logger.warning("Judge server %s failed, retrying on another node: %s", node, e)
+                node.healthy = False
+                last_error = e
+            finally:
+                self._release(node)
+        raise JudgeServerClientError(str(last_error) if last_error else "No judge server available")
+
+    def ping(self):
+        return self.dispatch("ping")
+
+    def judge(self, *args, spj_src=None, spj_compile_config=None, **kwargs):
+        """
+        带特判时，先确保选中的节点上已经编译过这个版本的特判程序，
+        之后的判题请求只带 spj_version 和 spj_config，不再每次发送特判程序的源代码。
+        """
+        prepare = None
+        if spj_src and kwargs.get("spj_version"):
+            prepare = lambda node: self._prepare_spj(node, spj_src, kwargs["spj_version"], spj_compile_config)
+        return self.dispatch("judge", *args, prepare=prepare, **kwargs)
+
+    def compile_spj(self, *args, **kwargs):
+        return self.dispatch("compile_spj", *args, **kwargs)
+
+    def _prepare_spj(self, node, src, spj_version, spj_compile_config):
+        if spj_version in node.spj_versions:
+            return
+        result = node.client.compile_spj(src=src, spj_version=spj_version, spj_compile_config=spj_compile_config)
+        if result.get("err"):
+            raise SpjCompileError(result.get("data"))
+        node.spj_versions.add(spj_version)
+
+    def broadcast_compile_spj(self, src, spj_version, spj_compile_config):
+        """在每台判题机上编译特判程序；连不上的节点跳过，等它判题时再编译"""
+        for node in self.nodes:
+            try:
+                self._prepare_spj(node, src, spj_version, spj_compile_config)
+            except JudgeServerClientError as e:
+                logger.warning("Failed to compile special judge on %s: %s", node, e)
+
+    def status(self):
+        return [node.to_dict() for node in self.nodes]
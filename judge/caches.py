@@ -0,0 +1,107 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import TestCaseResult
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CacheCounter:
+    """记录缓存命中/未命中次数，存在 Django 的缓存里，多进程部署时配合共享缓存使用"""
+    def __init__(self, name):
+        self.name = name
+
+    def _incr(self, key):
+        key = f'judge:counter:{self.name}:{key}'
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=None)
+
+    def hit(self):
+        self._incr('hits')
+
+    def miss(self):
+        self._incr('misses')
+
+    def stats(self):
+        hits = cache.get(f'judge:counter:{self.name}:hits', 0)
+        misses = cache.get(f'judge:counter:{self.name}:misses', 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else None}
+
+
+class CompileCache:
+    """
+    以 (语言, 源代码 hash, 编译配置) 为键，缓存编译结果。
+    JudgeServer 每次 /judge 都会重新编译，这里能省下的是编译失败的那部分：
+    同一份编译不通过的代码反复点“运行”时，直接返回缓存的编译错误，不再占用判题机。
+    """
+    def __init__(self):
+        self.counter = CacheCounter('compile')
+
+    @staticmethod
+    def _key(src, lang_config):
+        compile_config = json.dumps(lang_config.get("compile"), sort_keys=True)
+        return f'judge:compile:{_hash(compile_config, src)}'
+
+    def get(self, src, lang_config):
+        if not lang_config.get("compile"):
+            return None
+        result = cache.get(self._key(src, lang_config))
+        if result is None:
+            self.counter.miss()
+        else:
+            self.counter.hit()
+        return result
+
+    def set(self, src, lang_config, judge):
+        if lang_config.get("compile") and judge.get("err") == "CompileError":
+            cache.set(self._key(src, lang_config), {"err": judge.get("err"), "data": judge.get("data")}, timeout=settings.JUDGE_COMPILE_CACHE_TTL)
+
+
+class VerdictCache:
+    """
+    以 (测试用例版本, 语言, 资源限制, 规范化后的源代码 hash) 为键，缓存判题机返回的完整判题结果。
+    同一份代码再次提交时，直接用缓存的结果生成 Submission 和 TestCaseResult，不再调用判题机。
+    """
+    def __init__(self):
+        self.counter = CacheCounter('verdict')
+
+    @staticmethod
+    def normalize_src(src):
+        # 只统一换行符；行尾空白、空行都可能改变程序的含义（如三引号字符串、反斜杠续行）或报错的行号，保持原样
+        return src.replace('\r\n', '\n').replace('\r', '\n')
+
+    def _key(self, test_case_version, lang, src, max_cpu_time, max_memory):
+        return f'judge:verdict:{_hash(test_case_version, lang, str(max_cpu_time), str(max_memory), self.normalize_src(src))}'
+
+    def get(self, test_case_version, lang, src, max_cpu_time, max_memory):
+        judge = cache.get(self._key(test_case_version, lang, src, max_cpu_time, max_memory))
+        if judge is None:
+            self.counter.miss()
+        else:
+            self.counter.hit()
+        return judge
+
+    def set(self, test_case_version, lang, src, max_cpu_time, max_memory, judge):
+        # 判题机自身出错的结果不能复用
+        if judge.get("err") not in (None, "CompileError"):
+            return
+        if not judge.get("err") and any(result.get("result") == TestCaseResult.ResultCode.SYSTEM_ERROR for result in judge.get("data", [])):
+            return
+        cache.set(self._key(test_case_version, lang, src, max_cpu_time, max_memory), judge, timeout=settings.JUDGE_VERDICT_CACHE_TTL)
+
+
+COMPILE_CACHE = CompileCache()
+VERDICT_CACHE = VerdictCache()
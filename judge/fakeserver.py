@@ -0,0 +1,190 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .models import TestCaseResult
+
+# 判题结论的名字，命令行里用 accepted=90,wrong_answer=10 这样的写法指定分布
+VERDICTS = {
+    "accepted": TestCaseResult.ResultCode.SUCCESS,
+    "wrong_answer": TestCaseResult.ResultCode.WRONG_ANSWER,
+    "cpu_time_limit_exceeded": TestCaseResult.ResultCode.CPU_TIME_LIMIT_EXCEEDED,
+    "real_time_limit_exceeded": TestCaseResult.ResultCode.REAL_TIME_LIMIT_EXCEEDED,
+    "memory_limit_exceeded": TestCaseResult.ResultCode.MEMORY_LIMIT_EXCEEDED,
+    "runtime_error": TestCaseResult.ResultCode.RUNTIME_ERROR,
+    "system_error": TestCaseResult.ResultCode.SYSTEM_ERROR,
+    # 整份代码编译失败
+    "compile_error": None,
+}
+
+
+def parse_verdicts(value):
+    """把 "accepted=90,wrong_answer=10" 解析成 {"accepted": 90, "wrong_answer": 10}"""
+    weights = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in VERDICTS:
+            raise ValueError(f"Unknown verdict: {name}")
+        weights[name] = float(weight) if weight else 1
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("At least one verdict must have a positive weight")
+    return weights
+
+
+class JudgeError(Exception):
+    """判题机返回的整体性错误，如编译失败"""
+    def __init__(self, err, data):
+        super().__init__(data)
+        self.err = err
+        self.data = data
+
+
+class FakeJudgeServer(ThreadingHTTPServer):
+    """
+    本地的假判题机，实现 JudgeServer 的 /ping、/judge、/compile_spj 接口，不真正编译和运行代码，
+    用于在没有 Docker 判题机的环境里做压测和测试。
+    每个请求先等待 latency + 测试用例数 × case_latency 毫秒（上下浮动 jitter 的比例），
+    每个测试用例的结论按 verdicts 给出的权重随机抽取；编译失败的结论作用于整份代码。
+    """
+    daemon_threads = True
+
+    def __init__(self, address, token, latency=0, case_latency=0, jitter=0, verdicts=None, test_case_count=1, seed=None):
+        super().__init__(address, FakeJudgeRequestHandler)
+        self.token = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        self.latency = latency
+        self.case_latency = case_latency
+        self.jitter = jitter
+        self.verdicts = verdicts or {"accepted": 1}
+        # 只传 test_case_id 时不知道测试用例有几个，按这个数目返回结果
+        self.test_case_count = test_case_count
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.running_task_count = 0
+        self.spj_versions = set()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程里处理请求，返回该线程"""
+        thread = threading.Thread(target=self.serve_forever, name="fake-judge-server", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _random(self, method, *args):
+        # random.Random 本身不是线程安全的
+        with self._lock:
+            return getattr(self.random, method)(*args)
+
+    def sleep(self, case_count):
+        delay = self.latency + case_count * self.case_latency
+        if self.jitter:
+            delay *= self._random("uniform", 1 - self.jitter, 1 + self.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def choose_verdict(self):
+        names = list(self.verdicts)
+        return self._random("choices", names, [self.verdicts[name] for name in names])[0]
+
+    def ping(self, data):
+        return {
+            "judger_version": "fake",
+            "hostname": "fake-judge-server",
+            "cpu_core": 1,
+            "cpu": 0,
+            "memory": 0,
+            "running_task_count": self.running_task_count,
+        }
+
+    def compile_spj(self, data):
+        self.sleep(0)
+        self.spj_versions.add(data.get("spj_version"))
+        return "success"
+
+    def judge(self, data):
+        test_case = data.get("test_case")
+        cases = test_case if test_case else [{"input": "", "output": ""}] * self.test_case_count
+        if data.get("spj_version") and data.get("spj_version") not in self.spj_versions:
+            if not data.get("spj_src"):
+                raise JudgeError("SPJCompileError", "spj compile error")
+            self.spj_versions.add(data.get("spj_version"))
+
+        self.sleep(len(cases))
+        verdicts = [self.choose_verdict() for _ in cases]
+        if "compile_error" in verdicts:
+            raise JudgeError("CompileError", "fake compile error")
+
+        results = []
+        for i, (case, verdict) in enumerate(zip(cases, verdicts)):
+            result = VERDICTS[verdict]
+            max_cpu_time = data.get("max_cpu_time") or 1000
+            max_memory = data.get("max_memory") or 128 * 1024 * 1024
+            cpu_time = self._random("randint", 1, max(max_cpu_time // 4, 1))
+            memory = self._random("randint", 8 * 1024 * 1024, max(max_memory // 4, 8 * 1024 * 1024))
+            if result == TestCaseResult.ResultCode.CPU_TIME_LIMIT_EXCEEDED:
+                cpu_time = max_cpu_time + 1
+            elif result == TestCaseResult.ResultCode.MEMORY_LIMIT_EXCEEDED:
+                memory = max_memory + 1
+            output = case.get("output", "") if result == TestCaseResult.ResultCode.SUCCESS else ""
+            results.append({
+                "cpu_time": cpu_time,
+                "real_time": cpu_time + 1,
+                "memory": memory,
+                "signal": 9 if result == TestCaseResult.ResultCode.RUNTIME_ERROR else 0,
+                "exit_code": 0,
+                "error": 0,
+                "result": result,
+                "test_case": str(i + 1),
+                "output_md5": hashlib.md5(output.encode("utf-8")).hexdigest(),
+                "output": output if data.get("output") else None,
+            })
+        return results
+
+
+class FakeJudgeRequestHandler(BaseHTTPRequestHandler):
+    # 保持长连接，和真实的判题机一样可以复用连接池
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        handler = {"/ping": self.server.ping, "/judge": self.server.judge, "/compile_spj": self.server.compile_spj}.get(self.path)
+        if handler is None:
+            self.send_error(404)
+            return
+
+        if self.headers.get("X-Judge-Server-Token") != self.server.token:
+            response = {"err": "InvalidToken", "data": "invalid token"}
+        else:
+            with self.server._lock:
+                self.server.running_task_count += 1
+            try:
+                response = {"err": None, "data": handler(json.loads(body) if body else {})}
+            except JudgeError as e:
+                response = {"err": e.err, "data": e.data}
+            finally:
+                with self.server._lock:
+                    self.server.running_task_count -= 1
+
+        content = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
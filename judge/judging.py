@@ -0,0 +1,349 @@
+import difflib
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import Problem, Submission, TestCase, TestCaseResult, ProblemStats
+from .backends import JudgeBackendRegistry, SpjCompileError
+from .caches import COMPILE_CACHE, VERDICT_CACHE
+from .scheduler import SCHEDULER, JudgeScheduler, get_submission_priority
+from .serializers import TestCaseResultSerializer
+from .testcases import get_test_case_version
+from .JudgeServer.client.Python.client import JudgeServerClientError
+from .JudgeServer.client.Python.languages import c_lang_spj_config, c_lang_spj_compile, c_lang_config, cpp_lang_config, java_lang_config, py2_lang_config, py3_lang_config, go_lang_config, php_lang_config, js_lang_config
+
+# Load environment variables from .env file
+load_dotenv(override=True)
+# JUDGE_SERVER_BASE_URL 可以用逗号分隔多台判题机
+JUDGE_SERVER_BASE_URLS = [url.strip() for url in os.getenv("JUDGE_SERVER_BASE_URL", "").split(",") if url.strip()]
+CLIENT = JudgeBackendRegistry(token=os.getenv("JUDGE_SERVER_TOKEN"), server_base_urls=JUDGE_SERVER_BASE_URLS,
+                              pool_size=settings.JUDGE_CLIENT_POOL_SIZE, timeout=settings.JUDGE_CLIENT_TIMEOUT,
+                              health_check_interval=settings.JUDGE_HEALTH_CHECK_INTERVAL, retries=settings.JUDGE_DISPATCH_RETRIES)
+
+
+# 各语言相对于题目限制的时间倍数；运行在虚拟机/解释器上的语言需要更宽松的时间
+LANGUAGES = {
+    "C": (c_lang_config, 1),
+    "C++": (cpp_lang_config, 1),
+    "Java": (java_lang_config, 2),
+    "Python2": (py2_lang_config, 3),
+    "Python3": (py3_lang_config, 3),
+    "Go": (go_lang_config, 1),
+    "PHP": (php_lang_config, 3),
+    "JavaScript": (js_lang_config, 3),
+}
+
+
+def get_lang_config(lang):
+    config, _ = LANGUAGES.get(lang, (None, None))
+    return config
+
+
+def get_limits(problem, lang):
+    """返回 (max_cpu_time, max_memory)，单位分别是 ms 和 byte"""
+    config, time_factor = LANGUAGES.get(lang, (None, 1))
+    # memory_limit_check_only 的语言（Java、Go、PHP、JavaScript）运行时自身就要占用不少内存，给双倍
+    memory_factor = 2 if config and config["run"].get("memory_limit_check_only") else 1
+    return problem.time_limit * time_factor, problem.memory_limit * memory_factor * 1024 * 1024
+
+
+def get_spj_kwargs(problem):
+    """题目配置了特判程序时，判题需要额外传入的参数"""
+    if not problem.spj_version:
+        return {}
+    return {
+        "spj_version": problem.spj_version,
+        "spj_config": c_lang_spj_config,
+        "spj_compile_config": c_lang_spj_compile,
+        "spj_src": problem.spj_src,
+    }
+
+
+def compile_spj(spj_src):
+    """保存题目时先在每台判题机上编译特判程序，返回编译错误信息，编译通过时返回 None"""
+    try:
+        CLIENT.broadcast_compile_spj(spj_src, Problem.get_spj_version(spj_src), c_lang_spj_compile)
+    except SpjCompileError as e:
+        return str(e)
+    return None
+
+
+def run_judge(src, lang_config, priority=None, use_cache=True, **kwargs):
+    """
+    调用判题机；编译失败过的同一份代码直接返回缓存的编译错误，use_cache 为 False 时总是重新编译。
+    priority 为 (通道, 班级)，决定在 SCHEDULER 里排队的先后，默认按普通提交处理。
+    """
+    judge = COMPILE_CACHE.get(src, lang_config) if use_cache else None
+    if judge is None:
+        lane, group = priority or (JudgeScheduler.GRADED, None)
+        with SCHEDULER.slot(lane, group):
+            judge = CLIENT.judge(src=src, language_config=lang_config, **kwargs)
+        COMPILE_CACHE.set(src, lang_config, judge)
+    return judge
+
+
+SHARD_EXECUTOR = ThreadPoolExecutor(max_workers=settings.JUDGE_SHARD_WORKERS, thread_name_prefix='judge-shard')
+
+
+def run_judge_sharded(src, lang_config, test_case, shard_size, on_shard=None, **kwargs):
+    """
+    把测试用例切成若干份，并发地交给多台判题机去判，再按原顺序合并结果。
+    任何一份出现编译错误等整体性错误时，取消还没开始的分片，直接返回该错误。
+    每判完一份就调用 on_shard(起始下标, 这一份的结果)，便于边判边保存。
+    """
+    offsets = range(0, len(test_case), shard_size)
+    futures = {SHARD_EXECUTOR.submit(run_judge, src, lang_config, test_case=test_case[offset:offset + shard_size], **kwargs): offset for offset in offsets}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                judge = future.result()
+                if judge.get("err"):
+                    return judge
+                if on_shard:
+                    on_shard(futures[future], judge.get("data", []))
+    finally:
+        for future in pending:
+            future.cancel()
+
+    data = []
+    for future in futures:
+        data += future.result().get("data", [])
+    return {"err": None, "data": data}
+
+
+def claim_submission(submission_id):
+    """把 Pending 的提交原子地改为 Judging，只有改成功的 worker 才能判这份提交"""
+    # update() 不会自动更新 updated_at，这里显式记下领取的时间，用来判断 worker 是否已经退出
+    return Submission.objects.filter(id=submission_id, judge_status=Submission.JudgeStatus.PENDING).update(
+        judge_status=Submission.JudgeStatus.JUDGING, updated_at=timezone.now()) == 1
+
+
+def reset_stale_submissions():
+    """把领取后超过 JUDGE_STALE_TIMEOUT 秒仍没有判完的提交（领取它的 worker 多半已经退出）放回 Pending，返回放回的个数"""
+    stale_before = timezone.now() - timedelta(seconds=settings.JUDGE_STALE_TIMEOUT)
+    return Submission.objects.filter(judge_status=Submission.JudgeStatus.JUDGING, updated_at__lt=stale_before).update(
+        judge_status=Submission.JudgeStatus.PENDING, updated_at=timezone.now())
+
+
+def judge_submission(submission_id, record_stats=True, bulk=False, use_cache=True, claimed=False):
+    """
+    判一份 Pending 的提交。claimed 为 True 表示调用方已经把它改成了 Judging，不用再领取；
+    use_cache 为 False 时不复用缓存的判题结果和编译错误，重新判题就是为了在判题环境变化后真的再判一次。
+    """
+    if not claimed and not claim_submission(submission_id):
+        return
+
+    submission = Submission.objects.select_related('problem').get(id=submission_id)
+    test_case_id = submission.problem.test_case_id
+    test_cases = TestCase.objects.filter(problem_id=submission.problem_id).order_by('ordinal')
+    if test_case_id:
+        # 测试用例已经同步到判题机上了，只需要发送 id
+        test_cases = list(test_cases.only('id', 'ordinal'))
+        test = None
+    else:
+        test_cases = list(test_cases)
+        test = [{"input": case.input, "output": case.output} for case in test_cases]
+
+    max_cpu_time, max_memory = get_limits(submission.problem, submission.lang)
+    spj_kwargs = get_spj_kwargs(submission.problem)
+    test_case_version = test_case_id or get_test_case_version(test_cases)
+    if spj_kwargs:
+        # 特判程序变了，同一份代码的判题结果也可能不同
+        test_case_version = f'{test_case_version}:{submission.problem.spj_version}'
+    judge = VERDICT_CACHE.get(test_case_version, submission.lang, submission.src, max_cpu_time, max_memory) if use_cache else None
+    if judge is not None:
+        save_judge_result(submission, test_cases, judge, record_stats=record_stats)
+        return
+
+    results_saved = False
+    priority = get_submission_priority(submission, bulk=bulk)
+    lang_config = get_lang_config(submission.lang)
+    if not lang_config:
+        judge = {"err": "SystemError", "data": "Unsupported language"}
+    else:
+        try:
+            shard_size = settings.JUDGE_SHARD_SIZE
+            if shard_size and len(test_cases) > shard_size:
+                if test is None:
+                    # 判题机上的测试用例目录无法分片，这时改为随请求发送各个分片
+                    test = [{"input": case.input, "output": case.output} for case in TestCase.objects.filter(problem_id=submission.problem_id).order_by('ordinal')]
+
+                def save_shard(offset, data):
+                    # 每判完一份就先保存下来，流式接口可以立即把这些结果推送给学生
+                    if not submission.compiled:
+                        # 有分片判完，说明已经编译通过了
+                        submission.compiled = True
+                        Submission.objects.filter(id=submission.id).update(compiled=True)
+                    TestCaseResult.objects.bulk_create(build_test_case_results(submission, test_cases[offset:offset + len(data)], data))
+
+                judge = run_judge_sharded(
+                    src=submission.src,
+                    lang_config=lang_config,
+                    test_case=test,
+                    shard_size=shard_size,
+                    on_shard=save_shard,
+                    max_cpu_time=max_cpu_time,
+                    max_memory=max_memory,
+                    output=True,
+                    priority=priority,
+                    use_cache=use_cache,
+                    **spj_kwargs
+                )
+                results_saved = True
+            else:
+                judge = run_judge(
+                    src=submission.src,
+                    lang_config=lang_config,
+                    max_cpu_time=max_cpu_time,
+                    max_memory=max_memory,
+                    test_case_id=test_case_id,
+                    test_case=test,
+                    output=True,
+                    priority=priority,
+                    use_cache=use_cache,
+                    **spj_kwargs
+                )
+            VERDICT_CACHE.set(test_case_version, submission.lang, submission.src, max_cpu_time, max_memory, judge)
+        except JudgeServerClientError as e:
+            judge = {"err": "SystemError", "data": str(e)}
+        except SpjCompileError as e:
+            judge = {"err": "SPJCompileError", "data": str(e)}
+
+    save_judge_result(submission, test_cases, judge, results_saved=results_saved, record_stats=record_stats)
+
+
+def build_test_case_results(submission, test_cases, data):
+    return retain_output([
+        TestCaseResult(
+            submission=submission,
+            test_case=case,
+            result=result.get("result"),
+            cpu_time=result.get("cpu_time"),
+            real_time=result.get("real_time"),
+            memory=result.get("memory"),
+            output=result.get("output"),
+            exit_code=result.get("exit_code"),
+            signal=result.get("signal"),
+            error=result.get("error"),
+        )
+        for case, result in zip(test_cases, data)
+    ])
+
+
+def get_output_diff(expected, actual):
+    """只保留与预期输出第一处不同的地方附近的几行"""
+    lines = list(difflib.unified_diff(expected.rstrip().splitlines(), actual.rstrip().splitlines(), 'expected', 'actual', n=settings.JUDGE_OUTPUT_DIFF_CONTEXT, lineterm=''))
+    hunks = [i for i, line in enumerate(lines) if line.startswith('@@')]
+    if len(hunks) > 1:
+        lines = lines[:hunks[1]]
+    return '\n'.join(lines)[:settings.JUDGE_OUTPUT_MAX_LENGTH] or None
+
+
+def retain_output(test_case_results):
+    """
+    按配置精简要保存的程序输出：
+    通过的测试用例默认不保存输出；答案错误的额外保存一段 diff；
+    过长的输出截断保存，开启 JUDGE_OUTPUT_COMPRESS 时完整输出压缩后另存。
+    """
+    wrong = [result.test_case_id for result in test_case_results if result.result == TestCaseResult.ResultCode.WRONG_ANSWER]
+    expected = dict(TestCase.objects.filter(id__in=wrong).values_list('id', 'output')) if wrong else {}
+    for result in test_case_results:
+        if result.output is None:
+            continue
+        if result.result == TestCaseResult.ResultCode.SUCCESS and not settings.JUDGE_KEEP_ACCEPTED_OUTPUT:
+            result.output = None
+            continue
+        if result.result == TestCaseResult.ResultCode.WRONG_ANSWER:
+            result.output_diff = get_output_diff(expected.get(result.test_case_id, ''), result.output)
+        if len(result.output) > settings.JUDGE_OUTPUT_MAX_LENGTH:
+            if settings.JUDGE_OUTPUT_COMPRESS:
+                result.output_blob = zlib.compress(result.output.encode('utf-8'))
+            result.output = result.output[:settings.JUDGE_OUTPUT_MAX_LENGTH]
+            result.output_truncated = True
+    return test_case_results
+
+
+def save_judge_result(submission, test_cases, judge, results_saved=False, record_stats=True):
+    with transaction.atomic():
+        submission.total_count = len(test_cases)
+        submission.success_count = 0 if judge.get("err") else sum(result.get("result") == TestCaseResult.ResultCode.SUCCESS for result in judge.get("data", []))
+        submission.err = judge.get("err")
+        submission.error_reason = judge.get("data") if judge.get("err") else None
+        submission.compiled = get_compiled(judge)
+        submission.judge_status = Submission.JudgeStatus.FINISHED
+        submission.save()
+
+        if judge.get("err"):
+            # 分片判题时，出错之前判完的分片可能已经保存了
+            TestCaseResult.objects.filter(submission=submission).delete()
+        elif not results_saved:
+            TestCaseResult.objects.bulk_create(build_test_case_results(submission, test_cases, judge.get("data", [])))
+
+        if not record_stats:
+            return
+        data = [] if judge.get("err") else judge.get("data", [])
+        ProblemStats.record_submission(
+            submission,
+            get_verdict(judge),
+            cpu_time=max((result.get("cpu_time") or 0 for result in data), default=None),
+            memory=max((result.get("memory") or 0 for result in data), default=None),
+        )
+
+
+def get_compiled(judge):
+    """从判题结果里读出编译结果，其他错误（如判题机出错）时无法得知是否编译通过"""
+    if not judge.get("err"):
+        return True
+    if judge.get("err") == "CompileError":
+        return False
+    return None
+
+
+def get_verdict(judge):
+    """整份提交的结论：出错时为错误类型，否则为第一个没通过的测试用例的结果"""
+    if judge.get("err"):
+        return judge.get("err")
+    for result in judge.get("data", []):
+        if result.get("result") != TestCaseResult.ResultCode.SUCCESS:
+            return TestCaseResultSerializer.to_status(result.get("result"))
+    return "Accepted"
+
+
+def rebuild_problem_stats(problem):
+    """根据已有的提交重新计算一道题的统计"""
+    first_failure = TestCaseResult.objects.filter(submission=models.OuterRef('pk')).exclude(
+        result=TestCaseResult.ResultCode.SUCCESS).order_by('test_case__ordinal').values('result')[:1]
+    submissions = Submission.objects.filter(problem=problem, judge_status=Submission.JudgeStatus.FINISHED).annotate(
+        first_failure=models.Subquery(first_failure),
+        max_cpu_time=models.Max('results__cpu_time'),
+        max_memory=models.Max('results__memory'),
+    ).order_by('created_at', 'id').values_list('user_id', 'err', 'first_failure', 'max_cpu_time', 'max_memory')
+
+    stats = ProblemStats(problem=problem)
+    attempted, accepted = set(), set()
+    for user_id, err, first_failure, max_cpu_time, max_memory in submissions.iterator():
+        if err:
+            verdict = err
+        elif first_failure is not None:
+            verdict = TestCaseResultSerializer.to_status(first_failure)
+        else:
+            verdict = 'Accepted'
+        new_user = user_id not in attempted
+        new_accepted_user = verdict == 'Accepted' and user_id not in accepted
+        attempted.add(user_id)
+        if verdict == 'Accepted':
+            accepted.add(user_id)
+        stats.add(verdict, max_cpu_time, max_memory, new_user, new_accepted_user)
+
+    with transaction.atomic():
+        ProblemStats.objects.filter(problem=problem).delete()
+        stats.save()
+    return stats
@@ -0,0 +1,211 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from assign.models import ClassGroup, ClassMember
+from judge import judging
+from judge.backends import JudgeBackendRegistry
+from judge.fakeserver import FakeJudgeServer, parse_verdicts
+from judge.models import Problem, TestCase, Submission, ProblemStats
+from judge.workers import JUDGE_QUEUE
+
+SRC = "a, b = map(int, input().split())\nprint(a + b)\n"
+
+
+class QueryCounter:
+    """挂在每个数据库连接上，统计所有线程（包括判题 worker）执行的查询数"""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("在临时的测试数据库里模拟 N 个用户并发地运行/提交代码，判题交给本地的假判题机，"
+            "报告延迟的 p50/p95/p99、吞吐量和数据库查询数，用来在截止前的提交高峰之前发现性能退化")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['run', 'submit', 'mixed'], default='mixed')
+        parser.add_argument('--submit-ratio', type=float, default=0.5, help='mixed 模式下提交代码所占的比例')
+        parser.add_argument('--users', type=int, default=50, help='并发的用户数')
+        parser.add_argument('--requests', type=int, default=10, help='每个用户发出的请求数')
+        parser.add_argument('--class-size', type=int, default=30, help='每个班级的人数')
+        parser.add_argument('--test-cases', type=int, default=10, help='题目的测试用例数')
+        parser.add_argument('--workers', type=int, default=settings.JUDGE_WORKERS, help='判题 worker 线程数')
+        parser.add_argument('--latency', type=float, default=50, help='假判题机每个请求的基础耗时（毫秒）')
+        parser.add_argument('--case-latency', type=float, default=5, help='假判题机每个测试用例额外的耗时（毫秒）')
+        parser.add_argument('--jitter', type=float, default=0.2)
+        parser.add_argument('--verdicts', default='accepted=80,wrong_answer=15,runtime_error=3,compile_error=2')
+        parser.add_argument('--server-url', default=None, help='使用已经在运行的判题机，而不是启动内置的假判题机')
+        parser.add_argument('--throttle', action='store_true', help='保留限流配置；默认关闭限流，只测判题链路本身')
+        parser.add_argument('--timeout', type=float, default=300, help='等待所有提交判完的最长时间（秒）')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['mode'] != 'run' and options['workers'] <= 0:
+            raise CommandError("--workers must be positive when benchmarking submissions")
+        try:
+            verdicts = parse_verdicts(options['verdicts'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        token = os.getenv("JUDGE_SERVER_TOKEN") or ''
+        server = None
+        url = options['server_url']
+        if not url:
+            server = FakeJudgeServer(('127.0.0.1', 0), token, latency=options['latency'], case_latency=options['case_latency'],
+                                     jitter=options['jitter'], verdicts=verdicts, seed=options['seed'])
+            server.start()
+            url = server.url
+        old_client = judging.CLIENT
+        judging.CLIENT = JudgeBackendRegistry(token, [url], pool_size=settings.JUDGE_CLIENT_POOL_SIZE, timeout=settings.JUDGE_CLIENT_TIMEOUT,
+                                              health_check_interval=0, retries=settings.JUDGE_DISPATCH_RETRIES)
+        JUDGE_QUEUE.workers = options['workers']
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['throttle']:
+            overrides.update(JUDGE_RATE_LIMITS={scope: (10 ** 9, 10 ** 9) for scope in settings.JUDGE_RATE_LIMITS},
+                             JUDGE_MAX_IN_FLIGHT=10 ** 9, JUDGE_MAX_QUEUE_DEPTH=10 ** 9)
+
+        # 不碰真实数据：和 manage.py test 一样建一个临时数据库，跑完删掉
+        # SQLite 的内存测试库在多线程并发写入时会直接报 table is locked，这里改用临时文件
+        temp_dir = None
+        if connection.vendor == 'sqlite':
+            temp_dir = tempfile.TemporaryDirectory()
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(temp_dir.name, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        counter = QueryCounter()
+        try:
+            with override_settings(**overrides):
+                self._seed(options)
+                counter.install(connection=connection)
+                connection_created.connect(counter.install)
+                self._run(options, url, counter)
+        finally:
+            connection_created.disconnect(counter.install)
+            judging.CLIENT = old_client
+            if server:
+                server.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if temp_dir:
+                temp_dir.cleanup()
+
+    def _seed(self, options):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-user-{i}', full_name=f'Bench User {i}') for i in range(options['users'])
+        ])
+        class_size = max(options['class_size'], 1)
+        class_groups = ClassGroup.objects.bulk_create([
+            ClassGroup(title=f'Bench Class {i}') for i in range((len(users) + class_size - 1) // class_size)
+        ])
+        ClassMember.objects.bulk_create([
+            ClassMember(class_group=class_groups[i // class_size], student=user) for i, user in enumerate(users)
+        ])
+        self.problem = Problem.objects.create(title='Bench A + B', description='')
+        TestCase.objects.bulk_create([
+            TestCase(problem=self.problem, ordinal=i, input=f'{i} {i}', output=str(2 * i)) for i in range(1, options['test_cases'] + 1)
+        ])
+        self.users = users
+
+    def _session(self, index, user, options):
+        """一个用户依次发出若干请求，返回 [(类型, 耗时毫秒, 查询数, 状态码)]"""
+        rng = random.Random(options['seed'] * 100003 + index)
+        client = APIClient()
+        client.force_authenticate(user)
+        samples = []
+        try:
+            for i in range(options['requests']):
+                kind = options['mode']
+                if kind == 'mixed':
+                    kind = 'submit' if rng.random() < options['submit_ratio'] else 'run'
+                # 每次的代码都不同，不让编译缓存和判题结论缓存命中
+                data = {"src": f"{SRC}# {index}-{i}\n", "lang": "Python3"}
+                if kind == 'run':
+                    data.update(input='1 2', output='3')
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.post(f'/judge/problems/{self.problem.id}/{kind}/', data, format='json')
+                    elapsed = (time.perf_counter() - start) * 1000
+                samples.append((kind, elapsed, len(queries), response.status_code))
+        finally:
+            connection.close()
+        return samples
+
+    def _wait_for_judging(self, timeout):
+        """等所有提交判完，返回轮询用掉的查询数"""
+        deadline = time.monotonic() + timeout
+        unfinished = Submission.objects.exclude(judge_status=Submission.JudgeStatus.FINISHED)
+        polls = 1
+        while unfinished.exists():
+            if time.monotonic() > deadline:
+                self.stderr.write(f"Timed out with {unfinished.count()} submissions not judged")
+                return polls + 1
+            time.sleep(0.05)
+            polls += 1
+        return polls
+
+    def _run(self, options, url, counter):
+        self.stdout.write(f"Benchmarking {options['mode']}: {len(self.users)} users x {options['requests']} requests, "
+                          f"{options['test_cases']} test cases, "
+                          f"{options['workers']} judge workers, judge server {url}")
+        counter.count = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.users)) as executor:
+            sessions = list(executor.map(lambda args: self._session(*args, options), enumerate(self.users)))
+        load_time = time.perf_counter() - start
+        polls = self._wait_for_judging(options['timeout'])
+        total_time = time.perf_counter() - start
+        total_queries = counter.count - polls
+
+        samples = [sample for session in sessions for sample in session]
+        self.stdout.write(f"\n{'':<8}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries p50':>13}{'queries max':>13}")
+        for kind in ('run', 'submit'):
+            rows = [sample for sample in samples if sample[0] == kind]
+            if not rows:
+                continue
+            latencies = [row[1] for row in rows]
+            queries = [row[2] for row in rows]
+            errors = sum(row[3] >= 400 for row in rows)
+            self.stdout.write(f"{kind:<8}{len(rows):>7}{errors:>8}{percentile(latencies, 0.5):>10.1f}{percentile(latencies, 0.95):>10.1f}"
+                              f"{percentile(latencies, 0.99):>10.1f}{percentile(queries, 0.5):>13}{max(queries):>13}")
+
+        submissions = Submission.objects.filter(judge_status=Submission.JudgeStatus.FINISHED)
+        turnaround = [(updated_at - created_at).total_seconds() * 1000 for created_at, updated_at in submissions.values_list('created_at', 'updated_at')]
+        if turnaround:
+            self.stdout.write(f"{'judged':<8}{len(turnaround):>7}{'':>8}{percentile(turnaround, 0.5):>10.1f}"
+                              f"{percentile(turnaround, 0.95):>10.1f}{percentile(turnaround, 0.99):>10.1f}  (submit -> finished)")
+
+        self.stdout.write(f"\nThroughput: {len(samples) / load_time:.1f} requests/s")
+        if turnaround:
+            self.stdout.write(f"            {len(turnaround) / total_time:.1f} submissions judged/s")
+        self.stdout.write(f"DB queries: {total_queries} in total (including judge workers), {total_queries / max(len(samples), 1):.1f} per request")
+        stats = ProblemStats.objects.filter(problem=self.problem).first()
+        if stats:
+            verdicts = ', '.join(f'{verdict} {count}' for verdict, count in sorted(stats.get_verdicts().items(), key=lambda item: -item[1]))
+            self.stdout.write(f"Verdicts: {verdicts}")
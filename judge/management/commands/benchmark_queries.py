@@ -0,0 +1,137 @@
+import random
+import statistics
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, migrations
+from django.db.migrations.loader import MigrationLoader
+
+from accounts.models import CustomUser
+from chat.models import Conversation, Message
+from judge.models import Problem, TestCase, Submission, TestCaseResult, ProblemConversation, ProblemMessage
+
+# 加索引的迁移：先去掉其中的索引和约束测一遍，再加回来测一遍
+# 不回退整个迁移，否则之后的迁移新增的字段在旧的表结构里不存在，无法灌入数据
+INDEX_MIGRATIONS = [('judge', '0008_hot_query_indexes'), ('chat', '0006_message_conversation_idx')]
+
+
+class Command(BaseCommand):
+    help = "在临时的测试数据库里灌入数据，对比加索引前后判题相关热点查询的执行计划和耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--problems', type=int, default=50)
+        parser.add_argument('--test-cases', type=int, default=10, help='每道题的测试用例数')
+        parser.add_argument('--submissions', type=int, default=20000)
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=200, help='每个查询执行的次数')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # 不碰真实数据：和 manage.py test 一样建一个临时数据库，跑完删掉
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write("Seeding data...")
+            self._seed(options)
+            self._apply_indexes(forwards=False)
+            before = self._run("Before", options['repeat'])
+            self._apply_indexes(forwards=True)
+            after = self._run("After", options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("\nSummary (median ms):")
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            self.stdout.write(f"  {name:<32} {before[name]:>8.3f} -> {after[name]:>8.3f}  x{speedup:.1f}")
+
+    def _apply_indexes(self, forwards):
+        loader = MigrationLoader(connection)
+        with connection.schema_editor() as schema_editor:
+            for app_label, name in INDEX_MIGRATIONS:
+                for operation in loader.get_migration(app_label, name).operations:
+                    model = apps.get_model(app_label, operation.model_name)
+                    if isinstance(operation, migrations.AddIndex):
+                        (schema_editor.add_index if forwards else schema_editor.remove_index)(model, operation.index)
+                    elif isinstance(operation, migrations.AddConstraint):
+                        (schema_editor.add_constraint if forwards else schema_editor.remove_constraint)(model, operation.constraint)
+
+    def _seed(self, options):
+        rng = self.random
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-user-{i}', full_name=f'Bench User {i}') for i in range(options['users'])
+        ])
+        problems = Problem.objects.bulk_create([
+            Problem(title=f'Bench Problem {i}', description='') for i in range(options['problems'])
+        ])
+        test_cases = {}
+        for problem in problems:
+            test_cases[problem.id] = TestCase.objects.bulk_create([
+                TestCase(problem=problem, ordinal=i, input=f'{i}', output=f'{i}') for i in range(1, options['test_cases'] + 1)
+            ])
+
+        statuses = [Submission.JudgeStatus.FINISHED] * 98 + [Submission.JudgeStatus.PENDING, Submission.JudgeStatus.JUDGING]
+        submissions = Submission.objects.bulk_create([
+            Submission(user=rng.choice(users), problem=rng.choice(problems), src='print(input())', lang='Python3',
+                       judge_status=rng.choice(statuses), total_count=options['test_cases'])
+            for _ in range(options['submissions'])
+        ], batch_size=1000)
+        TestCaseResult.objects.bulk_create((
+            TestCaseResult(submission=submission, test_case=case, result=rng.choice([-1, 0, 0, 0, 1]),
+                           cpu_time=1, real_time=1, memory=1, exit_code=0, signal=0, error=0)
+            for submission in submissions for case in test_cases[submission.problem_id]
+        ), batch_size=1000)
+
+        conversations = Conversation.objects.bulk_create([Conversation(user=user) for user in users])
+        problem_conversations = ProblemConversation.objects.bulk_create([
+            ProblemConversation(problem=rng.choice(problems), conversation=conversation) for conversation in conversations
+        ])
+        messages = Message.objects.bulk_create([
+            Message(conversation=rng.choice(conversations), role=rng.choice(['user', 'assistant']), content='')
+            for _ in range(options['messages'])
+        ], batch_size=1000)
+        problem_conversation_of = {pc.conversation_id: pc for pc in problem_conversations}
+        ProblemMessage.objects.bulk_create([
+            ProblemMessage(problem_conversation=problem_conversation_of[message.conversation_id], message=message)
+            for message in messages
+        ], batch_size=1000)
+
+        self.users, self.problems, self.submissions = users, problems, submissions
+        self.conversations, self.problem_conversations = conversations, problem_conversations
+
+    def _queries(self):
+        rng = self.random
+        return {
+            "submissions by user and problem": lambda: Submission.objects.filter(
+                user=rng.choice(self.users), problem=rng.choice(self.problems)).order_by('-created_at')[:20],
+            "pending submissions": lambda: Submission.objects.filter(
+                judge_status=Submission.JudgeStatus.PENDING).order_by('created_at')[:40],
+            "results of a submission": lambda: TestCaseResult.objects.filter(
+                submission=rng.choice(self.submissions)).select_related('test_case').order_by('test_case__ordinal'),
+            "test cases of a problem": lambda: TestCase.objects.filter(
+                problem=rng.choice(self.problems)).order_by('ordinal'),
+            "messages of a conversation": lambda: Message.objects.filter(
+                conversation=rng.choice(self.conversations)).order_by('-created_at')[:20],
+            "problem messages": lambda: ProblemMessage.objects.filter(
+                problem_conversation=rng.choice(self.problem_conversations)).order_by('-message__created_at')[:20],
+        }
+
+    def _run(self, label, repeat):
+        self.stdout.write(f"\n== {label} ==")
+        medians = {}
+        for name, make_queryset in self._queries().items():
+            self.stdout.write(f"\n{name}:")
+            for line in make_queryset().explain().splitlines():
+                self.stdout.write(f"    {line}")
+            timings = []
+            for _ in range(repeat):
+                queryset = make_queryset()
+                start = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - start) * 1000)
+            medians[name] = statistics.median(timings)
+            p95 = sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+            self.stdout.write(f"    median {medians[name]:.3f} ms, p95 {p95:.3f} ms")
+        return medians
@@ -0,0 +1,39 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.fakeserver import FakeJudgeServer, parse_verdicts
+
+
+class Command(BaseCommand):
+    help = "启动一个假的判题机（实现 /ping、/judge、/compile_spj），用于没有 Docker 判题机时的开发和压测"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12358)
+        parser.add_argument('--token', default=None, help='默认与 JUDGE_SERVER_TOKEN 相同')
+        parser.add_argument('--latency', type=float, default=50, help='每个请求的基础耗时（毫秒）')
+        parser.add_argument('--case-latency', type=float, default=10, help='每个测试用例额外的耗时（毫秒）')
+        parser.add_argument('--jitter', type=float, default=0.2, help='耗时上下浮动的比例')
+        parser.add_argument('--verdicts', default='accepted=80,wrong_answer=15,runtime_error=3,compile_error=2',
+                            help='各判题结论的权重，可选：accepted、wrong_answer、cpu_time_limit_exceeded、real_time_limit_exceeded、'
+                                 'memory_limit_exceeded、runtime_error、system_error、compile_error')
+        parser.add_argument('--test-case-count', type=int, default=1, help='只传 test_case_id 时返回的结果个数')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            verdicts = parse_verdicts(options['verdicts'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        token = options['token'] or os.getenv("JUDGE_SERVER_TOKEN") or ''
+        server = FakeJudgeServer((options['host'], options['port']), token, latency=options['latency'], case_latency=options['case_latency'],
+                                 jitter=options['jitter'], verdicts=verdicts, test_case_count=options['test_case_count'], seed=options['seed'])
+        self.stdout.write(f"Fake judge server listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from judge.models import Problem
+from judge.judging import rebuild_problem_stats
+
+
+class Command(BaseCommand):
+    help = "根据已有的提交重新计算题目统计（ProblemStats），用于首次上线或统计数据出错时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('problem_ids', nargs='*', type=int, help='要重新计算的题目 id，不填则计算全部题目')
+
+    def handle(self, *args, **options):
+        problems = Problem.objects.all()
+        if options['problem_ids']:
+            problems = problems.filter(id__in=options['problem_ids'])
+
+        for problem in problems.order_by('id'):
+            stats = rebuild_problem_stats(problem)
+            self.stdout.write(f"Problem {problem.id}: {stats.attempts} attempts, {stats.accepted_users} accepted users")
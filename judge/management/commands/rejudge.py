@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.models import RejudgeJob
+from judge.rejudge import create_rejudge_job, run_rejudge_job
+
+
+class Command(BaseCommand):
+    help = "修改测试用例后，重新判某些题目（或某个题单里所有题目）已有的提交"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problem', type=int, action='append', default=[], dest='problem_ids', help='题目 id，可以多次指定')
+        parser.add_argument('--problem-list', type=int, help='题单 id，重新判题单里的所有题目')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help='继续一个中断了的重新判题任务')
+        parser.add_argument('--concurrency', type=int, help='同时判题的提交数，默认为 JUDGE_REJUDGE_CONCURRENCY')
+        parser.add_argument('--batch-size', type=int, help='每批的提交数，默认为 JUDGE_REJUDGE_BATCH_SIZE')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                job = RejudgeJob.objects.get(id=options['resume'])
+            except RejudgeJob.DoesNotExist:
+                raise CommandError(f"Rejudge job {options['resume']} does not exist")
+            if job.status == RejudgeJob.Status.FINISHED:
+                raise CommandError(f"Rejudge job {job.id} is already finished")
+        elif options['problem_ids'] or options['problem_list']:
+            job = create_rejudge_job(problem_ids=options['problem_ids'], problem_list_id=options['problem_list'])
+        else:
+            raise CommandError("Specify --problem, --problem-list or --resume")
+
+        self.stdout.write(f"Rejudge job {job.id}: {job.total_count} submissions of problems {job.get_problem_ids()}")
+        job = run_rejudge_job(job, concurrency=options['concurrency'], batch_size=options['batch_size'],
+                              progress=lambda job: self.stdout.write(f"  {job.done_count} / {job.total_count}"))
+        if job.status == RejudgeJob.Status.FAILED:
+            raise CommandError(f"Rejudge job {job.id} failed: {job.error} (resume with --resume {job.id})")
+        self.stdout.write(f"Rejudge job {job.id} finished")
@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from judge.models import Submission
+from judge.judging import judge_submission, reset_stale_submissions
+
+
+class Command(BaseCommand):
+    help = "消费数据库里 Pending 状态的提交，适合把判题 worker 部署成独立进程"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='并发判题的线程数')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--recover', action='store_true', help='启动时把领取后超过 JUDGE_STALE_TIMEOUT 秒仍没判完的 Judging 提交重新放回队列')
+        parser.add_argument('--once', action='store_true', help='把当前队列消费完就退出')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+
+        if options['recover']:
+            # 只放回超时的提交，其他 worker 正在判的提交不受影响
+            count = reset_stale_submissions()
+            self.stdout.write(f"Recovered {count} interrupted submissions")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                close_old_connections()
+                pending = list(Submission.objects.filter(judge_status=Submission.JudgeStatus.PENDING).order_by('created_at').values_list('id', flat=True)[:workers * 4])
+                if not pending:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                list(executor.map(self._judge, pending))
+                self.stdout.write(f"Judged {len(pending)} submissions")
+
+    def _judge(self, submission_id):
+        try:
+            judge_submission(submission_id)
+        except Exception as e:
+            self.stderr.write(f"Failed to judge submission {submission_id}: {e}")
+        finally:
+            close_old_connections()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from judge.models import Problem
+from judge.testcases import export_test_cases
+
+
+class Command(BaseCommand):
+    help = "把题目的测试用例导出到判题机的测试用例目录（JUDGE_TEST_CASE_DIR）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('problem_ids', nargs='*', type=int, help='要导出的题目 id，不填则导出全部题目')
+
+    def handle(self, *args, **options):
+        if not settings.JUDGE_TEST_CASE_DIR:
+            raise CommandError("JUDGE_TEST_CASE_DIR is not configured")
+
+        problems = Problem.objects.all()
+        if options['problem_ids']:
+            problems = problems.filter(id__in=options['problem_ids'])
+
+        for problem in problems.order_by('id'):
+            test_case_id = export_test_cases(problem)
+            self.stdout.write(f"Problem {problem.id}: {test_case_id}")
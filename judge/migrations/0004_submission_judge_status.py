@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0003_problemconversation_problemmessage"),
+    ]
+
+    operations = [
+        # 已有的提交都是同步判完的，所以先以 Finished 回填，再把默认值改为 Pending
+        migrations.AddField(
+            model_name="submission",
+            name="judge_status",
+            field=models.CharField(default="Finished", max_length=20),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="judge_status",
+            field=models.CharField(default="Pending", max_length=20),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0004_submission_judge_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="test_case_id",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0005_problem_test_case_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="memory_limit",
+            field=models.PositiveIntegerField(
+                default=128,
+                validators=[
+                    django.core.validators.MinValueValidator(16),
+                    django.core.validators.MaxValueValidator(1024),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="problem",
+            name="time_limit",
+            field=models.PositiveIntegerField(
+                default=1000,
+                validators=[
+                    django.core.validators.MinValueValidator(100),
+                    django.core.validators.MaxValueValidator(10000),
+                ],
+            ),
+        ),
+    ]
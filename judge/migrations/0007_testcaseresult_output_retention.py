@@ -0,0 +1,27 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0006_problem_time_limit_memory_limit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcaseresult",
+            name="output_blob",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testcaseresult",
+            name="output_diff",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="testcaseresult",
+            name="output_truncated",
+            field=models.BooleanField(default=False),
+        ),
+    ]
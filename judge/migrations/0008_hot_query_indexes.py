@@ -0,0 +1,38 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0007_testcaseresult_output_retention"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["user", "problem", "-created_at"],
+                name="submission_user_problem_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["judge_status", "created_at"],
+                name="submission_judge_status_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="testcase",
+            constraint=models.UniqueConstraint(
+                fields=("problem", "ordinal"), name="unique_testcase_ordinal"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="testcaseresult",
+            constraint=models.UniqueConstraint(
+                fields=("submission", "test_case"), name="unique_testcaseresult"
+            ),
+        ),
+    ]
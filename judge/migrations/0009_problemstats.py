@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0008_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProblemStats",
+            fields=[
+                (
+                    "problem",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="judge.problem",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("accepted_count", models.PositiveIntegerField(default=0)),
+                ("attempted_users", models.PositiveIntegerField(default=0)),
+                ("accepted_users", models.PositiveIntegerField(default=0)),
+                ("verdicts", models.TextField(default="{}")),
+                ("cpu_time_sketch", models.TextField(default="")),
+                ("memory_sketch", models.TextField(default="")),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
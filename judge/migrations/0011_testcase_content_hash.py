@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:36
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    TestCase = apps.get_model("judge", "TestCase")
+    batch = []
+    for case in TestCase.objects.only("id", "input", "output").iterator(chunk_size=100):
+        digest = hashlib.sha256()
+        for value in (case.input, case.output):
+            digest.update(value.encode("utf-8"))
+            digest.update(b"\0")
+        case.content_hash = digest.hexdigest()
+        batch.append(case)
+        if len(batch) >= 100:
+            TestCase.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    TestCase.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0010_rejudgejob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcase",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0011_testcase_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="spj_src",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="problem",
+            name="spj_version",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0012_problem_spj"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="description_tokens",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+def fill_compiled(apps, schema_editor):
+    Submission = apps.get_model("judge", "Submission")
+    finished = Submission.objects.filter(judge_status="Finished")
+    finished.filter(err__isnull=True).update(compiled=True)
+    finished.filter(err="CompileError").update(compiled=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("judge", "0013_problem_description_tokens"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="compiled",
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_compiled, migrations.RunPython.noop),
+    ]
@@ -1,30 +1,85 @@
+import hashlib
+import json
+import zlib
+
 from django.conf import settings
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.db import transaction
 
 from chat.models import Conversation, Message
+from chat.tokenizer import TOKENIZER
+from .sketches import QuantileSketch
 
 # Create your models here.
 class Problem(models.Model):
     title = models.CharField(max_length=255, default='')
     description = models.TextField()
+    description_tokens = models.IntegerField(default=0)  # description 的 token 数，保存时计算，用 get_description_tokens() 读取
+    time_limit = models.PositiveIntegerField(default=1000, validators=[MinValueValidator(100), MaxValueValidator(10000)])  # unit is ms
+    memory_limit = models.PositiveIntegerField(default=128, validators=[MinValueValidator(16), MaxValueValidator(1024)])  # unit is MB
+    test_case_id = models.CharField(max_length=64, null=True, blank=True)  # 已同步到判题机的测试用例目录名，带版本号
+    spj_src = models.TextField(null=True, blank=True)  # 特判程序（C 语言），有多个正确答案的题目用它来判断输出是否正确
+    spj_version = models.CharField(max_length=32, null=True, blank=True)  # 特判程序源代码的 hash，判题机按版本缓存编译好的特判程序
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
+    @staticmethod
+    def get_spj_version(spj_src):
+        return hashlib.sha256(spj_src.encode('utf-8')).hexdigest()[:16] if spj_src else None
+
+    def get_description_tokens(self):
+        """description 的 token 数；之前保存（或 bulk_create）的题目还没有算过，第一次用到时计算并保存"""
+        if not self.description_tokens and self.description:
+            self.description_tokens = TOKENIZER.count_tokens(self.description)
+            Problem.objects.filter(id=self.id).update(description_tokens=self.description_tokens)
+        return self.description_tokens
+
+    def save(self, *args, **kwargs):
+        self.spj_version = self.get_spj_version(self.spj_src)
+        self.description_tokens = TOKENIZER.count_tokens(self.description)
+        super().save(*args, **kwargs)
+
 class TestCase(models.Model):
     problem = models.ForeignKey(Problem, related_name='test_cases', on_delete=models.CASCADE)
     ordinal = models.PositiveIntegerField()
     title = models.CharField(max_length=255, default='', blank=True)
     input = models.TextField()
     output = models.TextField()
+    content_hash = models.CharField(max_length=64, default='', blank=True)  # input 和 output 的 sha256，更新测试用例时据此判断内容是否改变
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['problem', 'ordinal'],
+                name='unique_testcase_ordinal'
+            )
+        ]
     
     def __str__(self):
         return f'TestCase{self.ordinal} for {self.problem.title}'
 
+    @staticmethod
+    def get_content_hash(input, output):
+        digest = hashlib.sha256()
+        for value in (input, output):
+            digest.update(value.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.get_content_hash(self.input, self.output)
+        super().save(*args, **kwargs)
+
 class Submission(models.Model):
+    class JudgeStatus:
+        PENDING = 'Pending'  # 已入队，等待判题机空闲
+        JUDGING = 'Judging'  # 已被某个判题 worker 领取
+        FINISHED = 'Finished'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='submissions', on_delete=models.CASCADE)
     problem = models.ForeignKey(Problem, related_name='submissions', on_delete=models.CASCADE)
     src = models.TextField()
@@ -38,9 +93,20 @@ class Submission(models.Model):
     # }
     total_count = models.PositiveIntegerField(default=0)
     success_count = models.PositiveIntegerField(default=0)
+    # 判题机报告的编译结果：None 为还不知道（或因为其他错误没能编译），True 为编译通过，False 为编译失败
+    compiled = models.BooleanField(null=True, blank=True)
+    judge_status = models.CharField(max_length=20, default=JudgeStatus.PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 某个学生在某道题下的提交记录，按时间倒序
+            models.Index(fields=['user', 'problem', '-created_at'], name='submission_user_problem_idx'),
+            # 判题 worker 按提交顺序领取排队中的提交
+            models.Index(fields=['judge_status', 'created_at'], name='submission_judge_status_idx'),
+        ]
+
     def __str__(self):
         return f'Submission by {self.user.username} for {self.problem.title}'
 
@@ -74,14 +140,129 @@ class TestCaseResult(models.Model):
     cpu_time = models.PositiveIntegerField()  # unit is ms
     real_time = models.PositiveIntegerField()  # unit is ms
     memory = models.PositiveIntegerField()  # unit is byte
-    output = models.TextField(null=True, blank=True)
+    output = models.TextField(null=True, blank=True)  # 可能被截断，见 output_truncated
+    output_truncated = models.BooleanField(default=False)
+    output_diff = models.TextField(null=True, blank=True)  # 答案错误时，与预期输出第一处不同附近的 diff
+    output_blob = models.BinaryField(null=True, blank=True)  # zlib 压缩后的完整输出，只在截断且开启压缩存储时才有
     exit_code = models.IntegerField()
     signal = models.IntegerField()
     error = models.IntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['submission', 'test_case'],
+                name='unique_testcaseresult'
+            )
+        ]
+
     def __str__(self):
         return f'Result for {self.submission} on {self.test_case}'
 
+    def get_full_output(self):
+        if self.output_blob:
+            return zlib.decompress(self.output_blob).decode('utf-8')
+        return self.output
+
+class ProblemStats(models.Model):
+    """每道题的提交统计，每判完一份提交增量更新一次，列表接口直接读取，不用再对提交表做 GROUP BY"""
+    problem = models.OneToOneField(Problem, related_name='stats', on_delete=models.CASCADE, primary_key=True)
+    attempts = models.PositiveIntegerField(default=0)  # 判完的提交数
+    accepted_count = models.PositiveIntegerField(default=0)  # 通过的提交数
+    attempted_users = models.PositiveIntegerField(default=0)
+    accepted_users = models.PositiveIntegerField(default=0)
+    verdicts = models.TextField(default='{}')  # {"Accepted": 10, "WrongAnswer": 3, "CompileError": 1, ...}
+    cpu_time_sketch = models.TextField(default='')  # 每份提交最大 CPU 时间（ms）的分位数草图，见 QuantileSketch
+    memory_sketch = models.TextField(default='')  # 每份提交最大内存（byte）的分位数草图
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Stats for {self.problem.title}'
+
+    def get_verdicts(self):
+        try:
+            return json.loads(self.verdicts or '{}')
+        except json.JSONDecodeError:
+            return {}
+
+    def get_cpu_time_sketch(self):
+        return QuantileSketch.from_json(self.cpu_time_sketch)
+
+    def get_memory_sketch(self):
+        return QuantileSketch.from_json(self.memory_sketch)
+
+    def add(self, verdict, cpu_time=None, memory=None, new_user=False, new_accepted_user=False):
+        self.attempts += 1
+        if verdict == 'Accepted':
+            self.accepted_count += 1
+        self.attempted_users += int(new_user)
+        self.accepted_users += int(new_accepted_user)
+
+        verdicts = self.get_verdicts()
+        verdicts[verdict] = verdicts.get(verdict, 0) + 1
+        self.verdicts = json.dumps(verdicts)
+
+        if cpu_time is not None:
+            sketch = self.get_cpu_time_sketch()
+            sketch.add(cpu_time)
+            self.cpu_time_sketch = sketch.to_json()
+        if memory is not None:
+            sketch = self.get_memory_sketch()
+            sketch.add(memory)
+            self.memory_sketch = sketch.to_json()
+
+    @classmethod
+    def record_submission(cls, submission, verdict, cpu_time=None, memory=None):
+        """在保存判题结果的事务里调用，锁住统计行后再判断是否是该学生第一次提交/第一次通过"""
+        with transaction.atomic():
+            cls.objects.get_or_create(problem_id=submission.problem_id)
+            stats = cls.objects.select_for_update().get(problem_id=submission.problem_id)
+            previous = Submission.objects.filter(user_id=submission.user_id, problem_id=submission.problem_id, judge_status=Submission.JudgeStatus.FINISHED).exclude(id=submission.id)
+            new_user = not previous.exists()
+            new_accepted_user = verdict == 'Accepted' and not previous.filter(err__isnull=True, total_count__gt=0, success_count=models.F('total_count')).exists()
+            stats.add(verdict, cpu_time, memory, new_user, new_accepted_user)
+            stats.save()
+            return stats
+
+class RejudgeJob(models.Model):
+    """批量重新判题的任务，按提交 id 从小到大分批进行，记录进度以便中断后继续"""
+    class Status:
+        RUNNING = 'Running'
+        FINISHED = 'Finished'
+        FAILED = 'Failed'
+
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='rejudge_jobs', null=True, blank=True, on_delete=models.SET_NULL)
+    problem_ids = models.TextField(default='[]')  # 要重新判题的题目 id 列表
+    status = models.CharField(max_length=20, default=Status.RUNNING)
+    total_count = models.PositiveIntegerField(default=0)
+    done_count = models.PositiveIntegerField(default=0)
+    last_submission_id = models.PositiveIntegerField(default=0)  # 已经判完的最后一份提交，继续时从它之后开始
+    max_submission_id = models.PositiveIntegerField(default=0)  # 创建任务时最新的提交，之后的提交用的已经是新测试用例
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Rejudge job {self.id} ({self.done_count} / {self.total_count})'
+
+    def get_problem_ids(self):
+        try:
+            return json.loads(self.problem_ids or '[]')
+        except json.JSONDecodeError:
+            return []
+
+    def set_problem_ids(self, problem_ids):
+        self.problem_ids = json.dumps(sorted(set(problem_ids)))
+
+    def get_submissions(self):
+        """还没有重新判过的提交；上次中断时已经放回队列但还没判的提交也包括在内"""
+        return Submission.objects.filter(
+            problem_id__in=self.get_problem_ids(),
+            judge_status__in=[Submission.JudgeStatus.FINISHED, Submission.JudgeStatus.PENDING],
+            id__gt=self.last_submission_id,
+            id__lte=self.max_submission_id,
+        ).order_by('id')
+
 class ProblemConversation(models.Model):
     problem = models.ForeignKey(Problem, related_name='conversations', on_delete=models.CASCADE)
     conversation = models.ForeignKey('chat.Conversation', related_name='problem_conversations', on_delete=models.CASCADE)
@@ -110,13 +291,14 @@ class ProblemMessage(models.Model):
         return f'Message {self.message.id} in Problem {self.problem_conversation.problem.title}'
     
     @classmethod
-    def create_message(cls, problem_conversation, role, content, tokens=0, src=None, lang=None, relevant_submission=None, start_question=None):
+    def create_message(cls, problem_conversation, role, content, tokens=0, src=None, lang=None, relevant_submission=None, start_question=None, status=Message.Status.COMPLETE):
         with transaction.atomic():
             message = Message.objects.create(
                 conversation=problem_conversation.conversation,
                 role=role,
                 content=content,
-                tokens=tokens
+                tokens=tokens,
+                status=status
             )
             problem_message = cls.objects.create(
                 problem_conversation=problem_conversation,
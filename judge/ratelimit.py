@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .models import Submission
+
+
+def _refill(state, now, capacity, rate):
+    tokens, updated_at = state
+    return min(capacity, tokens + (now - updated_at) * rate), now
+
+
+def _get_wait(buckets, states):
+    """所有桶都至少有一个令牌时返回 0，否则返回最长的等待秒数；只有返回 0 时才从各个桶里取令牌"""
+    return max(((1 - states[key][0]) / rate for key, capacity, rate in buckets if states[key][0] < 1), default=0)
+
+
+class LocalBackend:
+    """进程内的计数器，单进程部署时使用"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._counters = {}
+
+    def take(self, buckets):
+        """令牌桶：buckets 为 [(key, 桶容量, 每秒补充的令牌数)]，都有令牌时各取一个并返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            states = {key: _refill(self._buckets.get(key, (capacity, now)), now, capacity, rate) for key, capacity, rate in buckets}
+            wait = _get_wait(buckets, states)
+            if wait == 0:
+                for key, (tokens, updated_at) in states.items():
+                    self._buckets[key] = (tokens - 1, updated_at)
+            return wait
+
+    def acquire(self, key):
+        """进行中的请求数加一，返回 (归还时用的凭据, 加一后的总数)"""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return key, self._counters[key]
+
+    def release(self, lease):
+        with self._lock:
+            self._counters[lease] -= 1
+
+
+class CacheBackend:
+    """
+    存在 Django 缓存里的计数器，多进程部署时配合 Redis/Memcached 等共享缓存使用。
+    令牌桶的读写不是原子的，并发很高时可能多放行几个请求，作为限流足够了。
+    """
+    def take(self, buckets):
+        keys = {key: f'judge:bucket:{key}' for key, _, _ in buckets}
+        now = time.time()
+        saved = cache.get_many(keys.values())
+        states = {key: _refill(saved.get(keys[key], (capacity, now)), now, capacity, rate) for key, capacity, rate in buckets}
+        wait = _get_wait(buckets, states)
+        if wait == 0:
+            for key, capacity, rate in buckets:
+                tokens, updated_at = states[key]
+                cache.set(keys[key], (tokens - 1, updated_at), timeout=math.ceil(capacity / rate) + 1)
+        return wait
+
+    def acquire(self, key):
+        """
+        进行中的请求数加一，返回 (归还时用的凭据, 当前总数)。
+        计数按 JUDGE_IN_FLIGHT_TTL 秒分段保存并自动过期，总数为当前和上一段之和；
+        进程被杀掉时没来得及归还的名额，最多两段时间之后就不再计入。
+        """
+        ttl = settings.JUDGE_IN_FLIGHT_TTL
+        window = int(time.time() // ttl)
+        lease = f'judge:counter:{key}:{window}'
+        cache.add(lease, 0, timeout=2 * ttl)
+        count = cache.incr(lease)
+        return lease, count + cache.get(f'judge:counter:{key}:{window - 1}', 0)
+
+    def release(self, lease):
+        try:
+            cache.decr(lease)
+        except ValueError:
+            # 这一段的计数已经过期了
+            pass
+
+
+BACKEND = import_string(settings.JUDGE_RATE_LIMIT_BACKEND)()
+
+
+class JudgeThrottle(BaseThrottle):
+    """
+    运行和提交代码的限流：每个用户一个令牌桶，同一个班级的学生再共用一个令牌桶，避免一个班把判题机占满。
+    所有桶都有令牌时才放行，被拒绝的请求不消耗令牌，不会因为某个学生反复重试而耗尽全班的令牌。
+    """
+    def get_buckets(self, request):
+        buckets = [(f'user:{request.user.pk}', *settings.JUDGE_RATE_LIMITS['user'])]
+        class_group_ids = request.user.class_members.values_list('class_group_id', flat=True)
+        buckets += [(f'class:{class_group_id}', *settings.JUDGE_RATE_LIMITS['class']) for class_group_id in class_group_ids]
+        return buckets
+
+    def allow_request(self, request, view):
+        self.wait_seconds = BACKEND.take(self.get_buckets(request))
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class JudgeQueueThrottle(JudgeThrottle):
+    """排队的提交太多时直接拒绝，让客户端过一会儿再来；队列没满时再按 JudgeThrottle 限流"""
+    def allow_request(self, request, view):
+        depth = Submission.objects.filter(judge_status=Submission.JudgeStatus.PENDING).count()
+        if depth >= settings.JUDGE_MAX_QUEUE_DEPTH:
+            # 粗略估计：每个 worker 每秒判完一份
+            self.wait_seconds = math.ceil(depth / max(settings.JUDGE_WORKERS, 1))
+            return False
+        return super().allow_request(request, view)
+
+
+@contextmanager
+def judge_slot():
+    """限制同时在判题机上运行的同步判题请求数，超出时返回 429"""
+    lease, count = BACKEND.acquire('in_flight')
+    try:
+        if count > settings.JUDGE_MAX_IN_FLIGHT:
+            raise Throttled(wait=1)
+        yield
+    finally:
+        BACKEND.release(lease)
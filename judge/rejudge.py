@@ -0,0 +1,111 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from assign.models import Homework
+from design.models import ProblemListItem
+from .models import Problem, Submission, TestCaseResult, RejudgeJob
+from .judging import judge_submission, rebuild_problem_stats
+
+logger = logging.getLogger(__name__)
+
+
+def create_rejudge_job(problem_ids=None, problem_list_id=None, user=None):
+    problem_ids = set(problem_ids or [])
+    if problem_list_id:
+        problem_ids.update(ProblemListItem.objects.filter(problem_list_id=problem_list_id, problem__isnull=False).values_list('problem_id', flat=True))
+    job = RejudgeJob(created_by=user)
+    job.set_problem_ids(problem_ids)
+    job.max_submission_id = Submission.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    job.total_count = job.get_submissions().count()
+    job.save()
+    return job
+
+
+def rejudge_submission(submission_id):
+    # 重置和领取在同一个事务里，直接改为 Judging：判题 worker 不会把它当成普通的 Pending 提交领走
+    with transaction.atomic():
+        claimed = Submission.objects.filter(id=submission_id, judge_status__in=[Submission.JudgeStatus.FINISHED, Submission.JudgeStatus.PENDING]).update(
+            judge_status=Submission.JudgeStatus.JUDGING, compiled=None, updated_at=timezone.now())
+        if not claimed:
+            # 正在被判题 worker 判
+            return
+        TestCaseResult.objects.filter(submission_id=submission_id).delete()
+    try:
+        # 统计和作业在整个任务结束后统一刷新；不复用缓存，测试用例没变时也要真的再判一次
+        judge_submission(submission_id, record_stats=False, bulk=True, use_cache=False, claimed=True)
+    except Exception:
+        # 放回 Pending，继续任务时会重新判这一份
+        Submission.objects.filter(id=submission_id, judge_status=Submission.JudgeStatus.JUDGING).update(judge_status=Submission.JudgeStatus.PENDING)
+        raise
+
+
+def _rejudge(job_id, submission_id):
+    try:
+        rejudge_submission(submission_id)
+        # 每判完一份就更新 updated_at，据此判断任务是否还有进程在跑
+        RejudgeJob.objects.filter(id=job_id).update(updated_at=timezone.now())
+    finally:
+        close_old_connections()
+
+
+def refresh_homeworks(problem_ids):
+    homeworks = Homework.objects.filter(assignment__problem_list__problems__problem_id__in=problem_ids).distinct()
+    for homework_id in homeworks.values_list('id', flat=True):
+        with transaction.atomic():
+            homework = Homework.objects.select_for_update().get(id=homework_id)
+            homework.refresh_best_submissions()
+            homework.save()
+
+
+def run_rejudge_job(job, concurrency=None, batch_size=None, progress=None):
+    """
+    按提交 id 从小到大分批重新判题，每批最多 concurrency 份同时发给判题机。
+    每判完一批记录一次进度，中断后再次运行同一个任务会从上次的进度继续。
+    """
+    concurrency = concurrency or settings.JUDGE_REJUDGE_CONCURRENCY
+    batch_size = batch_size or settings.JUDGE_REJUDGE_BATCH_SIZE
+    job.status = RejudgeJob.Status.RUNNING
+    job.error = None
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                batch = list(job.get_submissions().values_list('id', flat=True)[:batch_size])
+                if not batch:
+                    break
+                list(executor.map(functools.partial(_rejudge, job.id), batch))
+                job.last_submission_id = batch[-1]
+                job.done_count += len(batch)
+                job.save(update_fields=['last_submission_id', 'done_count', 'updated_at'])
+                if progress:
+                    progress(job)
+
+        for problem in Problem.objects.filter(id__in=job.get_problem_ids()):
+            rebuild_problem_stats(problem)
+        refresh_homeworks(job.get_problem_ids())
+        job.status = RejudgeJob.Status.FINISHED
+    except Exception as e:
+        logger.exception("Rejudge job %s failed", job.id)
+        job.status = RejudgeJob.Status.FAILED
+        job.error = str(e)
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    return job
+
+
+def start_rejudge_job(job):
+    """在后台线程里运行重新判题任务，供接口调用"""
+    def target():
+        try:
+            run_rejudge_job(job)
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=target, name=f'rejudge-{job.id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from assign.models import Assignment, ClassMember
+
+
+class JudgeScheduler:
+    """
+    发往判题机的请求的准入调度：同时进行的请求不超过 slots 个，有空位时按以下规则放行等待的请求：
+    1. 先按通道的优先级：交互式运行 > 临近截止的作业提交 > 普通提交 > 批量重新判题；
+    2. 同一通道内按班级加权公平排队（开始时间公平排队，虚拟开始时间小的先走），
+       一个班集中提交时不会把其他班的提交挤在后面。
+    """
+    INTERACTIVE = 0
+    DEADLINE = 1
+    GRADED = 2
+    BULK = 3
+    LANES = ['interactive', 'deadline', 'graded', 'bulk']
+
+    def __init__(self, slots, weights=None):
+        self.slots = slots
+        self.weights = weights or {}
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._waiting = [[] for _ in self.LANES]
+        self._virtual_time = [0.0 for _ in self.LANES]
+        self._group_finish = {}
+        self._sequence = itertools.count()
+
+    def _head(self):
+        for heap in self._waiting:
+            if heap:
+                return heap[0]
+        return None
+
+    @contextmanager
+    def slot(self, lane, group=None):
+        if self.slots <= 0:
+            yield
+            return
+
+        with self._condition:
+            start = max(self._virtual_time[lane], self._group_finish.get((lane, group), 0.0))
+            self._group_finish[(lane, group)] = start + 1 / self.weights.get(group, 1)
+            ticket = (start, next(self._sequence))
+            heapq.heappush(self._waiting[lane], ticket)
+            self._condition.notify_all()
+            while self._in_use >= self.slots or self._head() != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiting[lane])
+            self._virtual_time[lane] = start
+            self._in_use += 1
+            # 还有空位时让下一个等待者也检查一下
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "slots": self.slots,
+                "in_use": self._in_use,
+                "waiting": {name: len(heap) for name, heap in zip(self.LANES, self._waiting)},
+            }
+
+
+def get_submission_priority(submission, bulk=False):
+    """返回 (通道, 班级)：离作业截止不到 JUDGE_DEADLINE_BOOST_WINDOW 秒的提交优先判"""
+    now = timezone.now()
+    assignment = Assignment.objects.filter(
+        class_group__members__student_id=submission.user_id,
+        problem_list__problems__problem_id=submission.problem_id,
+        release_date__lte=now,
+        due_date__gte=now,
+    ).order_by('due_date').values('class_group_id', 'due_date').first()
+    if bulk:
+        lane = JudgeScheduler.BULK
+    elif assignment and assignment['due_date'] - now <= timedelta(seconds=settings.JUDGE_DEADLINE_BOOST_WINDOW):
+        lane = JudgeScheduler.DEADLINE
+    else:
+        lane = JudgeScheduler.GRADED
+    if assignment:
+        return lane, assignment['class_group_id']
+    return lane, get_class_group_id(submission.user_id)
+
+
+def get_interactive_priority(user):
+    return JudgeScheduler.INTERACTIVE, get_class_group_id(user.id)
+
+
+def get_class_group_id(user_id):
+    return ClassMember.objects.filter(student_id=user_id).order_by('id').values_list('class_group_id', flat=True).first()
+
+
+SCHEDULER = JudgeScheduler(slots=settings.JUDGE_SCHEDULER_SLOTS, weights=settings.JUDGE_SCHEDULER_CLASS_WEIGHTS)
@@ -1,12 +1,67 @@
 from rest_framework import serializers
-from .models import Problem, TestCase, Submission, TestCaseResult, ProblemMessage
+from .models import Problem, TestCase, Submission, TestCaseResult, ProblemStats, RejudgeJob, ProblemMessage
 from chat.models import Message
 
+class SparseFieldsMixin:
+    """
+    支持只序列化部分字段（如 ?fields=id,status），列表接口可以借此跳过 src、output 等大字段。
+    model_fields 记录序列化字段依赖的模型字段，配合 only() 只查询需要的列。
+    """
+    model_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value):
+        fields = [name.strip() for name in (value or '').split(',')]
+        return [name for name in fields if name in cls.Meta.fields]
+
+    @classmethod
+    def get_model_fields(cls, fields=None):
+        model_fields = {'id'}
+        for name in fields or cls.Meta.fields:
+            model_fields.update(cls.model_fields.get(name, [name]))
+        return list(model_fields)
+
+class ProblemStatsSerializer(serializers.ModelSerializer):
+    acceptance_rate = serializers.SerializerMethodField(read_only=True)
+    verdicts = serializers.SerializerMethodField(read_only=True)
+    cpu_time = serializers.SerializerMethodField(read_only=True)
+    memory = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = ProblemStats
+        fields = ['attempts', 'accepted_count', 'attempted_users', 'accepted_users', 'acceptance_rate', 'verdicts', 'cpu_time', 'memory', 'updated_at']
+        read_only_fields = fields
+
+    @staticmethod
+    def to_percentiles(sketch):
+        return {f'p{int(q * 100)}': sketch.quantile(q) for q in (0.5, 0.9, 0.99)}
+
+    def get_acceptance_rate(self, obj):
+        return obj.accepted_count / obj.attempts if obj.attempts else None
+
+    def get_verdicts(self, obj):
+        return obj.get_verdicts()
+
+    def get_cpu_time(self, obj):
+        return self.to_percentiles(obj.get_cpu_time_sketch())
+
+    def get_memory(self, obj):
+        return self.to_percentiles(obj.get_memory_sketch())
+
 class ProblemSerializer(serializers.ModelSerializer):
+    stats = ProblemStatsSerializer(read_only=True)
+
     class Meta:
         model = Problem
-        fields = ['id', 'title', 'description', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'description', 'time_limit', 'memory_limit', 'spj_version', 'stats', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'spj_version', 'created_at', 'updated_at']
 
 class TestCaseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,10 +69,16 @@ class TestCaseSerializer(serializers.ModelSerializer):
         fields = ['id', 'ordinal', 'title', 'input', 'output']
         read_only_fields = ['id', 'ordinal']
 
-class SubmissionSerializer(serializers.ModelSerializer):
+class SubmissionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     username = serializers.SerializerMethodField(read_only=True)
     status = serializers.SerializerMethodField(read_only=True)
     message = serializers.SerializerMethodField(read_only=True)
+    
+    model_fields = {
+        'username': ['user', 'user__username'],
+        'status': ['judge_status', 'err', 'success_count', 'total_count'],
+        'message': ['judge_status', 'err', 'error_reason', 'success_count', 'total_count'],
+    }
 
     class Meta:
         model = Submission
@@ -28,6 +89,9 @@ class SubmissionSerializer(serializers.ModelSerializer):
         return obj.user.username
 
     def get_status(self, obj):
+        if obj.judge_status != Submission.JudgeStatus.FINISHED:
+            return obj.judge_status
+        
         if obj.err:
             return obj.err
         
@@ -39,18 +103,26 @@ class SubmissionSerializer(serializers.ModelSerializer):
             return "PartiallyAccepted"
     
     def get_message(self, obj):
+        if obj.judge_status != Submission.JudgeStatus.FINISHED:
+            return None
+        
         if obj.err:
             return obj.error_reason
         
         return f"{obj.success_count} / {obj.total_count}"
 
-class TestCaseResultSerializer(serializers.ModelSerializer):
+class TestCaseResultSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     status = serializers.SerializerMethodField(read_only=True)
     message = serializers.SerializerMethodField(read_only=True)
     
+    model_fields = {
+        'status': ['result'],
+        'message': ['result', 'output', 'cpu_time', 'real_time', 'memory', 'exit_code', 'signal', 'error'],
+    }
+    
     class Meta:
         model = TestCaseResult
-        fields = ['id', 'submission', 'test_case', 'status', 'message', 'output']
+        fields = ['id', 'submission', 'test_case', 'status', 'message', 'output', 'output_truncated', 'output_diff']
     
     @staticmethod
     def to_status(result):
@@ -97,13 +169,26 @@ class TestCaseResultSerializer(serializers.ModelSerializer):
         return self.to_status(result=obj.result)
     
     def get_message(self, obj):
-        return self.to_message(result=obj.result, output=obj.output, cpu_time=obj.cpu_time, real_time=obj.real_time, memory=obj.memory, exit_code=obj.exit_code, signal=obj.signal, error=obj.error)
+        # 只有明确要求时才加载（并解压）完整输出
+        output = obj.get_full_output() if self.context.get('full_output') else obj.output
+        return self.to_message(result=obj.result, output=output, cpu_time=obj.cpu_time, real_time=obj.real_time, memory=obj.memory, exit_code=obj.exit_code, signal=obj.signal, error=obj.error)
+
+
+class RejudgeJobSerializer(serializers.ModelSerializer):
+    problem_ids = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = RejudgeJob
+        fields = ['id', 'problem_ids', 'status', 'total_count', 'done_count', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
 
+    def get_problem_ids(self, obj):
+        return obj.get_problem_ids()
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'role', 'content', 'created_at']
+        fields = ['id', 'conversation', 'role', 'content', 'status', 'created_at']
 
 class ProblemMessageSerializer(serializers.ModelSerializer):
     message = MessageSerializer(read_only=True)
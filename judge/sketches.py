@@ -0,0 +1,67 @@
+import json
+import math
+
+
+class QuantileSketch:
+    """
+    对数分桶的分位数草图（思路同 DDSketch）：每个桶覆盖 [gamma^(i-1), gamma^i)，
+    估计出的分位数相对误差不超过 alpha。桶的计数直接相加即可合并，也可以减掉，
+    因此可以随每次判题增量更新，不必保存原始数据。
+    """
+    def __init__(self, alpha=0.01, buckets=None, zero_count=0):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.buckets = buckets or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.buckets.values())
+
+    def _index(self, value):
+        return math.ceil(math.log(value, self.gamma))
+
+    def add(self, value, count=1):
+        if value <= 0:
+            self.zero_count += count
+            return
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        if self.buckets[index] <= 0:
+            del self.buckets[index]
+
+    def remove(self, value):
+        self.add(value, count=-1)
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q):
+        count = self.count
+        if count <= 0:
+            return None
+        rank = q * (count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # 取桶的中点，保证相对误差在 alpha 以内
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_json(self):
+        return json.dumps({"alpha": self.alpha, "zero_count": self.zero_count, "buckets": self.buckets})
+
+    @classmethod
+    def from_json(cls, value):
+        if not value:
+            return cls()
+        data = json.loads(value)
+        buckets = {int(index): count for index, count in data.get("buckets", {}).items()}
+        return cls(alpha=data.get("alpha", 0.01), buckets=buckets, zero_count=data.get("zero_count", 0))
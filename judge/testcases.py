@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+import zipfile
+
+from django.conf import settings
+from django.db import models
+
+from .models import Problem, TestCase
+
+
+class TestCaseImportError(ValueError):
+    pass
+
+
+def get_test_case_version(test_cases):
+    """根据测试用例的内容计算版本号，内容不变则版本号不变"""
+    digest = hashlib.sha256()
+    for case in test_cases:
+        for value in (str(case.ordinal), case.input, case.output):
+            digest.update(value.encode('utf-8'))
+            digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _iterate(test_cases):
+    # 测试用例很多时逐批从数据库读取，不一次性全部载入内存
+    if isinstance(test_cases, models.QuerySet):
+        return test_cases.iterator(chunk_size=settings.JUDGE_TEST_CASE_BATCH_SIZE)
+    return iter(test_cases)
+
+
+def _write(path, content):
+    data = content.encode('utf-8')
+    with open(path, 'wb') as file:
+        file.write(data)
+    return len(data)
+
+
+def export_test_cases(problem, test_cases=None):
+    """
+    把一道题的测试用例导出到判题机的测试用例目录（JUDGE_TEST_CASE_DIR），
+    目录结构与 JudgeServer 的要求一致：1.in、1.out、...，以及记录 md5 的 info 文件。
+    每个版本一个目录，已经存在的版本不会重复导出。
+    返回 test_case_id；没有配置目录或者没有测试用例时返回 None，判题时退回到随请求发送测试用例。
+    """
+    test_case_dir = settings.JUDGE_TEST_CASE_DIR
+    if test_cases is None:
+        test_cases = TestCase.objects.filter(problem=problem).order_by('ordinal')
+    if isinstance(test_cases, models.QuerySet):
+        empty = not test_cases.exists()
+    else:
+        test_cases = list(test_cases)
+        empty = not test_cases
+    if not test_case_dir or empty:
+        test_case_id = None
+    else:
+        test_case_id = f'problem-{problem.id}-{get_test_case_version(_iterate(test_cases))}'
+        if problem.spj_version:
+            # info 里记录了是否特判，开关特判时需要换一个目录
+            test_case_id += '-spj'
+        target = os.path.join(test_case_dir, test_case_id)
+        if not os.path.isdir(target):
+            # 先写到临时目录再改名，判题机不会读到写了一半的目录
+            temp = os.path.join(test_case_dir, f'.{test_case_id}.{uuid.uuid4().hex}')
+            os.makedirs(temp)
+            try:
+                info = {"test_case_number": 0, "spj": bool(problem.spj_version), "test_cases": {}}
+                for index, case in enumerate(_iterate(test_cases), start=1):
+                    info["test_case_number"] = index
+                    input_name, output_name = f'{index}.in', f'{index}.out'
+                    info["test_cases"][str(index)] = {
+                        "input_name": input_name,
+                        "input_size": _write(os.path.join(temp, input_name), case.input),
+                        "output_name": output_name,
+                        "output_size": _write(os.path.join(temp, output_name), case.output),
+                        "output_md5": hashlib.md5(case.output.encode('utf-8')).hexdigest(),
+                        "stripped_output_md5": hashlib.md5(case.output.rstrip().encode('utf-8')).hexdigest(),
+                    }
+                with open(os.path.join(temp, 'info'), 'w', encoding='utf-8') as file:
+                    json.dump(info, file)
+                os.rename(temp, target)
+            except OSError:
+                # 并发导出同一个版本时，别人已经改名成功了
+                shutil.rmtree(temp, ignore_errors=True)
+                if not os.path.isdir(target):
+                    raise
+
+    Problem.objects.filter(id=problem.id).update(test_case_id=test_case_id)
+    problem.test_case_id = test_case_id
+    return test_case_id
+
+
+def _decode(name, data):
+    if len(data) > settings.JUDGE_TEST_CASE_MAX_SIZE:
+        raise TestCaseImportError(f"{name} is larger than {settings.JUDGE_TEST_CASE_MAX_SIZE} bytes")
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise TestCaseImportError(f"{name} is not valid UTF-8")
+
+
+def parse_test_cases_jsonl(file):
+    """逐行解析上传的 JSONL 文件，每行一个 {"input": ..., "output": ..., "title": ...}"""
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise TestCaseImportError(f"Line {line_number} is not valid JSON: {e}")
+        if not isinstance(data, dict) or not isinstance(data.get('input'), str) or not isinstance(data.get('output'), str):
+            raise TestCaseImportError(f"Line {line_number} must be an object with string 'input' and 'output'")
+        for key in ('input', 'output'):
+            if len(data[key].encode('utf-8')) > settings.JUDGE_TEST_CASE_MAX_SIZE:
+                raise TestCaseImportError(f"The {key} on line {line_number} is larger than {settings.JUDGE_TEST_CASE_MAX_SIZE} bytes")
+        yield {"title": str(data.get('title') or '')[:255], "input": data['input'], "output": data['output']}
+
+
+def parse_test_cases_zip(file):
+    """解析 JudgeServer 格式的 zip：1.in、1.out、2.in、2.out...，按编号顺序逐个读取"""
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise TestCaseImportError("Not a valid zip file")
+    members = {}
+    for info in archive.infolist():
+        match = re.fullmatch(r'(\d+)\.(in|out)', os.path.basename(info.filename))
+        if match and not info.is_dir():
+            members.setdefault(int(match.group(1)), {})[match.group(2)] = info
+    with archive:
+        for number in sorted(members):
+            pair = members[number]
+            if set(pair) != {'in', 'out'}:
+                raise TestCaseImportError(f"Test case {number} must have both {number}.in and {number}.out")
+            case = {"title": ""}
+            for suffix, key in (('in', 'input'), ('out', 'output')):
+                info = pair[suffix]
+                # 先看声明的大小，再限制实际读取的长度，防止压缩炸弹
+                if info.file_size > settings.JUDGE_TEST_CASE_MAX_SIZE:
+                    raise TestCaseImportError(f"{info.filename} is larger than {settings.JUDGE_TEST_CASE_MAX_SIZE} bytes")
+                with archive.open(info) as member:
+                    case[key] = _decode(info.filename, member.read(settings.JUDGE_TEST_CASE_MAX_SIZE + 1))
+            yield case
+
+
+def update_test_cases(problem, test_cases):
+    """
+    按编号和内容 hash 把一道题的测试用例更新为 test_cases（依次为第 1、2、... 个）：
+    没变的不动，改了的原地更新（保留主键和历史的测试结果），多出来的插入，少了的删除。
+    写入按 JUDGE_TEST_CASE_BATCH_SIZE 分批进行；需要在事务里调用，出错时整个更新回滚。
+    """
+    stored = {
+        ordinal: (case_id, content_hash, title)
+        for ordinal, case_id, content_hash, title in TestCase.objects.filter(problem=problem).values_list('ordinal', 'id', 'content_hash', 'title')
+    }
+    counts = {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    to_create, to_update = [], []
+
+    def flush(force=False):
+        nonlocal to_create, to_update
+        if to_create and (force or len(to_create) >= settings.JUDGE_TEST_CASE_BATCH_SIZE):
+            TestCase.objects.bulk_create(to_create)
+            to_create = []
+        if to_update and (force or len(to_update) >= settings.JUDGE_TEST_CASE_BATCH_SIZE):
+            TestCase.objects.bulk_update(to_update, ['title', 'input', 'output', 'content_hash'])
+            to_update = []
+
+    for ordinal, case in enumerate(test_cases, start=1):
+        if ordinal > settings.JUDGE_TEST_CASE_MAX_COUNT:
+            raise TestCaseImportError(f"A problem can have at most {settings.JUDGE_TEST_CASE_MAX_COUNT} test cases")
+        title = case.get('title') or ''
+        content_hash = TestCase.get_content_hash(case['input'], case['output'])
+        old = stored.pop(ordinal, None)
+        if old and old[1] == content_hash and old[2] == title:
+            counts["unchanged"] += 1
+            continue
+        test_case = TestCase(id=old[0] if old else None, problem=problem, ordinal=ordinal, title=title,
+                             input=case['input'], output=case['output'], content_hash=content_hash)
+        if old:
+            to_update.append(test_case)
+            counts["updated"] += 1
+        else:
+            to_create.append(test_case)
+            counts["created"] += 1
+        flush()
+    flush(force=True)
+
+    if stored:
+        TestCase.objects.filter(id__in=[case_id for case_id, _, _ in stored.values()]).delete()
+        counts["deleted"] = len(stored)
+    return counts
+
+
+class _StreamBuffer:
+    """只能追加写入的缓冲区，zipfile 写进来的数据由生成器随时取走"""
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_test_cases_jsonl(test_cases):
+    for case in _iterate(test_cases):
+        yield json.dumps({"ordinal": case.ordinal, "title": case.title, "input": case.input, "output": case.output}, ensure_ascii=False) + '\n'
+
+
+def stream_test_cases_zip(test_cases):
+    """边压缩边输出，配合 StreamingHttpResponse 使用，不需要先在内存或磁盘上生成整个 zip"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for case in _iterate(test_cases):
+            for suffix, content in (('in', case.input), ('out', case.output)):
+                with archive.open(f'{case.ordinal}.{suffix}', 'w') as member:
+                    member.write(content.encode('utf-8'))
+            yield buffer.drain()
+    yield buffer.drain()
@@ -1,3 +1,810 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from chat.models import Message
+from assign.models import ClassGroup, ClassMember, Assignment, Homework
+from design.models import ProblemList, ProblemListItem
+from .backends import JudgeBackendRegistry, SpjCompileError
+from .caches import COMPILE_CACHE, VerdictCache
+from .fakeserver import FakeJudgeServer, parse_verdicts
+from .judging import LANGUAGES, get_limits, get_output_diff, get_spj_kwargs, judge_submission, run_judge, run_judge_sharded, save_judge_result
+from .JudgeServer.client.Python.client import JudgeServerClient, JudgeServerClientError
+from .JudgeServer.client.Python.languages import cpp_lang_config, py3_lang_config
+from .models import Problem, TestCase as ProblemTestCase, Submission, TestCaseResult, ProblemStats, RejudgeJob
+from .rejudge import create_rejudge_job, rejudge_submission, run_rejudge_job
+from .scheduler import JudgeScheduler, get_submission_priority
+from .judging import claim_submission, reset_stale_submissions
+from .ratelimit import CacheBackend, LocalBackend
+from .workers import JudgeQueue
+from .sketches import QuantileSketch
 
 # Create your tests here.
+class SubmissionListQueryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        self.test_cases = [
+            ProblemTestCase.objects.create(problem=self.problem, ordinal=i, input=f'{i} {i}', output=str(2 * i))
+            for i in range(1, 4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_submissions(self, count):
+        for _ in range(count):
+            submission = Submission.objects.create(user=self.user, problem=self.problem, src='print(1)', lang='Python3',
+                                                   judge_status=Submission.JudgeStatus.FINISHED, total_count=3, success_count=3)
+            TestCaseResult.objects.bulk_create([
+                TestCaseResult(submission=submission, test_case=case, result=TestCaseResult.ResultCode.SUCCESS,
+                               cpu_time=1, real_time=1, memory=1, exit_code=0, signal=0, error=0)
+                for case in self.test_cases
+            ])
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_submissions_query_count_is_constant_per_page(self):
+        url = f'/judge/problems/{self.problem.id}/submissions/?page_size=5&fields=id,username,status'
+        self._create_submissions(5)
+        few, _ = self._count_queries(url)
+        self._create_submissions(20)
+        many, response = self._count_queries(url)
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'username', 'status'})
+
+    def test_results_query_count_is_constant_per_page(self):
+        url = f'/judge/problems/{self.problem.id}/results/?page_size=10&fields=id,test_case,status'
+        self._create_submissions(1)
+        few, _ = self._count_queries(url)
+        self._create_submissions(10)
+        many, response = self._count_queries(url)
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_submissions_cursor_pagination_walks_all_pages(self):
+        self._create_submissions(7)
+        url = f'/judge/problems/{self.problem.id}/submissions/?page_size=3&fields=id'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [submission['id'] for submission in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+
+    def test_results_cursor_pagination_walks_all_pages(self):
+        # 每个 ordinal 都有 4 条结果，翻页时要靠 id 区分
+        self._create_submissions(4)
+        url = f'/judge/problems/{self.problem.id}/results/?page_size=5&fields=id'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [result['id'] for result in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(sorted(ids), sorted(TestCaseResult.objects.values_list('id', flat=True)))
+
+
+class ProblemTokensTests(TestCase):
+    def test_description_tokens_are_counted_lazily(self):
+        problem = Problem.objects.bulk_create([Problem(title='A + B', description='add two numbers')])[0]
+        self.assertEqual(Problem.objects.get(id=problem.id).description_tokens, 0)
+        self.assertEqual(problem.get_description_tokens(), Message.count_tokens('add two numbers'))
+        self.assertEqual(Problem.objects.get(id=problem.id).description_tokens, problem.description_tokens)
+
+
+class VerdictCacheTests(TestCase):
+    def test_only_line_endings_are_normalized(self):
+        normalize_src = VerdictCache.normalize_src
+        self.assertEqual(normalize_src('a = 1\r\nprint(a)\r'), normalize_src('a = 1\nprint(a)\n'))
+        # 三引号字符串里的行尾空格、反斜杠后的空格都会改变程序的含义
+        self.assertNotEqual(normalize_src('s = """a \n"""'), normalize_src('s = """a\n"""'))
+        self.assertNotEqual(normalize_src('x = 1 + \\ \n2'), normalize_src('x = 1 + \\\n2'))
+
+
+class CompileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _run(self, src, judge):
+        with mock.patch('judge.judging.CLIENT') as client:
+            client.judge.return_value = judge
+            result = run_judge(src, cpp_lang_config, max_cpu_time=1000, max_memory=1024, test_case=[{"input": "", "output": ""}])
+        return result, client.judge.call_count
+
+    def test_compile_errors_are_reused(self):
+        compile_error = {"err": "CompileError", "data": "expected ';'"}
+        self.assertEqual(self._run('int main() {}}', compile_error), (compile_error, 1))
+        # 同一份代码再次运行时不再调用判题机
+        self.assertEqual(self._run('int main() {}}', {"err": None, "data": []}), (compile_error, 0))
+        self.assertEqual(self._run('int main() {} }', compile_error), (compile_error, 1))
+        self.assertEqual(COMPILE_CACHE.counter.stats()["hits"], 1)
+
+    def test_successful_compiles_are_not_cached(self):
+        accepted = {"err": None, "data": [{"result": TestCaseResult.ResultCode.SUCCESS, "output": ""}]}
+        self.assertEqual(self._run('int main() {}', accepted), (accepted, 1))
+        self.assertEqual(self._run('int main() {}', accepted), (accepted, 1))
+        # 判题机自身的错误也不缓存
+        system_error = {"err": "JudgeClientError", "data": "internal error"}
+        self.assertEqual(self._run('int main() { x }', system_error), (system_error, 1))
+        self.assertEqual(self._run('int main() { x }', system_error), (system_error, 1))
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_denied_request_takes_no_tokens(self):
+        for backend in (LocalBackend(), CacheBackend()):
+            with mock.patch('judge.ratelimit.time.monotonic', return_value=1000), mock.patch('judge.ratelimit.time.time', return_value=1000):
+                user, classmate, group = ('user:1', 1, 0.001), ('user:2', 5, 0.001), ('class:1', 3, 0.001)
+                self.assertEqual(backend.take([user, group]), 0)
+                # 这个学生的桶空了，反复重试也不会消耗班级的令牌
+                for _ in range(5):
+                    self.assertGreater(backend.take([user, group]), 0)
+                self.assertEqual(backend.take([classmate, group]), 0)
+                self.assertEqual(backend.take([classmate, group]), 0)
+                self.assertGreater(backend.take([classmate, group]), 0)
+
+    def test_leaked_in_flight_slots_expire(self):
+        backend = CacheBackend()
+
+        def acquire(now):
+            with self.settings(JUDGE_IN_FLIGHT_TTL=60), mock.patch('judge.ratelimit.time.time', return_value=now):
+                return backend.acquire('in_flight')
+
+        # 模拟进程被杀掉，两个名额都没有归还
+        acquire(6000)
+        self.assertEqual(acquire(6000)[1], 2)
+        lease, count = acquire(6060)
+        self.assertEqual(count, 3)
+        backend.release(lease)
+        # 两段时间之后，漏掉的名额不再计入
+        self.assertEqual(acquire(6120)[1], 1)
+
+
+class JudgeQueueRecoveryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+
+    def _submit(self, judge_status, age):
+        submission = Submission.objects.create(user=self.user, problem=self.problem, src='print(1)', lang='Python3', judge_status=judge_status)
+        moment = timezone.now() - timedelta(seconds=age)
+        Submission.objects.filter(id=submission.id).update(created_at=moment, updated_at=moment)
+        return submission.id
+
+    def test_pending_and_stale_submissions_are_requeued_in_order(self):
+        second = self._submit(Submission.JudgeStatus.PENDING, 60)
+        first = self._submit(Submission.JudgeStatus.PENDING, 120)
+        stale = self._submit(Submission.JudgeStatus.JUDGING, 3600)
+        live = self._submit(Submission.JudgeStatus.JUDGING, 10)
+
+        judge_queue = JudgeQueue(workers=1)
+        with self.settings(JUDGE_STALE_TIMEOUT=600):
+            judge_queue._recover()
+        self.assertEqual([submission_id for _, _, submission_id in sorted(judge_queue._queue.queue)], [stale, first, second])
+        self.assertEqual(Submission.objects.get(id=live).judge_status, Submission.JudgeStatus.JUDGING)
+        with self.settings(JUDGE_STALE_TIMEOUT=600):
+            self.assertEqual(reset_stale_submissions(), 0)
+
+    def test_started_once_per_process(self):
+        judge_queue = JudgeQueue(workers=2)
+
+        def wait_recovered(count):
+            for _ in range(200):
+                if recover.call_count >= count:
+                    return
+                time.sleep(0.01)
+            self.fail("queue was not recovered")
+
+        with mock.patch.object(JudgeQueue, '_work'), mock.patch.object(JudgeQueue, '_recover') as recover:
+            judge_queue.start()
+            judge_queue.start()
+            wait_recovered(1)
+            # fork 出来的子进程里没有 worker 线程，要重新启动
+            with mock.patch('judge.workers.os.getpid', return_value=-1):
+                judge_queue.start()
+            wait_recovered(2)
+            time.sleep(0.05)
+        self.assertEqual(recover.call_count, 2)
+        self.assertEqual(len(judge_queue._threads), 2)
+
+
+class SubmissionEventsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        self.submission = Submission.objects.create(user=self.user, problem=self.problem, src='print(1)', lang='Python3',
+                                                    judge_status=Submission.JudgeStatus.FINISHED)
+        self.url = f'/judge/problems/{self.problem.id}/submissions/{self.submission.id}/events/'
+
+    async def _get(self, url):
+        return await self.async_client.get(url, headers={'Authorization': f'Token {self.token.key}'})
+
+    async def test_stream_types(self):
+        for query, content_type, first_line in [('', 'text/event-stream', b'event: status'), ('?stream=sse', 'text/event-stream', b'event: status'),
+                                                ('?stream=ndjson', 'application/x-ndjson', b'{"event": "status"')]:
+            response = await self._get(self.url + query)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            self.assertEqual(response['Content-Type'], content_type)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+            self.assertTrue(content.startswith(first_line), content)
+            self.assertIn(b'finished', content)
+
+    async def test_compiled_event_follows_reported_compile_result(self):
+        for judge, success in [({"err": "CompileError", "data": "syntax error"}, False), ({"err": None, "data": []}, True)]:
+            submission = await Submission.objects.acreate(user=self.user, problem=self.problem, src='print(1)', lang='Python3')
+            await sync_to_async(save_judge_result)(submission, [], judge, record_stats=False)
+            response = await self._get(f'/judge/problems/{self.problem.id}/submissions/{submission.id}/events/?stream=ndjson')
+            lines = [json.loads(line) async for line in response.streaming_content]
+            self.assertEqual([line["event"] for line in lines], ['status', 'compiled', 'finished'])
+            self.assertEqual(lines[1]["data"], {"success": success})
+
+    def test_wsgi_streaming_is_rejected(self):
+        # WSGI 下推送会让每个连接占用一个 worker，直接拒绝，提交也不会创建
+        response = self.client.get(self.url + '?stream=ndjson', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 406)
+        response = self.client.post(f'/judge/problems/{self.problem.id}/submit/?stream=sse', {'src': 'print(1)', 'lang': 'Python3'},
+                                    HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(Submission.objects.count(), 1)
+
+
+class ProblemStatsTests(TestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(username=f'student{i}', full_name='Student', password='password') for i in range(2)]
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        self.test_cases = [ProblemTestCase.objects.create(problem=self.problem, ordinal=i, input='1 1', output='2') for i in range(1, 3)]
+
+    def _judge(self, user, judge):
+        submission = Submission.objects.create(user=user, problem=self.problem, src='print(2)', lang='Python3')
+        save_judge_result(submission, self.test_cases, judge)
+
+    @staticmethod
+    def _results(*codes, cpu_time=10, memory=1024):
+        return {"err": None, "data": [
+            {"result": code, "cpu_time": cpu_time, "real_time": cpu_time, "memory": memory, "exit_code": 0, "signal": 0, "error": 0, "output": "2"}
+            for code in codes
+        ]}
+
+    def test_stats_are_updated_incrementally(self):
+        self._judge(self.users[0], {"err": "CompileError", "data": "error"})
+        self._judge(self.users[0], self._results(TestCaseResult.ResultCode.SUCCESS, TestCaseResult.ResultCode.WRONG_ANSWER))
+        self._judge(self.users[0], self._results(TestCaseResult.ResultCode.SUCCESS, TestCaseResult.ResultCode.SUCCESS, cpu_time=20))
+        self._judge(self.users[0], self._results(TestCaseResult.ResultCode.SUCCESS, TestCaseResult.ResultCode.SUCCESS, cpu_time=30))
+        self._judge(self.users[1], self._results(TestCaseResult.ResultCode.CPU_TIME_LIMIT_EXCEEDED, TestCaseResult.ResultCode.SUCCESS))
+
+        stats = ProblemStats.objects.get(problem=self.problem)
+        self.assertEqual(stats.attempts, 5)
+        self.assertEqual(stats.accepted_count, 2)
+        self.assertEqual(stats.attempted_users, 2)
+        self.assertEqual(stats.accepted_users, 1)
+        self.assertEqual(stats.get_verdicts(), {"CompileError": 1, "WrongAnswer": 1, "Accepted": 2, "TimeLimitExceeded": 1})
+        self.assertEqual(stats.get_cpu_time_sketch().count, 4)
+
+        # 从提交表重新计算的结果应该与增量更新的一致
+        call_command('rebuild_problem_stats', self.problem.id, stdout=StringIO())
+        rebuilt = ProblemStats.objects.get(problem=self.problem)
+        for field in ['attempts', 'accepted_count', 'attempted_users', 'accepted_users']:
+            self.assertEqual(getattr(rebuilt, field), getattr(stats, field))
+        self.assertEqual(rebuilt.get_verdicts(), stats.get_verdicts())
+
+    def test_sketch_quantiles_are_mergeable(self):
+        left, right, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in range(1, 1001):
+            (left if value % 2 else right).add(value)
+            whole.add(value)
+        left.merge(right)
+        self.assertEqual(left.buckets, whole.buckets)
+        for q in (0.5, 0.9, 0.99):
+            expected = 1 + q * 999
+            self.assertLessEqual(abs(left.quantile(q) - expected) / expected, 0.02)
+
+
+class JudgeLimitsTests(TestCase):
+    def test_language_multipliers(self):
+        problem = Problem.objects.create(title='A + B', description='a + b', time_limit=2000, memory_limit=256)
+        expected = {
+            "C": (2000, 256),
+            "C++": (2000, 256),
+            "Java": (4000, 512),
+            "Python2": (6000, 256),
+            "Python3": (6000, 256),
+            "Go": (2000, 512),
+            "PHP": (6000, 512),
+            "JavaScript": (6000, 512),
+        }
+        self.assertEqual(set(expected), set(LANGUAGES))
+        for lang, (cpu_time, memory) in expected.items():
+            with self.subTest(lang=lang):
+                self.assertEqual(get_limits(problem, lang), (cpu_time, memory * 1024 * 1024))
+
+    def test_defaults(self):
+        # 没有设置限制的题目用默认的 1 秒、128 MB；不认识的语言不放宽
+        problem = Problem.objects.create(title='A + B', description='a + b')
+        self.assertEqual(get_limits(problem, 'C'), (1000, 128 * 1024 * 1024))
+        self.assertEqual(get_limits(problem, 'Python3'), (3000, 128 * 1024 * 1024))
+        self.assertEqual(get_limits(problem, 'Brainfuck'), (1000, 128 * 1024 * 1024))
+
+
+class OutputRetentionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.problem = Problem.objects.create(title='Lines', description='print 1..100')
+        expected = '\n'.join(str(i) for i in range(1, 101)) + '\n'
+        self.test_cases = [
+            ProblemTestCase.objects.create(problem=self.problem, ordinal=1, input='', output=expected),
+            ProblemTestCase.objects.create(problem=self.problem, ordinal=2, input='', output=expected),
+        ]
+        self.submission = Submission.objects.create(user=self.user, problem=self.problem, src='', lang='Python3')
+        self.accepted = expected + 'é' * 100
+        self.wrong = expected.replace('\n50\n', '\n51\n')
+
+    def _save(self):
+        judge = {"err": None, "data": [
+            {"result": code, "cpu_time": 1, "real_time": 1, "memory": 1, "exit_code": 0, "signal": 0, "error": 0, "output": output}
+            for code, output in [(TestCaseResult.ResultCode.SUCCESS, self.accepted), (TestCaseResult.ResultCode.WRONG_ANSWER, self.wrong)]
+        ]}
+        save_judge_result(self.submission, self.test_cases, judge, record_stats=False)
+        return [TestCaseResult.objects.get(submission=self.submission, test_case=case) for case in self.test_cases]
+
+    def test_accepted_output_is_dropped_by_default(self):
+        accepted, wrong = self._save()
+        self.assertIsNone(accepted.output)
+        self.assertEqual(wrong.output, self.wrong)
+        self.assertFalse(wrong.output_truncated)
+
+    def test_long_output_is_truncated_and_compressed(self):
+        with self.settings(JUDGE_KEEP_ACCEPTED_OUTPUT=True, JUDGE_OUTPUT_MAX_LENGTH=64, JUDGE_OUTPUT_COMPRESS=True):
+            accepted, wrong = self._save()
+        self.assertTrue(accepted.output_truncated)
+        self.assertEqual(accepted.output, self.accepted[:64])
+        self.assertEqual(accepted.get_full_output(), self.accepted)
+        self.assertEqual(wrong.get_full_output(), self.wrong)
+
+        with self.settings(JUDGE_KEEP_ACCEPTED_OUTPUT=True, JUDGE_OUTPUT_MAX_LENGTH=64, JUDGE_OUTPUT_COMPRESS=False):
+            self.submission.results.all().delete()
+            accepted, _ = self._save()
+        self.assertTrue(accepted.output_truncated)
+        self.assertIsNone(accepted.output_blob)
+        self.assertEqual(accepted.get_full_output(), self.accepted[:64])
+
+    def test_wrong_answer_stores_diff_around_first_difference(self):
+        with self.settings(JUDGE_OUTPUT_DIFF_CONTEXT=1):
+            _, wrong = self._save()
+        self.assertEqual(wrong.output_diff, '--- expected\n+++ actual\n@@ -49,3 +49,3 @@\n 49\n-50\n+51\n 51')
+        self.assertEqual(get_output_diff('1\n2\n', '1\n2'), None)
+
+
+class TestCaseExportTests(TestCase):
+    def setUp(self):
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        ProblemTestCase.objects.create(problem=self.problem, ordinal=1, input='1 2\n', output='3\n')
+        ProblemTestCase.objects.create(problem=self.problem, ordinal=2, input='2 2\n', output='4 \n')
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.test_case_dir = temp.name
+
+    def _sync(self):
+        stdout = StringIO()
+        with self.settings(JUDGE_TEST_CASE_DIR=self.test_case_dir):
+            call_command('sync_test_cases', self.problem.id, stdout=stdout)
+        self.problem.refresh_from_db()
+        self.assertEqual(stdout.getvalue(), f"Problem {self.problem.id}: {self.problem.test_case_id}\n")
+        return self.problem.test_case_id
+
+    def test_export_writes_judge_server_layout(self):
+        test_case_id = self._sync()
+        directory = os.path.join(self.test_case_dir, test_case_id)
+        self.assertEqual(sorted(os.listdir(self.test_case_dir)), [test_case_id])
+        self.assertEqual(sorted(os.listdir(directory)), ['1.in', '1.out', '2.in', '2.out', 'info'])
+        with open(os.path.join(directory, '2.out'), encoding='utf-8') as file:
+            self.assertEqual(file.read(), '4 \n')
+        with open(os.path.join(directory, 'info'), encoding='utf-8') as file:
+            info = json.load(file)
+        self.assertEqual(info["test_case_number"], 2)
+        self.assertFalse(info["spj"])
+        self.assertEqual(info["test_cases"]["2"], {
+            "input_name": "2.in",
+            "input_size": 4,
+            "output_name": "2.out",
+            "output_size": 3,
+            "output_md5": hashlib.md5(b'4 \n').hexdigest(),
+            "stripped_output_md5": hashlib.md5(b'4').hexdigest(),
+        })
+
+    def test_test_case_id_changes_only_with_content(self):
+        first = self._sync()
+        self.assertEqual(self._sync(), first)
+        # 改了标题，内容没变
+        ProblemTestCase.objects.filter(problem=self.problem, ordinal=1).update(title='sample')
+        self.assertEqual(self._sync(), first)
+
+        ProblemTestCase.objects.filter(problem=self.problem, ordinal=1).update(output='4\n')
+        second = self._sync()
+        self.assertNotEqual(second, first)
+        # 旧版本的目录留着，正在用它判题的请求不受影响
+        self.assertEqual(sorted(os.listdir(self.test_case_dir)), sorted([first, second]))
+
+        ProblemTestCase.objects.filter(problem=self.problem).delete()
+        self.assertIsNone(self._sync())
+
+    def test_sync_requires_test_case_dir(self):
+        with self.settings(JUDGE_TEST_CASE_DIR=None), self.assertRaises(CommandError):
+            call_command('sync_test_cases', stdout=StringIO())
+
+
+class ShardedJudgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        for i in range(1, 8):
+            ProblemTestCase.objects.create(problem=self.problem, ordinal=i, input=str(i), output=str(i))
+
+    @staticmethod
+    def _echo(src, lang_config, test_case=None, **kwargs):
+        # 前面的分片判得慢，让后面的分片先返回
+        time.sleep(0.05 / int(test_case[0]["input"]))
+        return {"err": None, "data": [
+            {"result": TestCaseResult.ResultCode.SUCCESS, "cpu_time": 1, "real_time": 1, "memory": 1, "exit_code": 0, "signal": 0, "error": 0, "output": case["input"]}
+            for case in test_case
+        ]}
+
+    def test_shards_are_merged_in_order(self):
+        test_case = [{"input": str(i), "output": str(i)} for i in range(1, 8)]
+        shards = []
+        with mock.patch('judge.judging.run_judge', side_effect=self._echo):
+            judge = run_judge_sharded('', {}, test_case, shard_size=3, on_shard=lambda offset, data: shards.append((offset, len(data))))
+        self.assertIsNone(judge["err"])
+        self.assertEqual([result["output"] for result in judge["data"]], [str(i) for i in range(1, 8)])
+        self.assertEqual(sorted(shards), [(0, 3), (3, 3), (6, 1)])
+
+    def test_failing_shard_fails_the_whole_submission(self):
+        def fail_second(src, lang_config, test_case=None, **kwargs):
+            if test_case[0]["input"] == "4":
+                return {"err": "CompileError", "data": "compile error"}
+            return self._echo(src, lang_config, test_case)
+
+        submission = Submission.objects.create(user=self.user, problem=self.problem, src='print(1)', lang='Python3')
+        with self.settings(JUDGE_SHARD_SIZE=3), mock.patch('judge.judging.run_judge', side_effect=fail_second):
+            judge_submission(submission.id, record_stats=False)
+        submission.refresh_from_db()
+        self.assertEqual((submission.judge_status, submission.err), (Submission.JudgeStatus.FINISHED, "CompileError"))
+        # 出错之前判完的分片已经保存过，出错后要删掉
+        self.assertFalse(submission.results.exists())
+
+        test_case = [{"input": str(i), "output": str(i)} for i in range(1, 8)]
+        with mock.patch('judge.judging.run_judge', side_effect=JudgeServerClientError("no judge server")):
+            with self.assertRaises(JudgeServerClientError):
+                run_judge_sharded('', {}, test_case, shard_size=3)
+
+    def test_submission_results_follow_ordinals(self):
+        submission = Submission.objects.create(user=self.user, problem=self.problem, src='print(1)', lang='Python3')
+        with self.settings(JUDGE_SHARD_SIZE=3, JUDGE_KEEP_ACCEPTED_OUTPUT=True), mock.patch('judge.judging.run_judge', side_effect=self._echo):
+            judge_submission(submission.id, record_stats=False)
+        submission.refresh_from_db()
+        self.assertEqual((submission.success_count, submission.total_count, submission.compiled), (7, 7, True))
+        results = submission.results.order_by('test_case__ordinal').values_list('test_case__ordinal', 'output')
+        self.assertEqual(list(results), [(i, str(i)) for i in range(1, 8)])
+
+
+class RejudgeTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        self.problem = Problem.objects.create(title='A + B', description='a + b')
+        test_case = ProblemTestCase.objects.create(problem=self.problem, ordinal=1, input='1 1', output='3')
+        self.submissions = []
+        for i in range(5):
+            submission = Submission.objects.create(user=self.user, problem=self.problem, src=f'print({i} * 0 + 2)', lang='Python3',
+                                                   judge_status=Submission.JudgeStatus.FINISHED, total_count=1, success_count=0)
+            TestCaseResult.objects.create(submission=submission, test_case=test_case, result=TestCaseResult.ResultCode.WRONG_ANSWER,
+                                          cpu_time=1, real_time=1, memory=1, exit_code=0, signal=0, error=0)
+            self.submissions.append(submission)
+
+        problem_list = ProblemList.objects.create(title='List', description='')
+        item = ProblemListItem.objects.create(problem_list=problem_list, problem=self.problem, ordinal=1)
+        class_group = ClassGroup.objects.create(title='Class')
+        class_member = ClassMember.objects.create(class_group=class_group, student=self.user)
+        assignment = Assignment.objects.create(class_group=class_group, problem_list=problem_list, release_date=timezone.now(), due_date=timezone.now())
+        self.homework = Homework.objects.create(assignment=assignment, class_member=class_member)
+        for submission in self.submissions:
+            self.homework.update_problems(str(item.id), submission)
+        self.homework.save()
+
+        # 老师修正了测试用例：旧的测试用例被删除，结果也随之删除
+        ProblemTestCase.objects.filter(problem=self.problem).delete()
+        ProblemTestCase.objects.create(problem=self.problem, ordinal=1, input='1 1', output='2')
+
+    @staticmethod
+    def _accepted(src, lang_config, test_case=None, **kwargs):
+        return {"err": None, "data": [
+            {"result": TestCaseResult.ResultCode.SUCCESS, "cpu_time": 1, "real_time": 1, "memory": 1, "exit_code": 0, "signal": 0, "error": 0, "output": "2"}
+            for _ in test_case
+        ]}
+
+    def test_rejudge_updates_submissions_stats_and_homework(self):
+        job = create_rejudge_job(problem_ids=[self.problem.id])
+        self.assertEqual(job.total_count, 5)
+
+        with mock.patch('judge.judging.run_judge', side_effect=self._accepted):
+            job = run_rejudge_job(job, concurrency=1, batch_size=2)
+
+        self.assertEqual(job.status, RejudgeJob.Status.FINISHED)
+        self.assertEqual(job.done_count, 5)
+        for submission in Submission.objects.filter(problem=self.problem):
+            self.assertEqual((submission.judge_status, submission.success_count), (Submission.JudgeStatus.FINISHED, 1))
+            self.assertEqual(submission.results.count(), 1)
+        self.assertEqual(ProblemStats.objects.get(problem=self.problem).accepted_users, 1)
+        self.homework.refresh_from_db()
+        self.assertEqual(self.homework.done_count, 1)
+
+    def test_rejudge_judges_again_and_claims_directly(self):
+        with mock.patch('judge.judging.run_judge', side_effect=self._accepted):
+            run_rejudge_job(create_rejudge_job(problem_ids=[self.problem.id]), concurrency=1, batch_size=5)
+
+        # 测试用例没变，但判题环境变了：重新判题不能直接用缓存的结果
+        def wrong(src, lang_config, test_case=None, use_cache=True, **kwargs):
+            self.assertFalse(use_cache)
+            judge = self._accepted(src, lang_config, test_case)
+            judge["data"][0]["result"] = TestCaseResult.ResultCode.WRONG_ANSWER
+            return judge
+
+        with mock.patch('judge.judging.run_judge', side_effect=wrong):
+            job = run_rejudge_job(create_rejudge_job(problem_ids=[self.problem.id]), concurrency=1, batch_size=5)
+        self.assertEqual(job.status, RejudgeJob.Status.FINISHED)
+        self.assertFalse(Submission.objects.exclude(success_count=0).exists())
+
+        # 重置之后直接是 Judging，判题 worker 领取不到
+        submission_id = self.submissions[0].id
+        with mock.patch('judge.rejudge.judge_submission') as judge_submission:
+            rejudge_submission(submission_id)
+        self.assertEqual(Submission.objects.get(id=submission_id).judge_status, Submission.JudgeStatus.JUDGING)
+        self.assertFalse(claim_submission(submission_id))
+        judge_submission.assert_called_once_with(submission_id, record_stats=False, bulk=True, use_cache=False, claimed=True)
+
+    def test_api_resumes_stalled_running_job(self):
+        admin = CustomUser.objects.create_user(username='admin', full_name='Admin', password='password', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        job = create_rejudge_job(problem_ids=[self.problem.id])
+        url = f'/judge/rejudge/{job.id}/'
+
+        with self.settings(JUDGE_REJUDGE_STALE_TIMEOUT=600), mock.patch('judge.views.start_rejudge_job') as start:
+            # 还在运行的任务不能再开一个线程去跑
+            self.assertEqual(client.post(url).status_code, 409)
+            # 处理它的进程退出后，任务一直停在 Running
+            RejudgeJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(seconds=3600))
+            self.assertEqual(client.post(url).status_code, 202)
+            self.assertEqual(client.post(url).status_code, 409)
+        start.assert_called_once()
+
+    def test_rejudge_resumes_after_failure(self):
+        job = create_rejudge_job(problem_ids=[self.problem.id])
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise RuntimeError("judge worker crashed")
+            return self._accepted(*args, **kwargs)
+
+        with mock.patch('judge.judging.run_judge', side_effect=flaky):
+            with self.assertLogs('judge.rejudge', level='ERROR'):
+                job = run_rejudge_job(job, concurrency=1, batch_size=2)
+            self.assertEqual(job.status, RejudgeJob.Status.FAILED)
+            self.assertEqual(job.done_count, 2)
+            job = run_rejudge_job(job, concurrency=1, batch_size=2)
+
+        self.assertEqual(job.status, RejudgeJob.Status.FINISHED)
+        self.assertEqual(job.done_count, 5)
+        self.assertFalse(Submission.objects.exclude(success_count=1).exists())
+
+
+class JudgeBackendRegistryTests(TestCase):
+    def setUp(self):
+        self.registry = JudgeBackendRegistry(token='token', server_base_urls=['http://judge-1', 'http://judge-2'], health_check_interval=0)
+        self.first, self.second = self.registry.nodes
+        for node in self.registry.nodes:
+            node.client = mock.Mock(server_base_url=str(node))
+            node.client.judge.return_value = {"err": None, "data": str(node)}
+            node.client.ping.return_value = {"err": None, "data": {"cpu": 0, "memory": 0, "cpu_core": 1}}
+
+    def _judge(self):
+        return self.registry.judge(src='', language_config={}, max_cpu_time=1000, max_memory=1024, test_case=[{"input": "", "output": ""}])
+
+    def test_least_loaded_node_is_chosen(self):
+        self.first.update({"err": None, "data": {"cpu": 90, "memory": 50, "cpu_core": 1}})
+        self.assertEqual(self._judge()["data"], 'http://judge-2')
+        # 多核的判题机能同时跑更多任务
+        self.first.update({"err": None, "data": {"cpu": 0, "memory": 0, "cpu_core": 8}})
+        self.second.in_flight = 1
+        self.assertEqual(self._judge()["data"], 'http://judge-1')
+
+    def test_failed_node_is_retried_on_another_node(self):
+        self.second.cpu = 50
+        self.first.client.judge.side_effect = JudgeServerClientError("connection refused")
+        with self.assertLogs('judge.backends', level='WARNING'):
+            self.assertEqual(self._judge()["data"], 'http://judge-2')
+        self.assertFalse(self.first.healthy)
+        self.assertEqual([node.in_flight for node in self.registry.nodes], [0, 0])
+
+        self.second.client.judge.side_effect = JudgeServerClientError("timed out")
+        with self.assertLogs('judge.backends', level='WARNING'), self.assertRaises(JudgeServerClientError):
+            self._judge()
+
+    def test_unhealthy_node_is_skipped_until_it_recovers(self):
+        self.second.cpu = 50
+        self.first.client.ping.return_value = {"err": "InvalidToken", "data": "invalid token"}
+        with self.assertLogs('judge.backends', level='WARNING'):
+            self.registry.check_health()
+        self.assertFalse(self.first.healthy)
+        self.assertEqual(self._judge()["data"], 'http://judge-2')
+        self.first.client.judge.assert_not_called()
+
+        self.first.client.ping.return_value = {"err": None, "data": {"cpu": 0, "memory": 0, "cpu_core": 1}}
+        self.registry.check_health()
+        self.assertTrue(self.first.healthy)
+        self.assertEqual(self._judge()["data"], 'http://judge-1')
+
+
+class SpecialJudgeTests(TestCase):
+    def setUp(self):
+        self.registry = JudgeBackendRegistry(token='token', server_base_urls=['http://judge-1', 'http://judge-2'], health_check_interval=0)
+        for node in self.registry.nodes:
+            node.client = mock.Mock()
+            node.client.compile_spj.return_value = {"err": None, "data": "success"}
+            node.client.judge.return_value = {"err": None, "data": []}
+        self.problem = Problem.objects.create(title='Any answer', description='', spj_src='int main() { return 0; }')
+
+    def test_checker_is_compiled_once_per_node_and_version(self):
+        spj_kwargs = get_spj_kwargs(self.problem)
+        for _ in range(4):
+            self.registry.judge(src='', language_config={}, max_cpu_time=1000, max_memory=1024, test_case=[{"input": "", "output": ""}], **spj_kwargs)
+
+        for node in self.registry.nodes:
+            self.assertEqual(node.client.compile_spj.call_count, 1 if node.client.judge.called else 0)
+            for call in node.client.judge.call_args_list:
+                self.assertEqual(call.kwargs["spj_version"], self.problem.spj_version)
+                self.assertNotIn("spj_src", call.kwargs)
+
+        # 判题机下线又恢复后，需要重新编译
+        node = self.registry.nodes[0]
+        node.spj_versions.add(self.problem.spj_version)
+        node.healthy = False
+        node.update({"err": None, "data": {}})
+        self.assertEqual(node.spj_versions, set())
+
+    def test_checker_compile_error_is_not_retried(self):
+        for node in self.registry.nodes:
+            node.client.compile_spj.return_value = {"err": "SPJCompileError", "data": "syntax error"}
+        with self.assertRaises(SpjCompileError):
+            self.registry.judge(src='', language_config={}, max_cpu_time=1000, max_memory=1024, test_case=[{"input": "", "output": ""}], **get_spj_kwargs(self.problem))
+        self.assertTrue(all(node.healthy for node in self.registry.nodes))
+
+    def test_spj_version_follows_source(self):
+        version = self.problem.spj_version
+        self.assertTrue(version)
+        self.problem.spj_src += '\n'
+        self.problem.save()
+        self.assertNotEqual(self.problem.spj_version, version)
+        self.problem.spj_src = ''
+        self.problem.save()
+        self.assertIsNone(self.problem.spj_version)
+
+
+class JudgeSchedulerTests(TestCase):
+    def _wait_queued(self, scheduler, count):
+        for _ in range(200):
+            if sum(scheduler.stats()['waiting'].values()) >= count:
+                return
+            time.sleep(0.01)
+        self.fail("waiter was not queued")
+
+    def test_lanes_and_fair_share_between_classes(self):
+        scheduler = JudgeScheduler(slots=1)
+        order = []
+
+        def worker(name, lane, group):
+            with scheduler.slot(lane, group):
+                order.append(name)
+
+        waiters = [
+            ('bulk', JudgeScheduler.BULK, 1),
+            ('a1', JudgeScheduler.GRADED, 1),
+            ('a2', JudgeScheduler.GRADED, 1),
+            ('a3', JudgeScheduler.GRADED, 1),
+            ('b1', JudgeScheduler.GRADED, 2),
+            ('run', JudgeScheduler.INTERACTIVE, 2),
+        ]
+        threads = []
+        with scheduler.slot(JudgeScheduler.GRADED):
+            for i, args in enumerate(waiters):
+                thread = threading.Thread(target=worker, args=args)
+                thread.start()
+                threads.append(thread)
+                self._wait_queued(scheduler, i + 1)
+        for thread in threads:
+            thread.join(timeout=5)
+
+        # 交互式运行最先，b 班不用等 a 班的三个提交都判完，批量重判最后
+        self.assertEqual(order, ['run', 'a1', 'b1', 'a2', 'a3', 'bulk'])
+        self.assertEqual(scheduler.stats()['in_use'], 0)
+
+    def test_deadline_boost(self):
+        user = CustomUser.objects.create_user(username='student', full_name='Student', password='password')
+        problem = Problem.objects.create(title='A + B', description='a + b')
+        problem_list = ProblemList.objects.create(title='List', description='')
+        ProblemListItem.objects.create(problem_list=problem_list, problem=problem, ordinal=1)
+        class_group = ClassGroup.objects.create(title='Class')
+        ClassMember.objects.create(class_group=class_group, student=user)
+        now = timezone.now()
+        assignment = Assignment.objects.create(class_group=class_group, problem_list=problem_list,
+                                               release_date=now - timedelta(days=1), due_date=now + timedelta(days=3))
+        submission = Submission.objects.create(user=user, problem=problem, src='', lang='Python3')
+
+        self.assertEqual(get_submission_priority(submission), (JudgeScheduler.GRADED, class_group.id))
+        assignment.due_date = now + timedelta(minutes=30)
+        assignment.save()
+        self.assertEqual(get_submission_priority(submission), (JudgeScheduler.DEADLINE, class_group.id))
+        self.assertEqual(get_submission_priority(submission, bulk=True), (JudgeScheduler.BULK, class_group.id))
+
+
+class FakeJudgeServerTests(TestCase):
+    def _start(self, **kwargs):
+        server = FakeJudgeServer(('127.0.0.1', 0), 'token', seed=0, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        client = JudgeServerClient('token', server.url)
+        self.addCleanup(client.close)
+        return server, client
+
+    def test_judge_protocol(self):
+        server, client = self._start(verdicts=parse_verdicts('accepted=1'))
+        self.assertIsNone(client.ping()['err'])
+        judge = client.judge(src='print(3)', language_config=py3_lang_config, max_cpu_time=1000, max_memory=128 * 1024 * 1024,
+                             test_case=[{"input": "1 2", "output": "3"}, {"input": "2 2", "output": "4"}], output=True)
+        self.assertIsNone(judge['err'])
+        self.assertEqual([(r['result'], r['output']) for r in judge['data']], [(TestCaseResult.ResultCode.SUCCESS, '3'), (TestCaseResult.ResultCode.SUCCESS, '4')])
+        self.assertEqual(client.compile_spj(src='int main(){}', spj_version='v1', spj_compile_config={}), {"err": None, "data": "success"})
+
+        bad_client = JudgeServerClient('wrong', server.url)
+        self.addCleanup(bad_client.close)
+        self.assertEqual(bad_client.ping()['err'], 'InvalidToken')
+
+    def test_verdict_distribution(self):
+        server, client = self._start(verdicts=parse_verdicts('wrong_answer=1,compile_error=0'))
+        judge = client.judge(src='', language_config=py3_lang_config, max_cpu_time=1000, max_memory=128 * 1024 * 1024,
+                             test_case=[{"input": "", "output": "1"}] * 5)
+        self.assertEqual({r['result'] for r in judge['data']}, {TestCaseResult.ResultCode.WRONG_ANSWER})
+
+        server.verdicts = parse_verdicts('compile_error')
+        judge = client.judge(src='', language_config=py3_lang_config, max_cpu_time=1000, max_memory=128 * 1024 * 1024, test_case_id='1')
+        self.assertEqual(judge['err'], 'CompileError')
+        with self.assertRaises(ValueError):
+            parse_verdicts('unknown=1')
@@ -9,9 +9,14 @@ urlpatterns = [
     path("problems/<int:problem_id>/run/", views.run_code, name="run"),
     path("problems/<int:problem_id>/submit/", views.submit_code, name="submit"),
     path("problems/<int:problem_id>/submissions/", views.get_submissions, name="submissions"),
+    path("problems/<int:problem_id>/submissions/<int:submission_id>/", views.get_submission_status, name="submission_status"),
+    path("problems/<int:problem_id>/submissions/<int:submission_id>/events/", views.stream_submission_status, name="submission_events"),
     path("problems/<int:problem_id>/results/", views.get_results, name="results"),
     path("problems/<int:problem_id>/messages/", views.ProblemMessageView.as_view(), name="messages"),
     path("problems/<int:problem_id>/ask/", views.ProblemAskQuestionView.as_view(), name="ask"),
     path("problems/<int:problem_id>/answer/", views.ProblemGetAnswerView.as_view(), name="answer"),
     path("problems/<int:problem_id>/recommendations/", views.ProblemGetRecommendationsView.as_view(), name="recommendations"),
+    path("metrics/", views.get_judge_metrics, name="metrics"),
+    path("rejudge/", views.RejudgeJobView.as_view(), name="rejudge_jobs"),
+    path("rejudge/<int:job_id>/", views.RejudgeJobView.as_view(), name="rejudge_job"),
 ]
\ No newline at end of file
@@ -1,29 +1,37 @@
+import asyncio
 import json
 import os
+import time
+from datetime import timedelta
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
-from django.http import StreamingHttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from dotenv import load_dotenv
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import transaction
-from openai import OpenAI
+from rest_framework.pagination import CursorPagination
+from django.db import models, transaction
 
-from .models import Problem, ProblemConversation, ProblemMessage, TestCase, Submission, TestCaseResult
-from .serializers import ProblemSerializer, TestCaseSerializer, SubmissionSerializer, TestCaseResultSerializer, ProblemMessageSerializer
-from .JudgeServer.client.Python.client import JudgeServerClient
-from .JudgeServer.client.Python.languages import c_lang_config, cpp_lang_config, java_lang_config, c_lang_spj_config, c_lang_spj_compile, py2_lang_config, py3_lang_config, go_lang_config, php_lang_config, js_lang_config
+from .models import Problem, ProblemConversation, ProblemMessage, TestCase, Submission, TestCaseResult, RejudgeJob
+from .serializers import ProblemSerializer, TestCaseSerializer, SubmissionSerializer, TestCaseResultSerializer, RejudgeJobSerializer, ProblemMessageSerializer
+from .judging import CLIENT, get_lang_config, get_limits, get_spj_kwargs, run_judge
+from .backends import SpjCompileError
+from .caches import COMPILE_CACHE, VERDICT_CACHE
+from .ratelimit import JudgeThrottle, JudgeQueueThrottle, judge_slot
+from .JudgeServer.client.Python.client import JudgeServerClientError
+from .workers import JUDGE_QUEUE
+from .scheduler import SCHEDULER, get_interactive_priority, get_submission_priority
+from .rejudge import create_rejudge_job, start_rejudge_job
 from chat.models import Conversation, Message
-
-# Load environment variables from .env file
-load_dotenv(override=True)
-CLIENT = JudgeServerClient(token=os.getenv("JUDGE_SERVER_TOKEN"), server_base_url=os.getenv("JUDGE_SERVER_BASE_URL"))
-LLM_CLIENT = OpenAI(api_key=os.getenv("API_KEY"), base_url=os.getenv("BASE_URL"))
-MODEL = os.getenv("MODEL")
+from chat.llm import LLM, LLMBusyError, stream_answer
+from chat.context import get_window_ids
+from accounts.authentication import AsyncAPIView, async_api_view
 
 with open(os.path.join(os.path.dirname(__file__), './prompts/answer.txt'), 'r', encoding='utf-8') as file:
     PROMPT_ANSWER = file.read()
@@ -36,7 +44,7 @@ with open(os.path.join(os.path.dirname(__file__), './prompts/recommendations.txt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_problems(request):
-    problems = Problem.objects.all()
+    problems = Problem.objects.select_related('stats')
     
     problem_id = request.query_params.get('problem_id', None)
     
@@ -55,21 +63,9 @@ def get_problem_testcases(request, problem_id):
     serializer = TestCaseSerializer(testCases, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
-def _get_lang_config(lang):
-    lang_dict = {
-        "C": c_lang_config,
-        "C++": cpp_lang_config,
-        "Java": java_lang_config,
-        "Python2": py2_lang_config,
-        "Python3": py3_lang_config,
-        "Go": go_lang_config,
-        "PHP": php_lang_config,
-        "JavaScript": js_lang_config,
-    }
-    return lang_dict.get(lang)
-
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([JudgeThrottle])
 def run_code(request, problem_id):
     problem = get_object_or_404(Problem, id=problem_id)
     
@@ -81,20 +77,29 @@ def run_code(request, problem_id):
     if not src or not lang:
         return Response({"error": "Source code and language are required"}, status=status.HTTP_400_BAD_REQUEST)
     
-    lang_config = _get_lang_config(lang)
+    lang_config = get_lang_config(lang)
     if not lang_config:
         return Response({"error": "Unsupported language"}, status=status.HTTP_400_BAD_REQUEST)
     
     test = [{"input": input_data, "output": output_data}]
+    max_cpu_time, max_memory = get_limits(problem, lang)
     
-    judge = CLIENT.judge(
-        src=src,
-        language_config=lang_config,
-        max_cpu_time=1000,
-        max_memory=1024 * 1024 * 128,
-        test_case=test,
-        output=True
-    )
+    try:
+        with judge_slot():
+            judge = run_judge(
+                src=src,
+                lang_config=lang_config,
+                max_cpu_time=max_cpu_time,
+                max_memory=max_memory,
+                test_case=test,
+                output=True,
+                priority=get_interactive_priority(request.user),
+                **get_spj_kwargs(problem)
+            )
+    except JudgeServerClientError as e:
+        return Response({"error": "Judge server is unavailable", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except SpjCompileError as e:
+        judge = {"err": "SPJCompileError", "data": str(e)}
     
     if judge.get("err"):
         return Response({"err": judge.get("err"), "data": judge.get("data")}, status=status.HTTP_200_OK)
@@ -112,6 +117,7 @@ def run_code(request, problem_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([JudgeQueueThrottle])
 def submit_code(request, problem_id):
     problem = get_object_or_404(Problem, id=problem_id)
     
@@ -122,56 +128,42 @@ def submit_code(request, problem_id):
     src = serializer.validated_data['src']
     lang = serializer.validated_data['lang']
     
-    lang_config = _get_lang_config(lang)
+    lang_config = get_lang_config(lang)
     if not lang_config:
         return Response({"error": "Unsupported language"}, status=status.HTTP_400_BAD_REQUEST)
     
-    test_cases = TestCase.objects.filter(problem_id=problem_id).order_by('ordinal')
-    test = [{"input": case.input, "output": case.output} for case in test_cases]
-    
-    judge = CLIENT.judge(
-        src=src,
-        language_config=lang_config,
-        max_cpu_time=1000,
-        max_memory=1024 * 1024 * 128,
-        test_case=test,
-        output=True
-    )
+    # ?stream=ndjson 或 ?stream=sse 时，不再立即返回，而是边判边推送每个测试用例的结果
+    stream = request.query_params.get('stream')
+    if stream in ('ndjson', 'sse') and not _can_stream(request):
+        return Response({"error": STREAM_UNSUPPORTED}, status=status.HTTP_406_NOT_ACCEPTABLE)
     
     with transaction.atomic():
-        total_count = len(test_cases)
-        success_count = 0 if judge.get("err") else sum(result.get("result") == TestCaseResult.ResultCode.SUCCESS for result in judge.get("data", []))
-        
         submission = Submission.objects.create(
             user=request.user,
             problem=problem,
             src=src,
             lang=lang,
-            err=judge.get("err"),
-            error_reason=judge.get("data") if judge.get("err") else None,
-            total_count=total_count,
-            success_count=success_count,
+            judge_status=Submission.JudgeStatus.PENDING,
         )
-        
-        if not judge.get("err"):
-            test_case_results = [
-                TestCaseResult(
-                    submission=submission,
-                    test_case=case,
-                    result=result.get("result"),
-                    cpu_time=result.get("cpu_time"),
-                    real_time=result.get("real_time"),
-                    memory=result.get("memory"),
-                    output=result.get("output"),
-                    exit_code=result.get("exit_code"),
-                    signal=result.get("signal"),
-                    error=result.get("error"),
-                )
-                for case, result in zip(test_cases, judge.get("data", []))
-            ]
-            TestCaseResult.objects.bulk_create(test_case_results)
-    
-    return Response({"submission_id": submission.id}, status=status.HTTP_201_CREATED)
+        # 等事务提交后再入队，保证 worker 一定能读到这条提交
+        lane, _ = get_submission_priority(submission)
+        transaction.on_commit(lambda: JUDGE_QUEUE.enqueue(submission.id, lane=lane))
+    
+    if stream in ('ndjson', 'sse'):
+        return _stream_submission_events(submission.id, stream)
+    
+    return Response({"submission_id": submission.id, "status": submission.judge_status}, status=status.HTTP_201_CREATED)
+
+def _get_cursor_paginator(request, ordering):
+    # 为了兼容旧的客户端，只有传了 page_size 或 cursor 时才分页
+    if 'page_size' not in request.query_params and 'cursor' not in request.query_params:
+        return None
+    paginator = CursorPagination()
+    paginator.ordering = ordering
+    paginator.page_size = 20
+    paginator.page_size_query_param = 'page_size'
+    paginator.max_page_size = 100
+    return paginator
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -189,12 +181,110 @@ def get_submissions(request, problem_id):
     if username:
         submissions = submissions.filter(user__username=username)
     
-    if order_by.lstrip('-') in ['created_at']:
-        submissions = submissions.order_by(order_by)
+    if order_by.lstrip('-') not in ['created_at']:
+        order_by = '-created_at'
+    # 同一时刻的提交按 id 排，保证游标分页翻页时不重复、不遗漏
+    ordering = (order_by, '-id' if order_by.startswith('-') else 'id')
+    submissions = submissions.order_by(*ordering)
     
-    serializer = SubmissionSerializer(submissions, many=True)
+    fields = SubmissionSerializer.parse_fields(request.query_params.get('fields'))
+    # 排序字段也要取出来，游标分页要用它生成下一页的游标
+    model_fields = SubmissionSerializer.get_model_fields(fields) + ['created_at']
+    if 'user__username' in model_fields:
+        submissions = submissions.select_related('user')
+    submissions = submissions.only(*model_fields)
+    
+    paginator = _get_cursor_paginator(request, ordering)
+    if paginator:
+        page = paginator.paginate_queryset(submissions, request)
+        serializer = SubmissionSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+    
+    serializer = SubmissionSerializer(submissions, many=True, fields=fields)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_submission_status(request, problem_id, submission_id):
+    submission = get_object_or_404(Submission, id=submission_id, problem_id=problem_id, user=request.user)
+    serializer = SubmissionSerializer(submission)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+def _poll_submission_events(submission_id, state):
+    """
+    查一次数据库，返回这期间判题过程中产生的事件，以及是否已经判完：
+    status（状态变化）、compiled（判题机报告了编译结果，success 为是否编译通过）、result（某个测试用例判完）、finished（全部判完）。
+    不分片判题时所有结果是一次保存的，compiled 和 result 会和 finished 一起到达；只有开启 JUDGE_SHARD_SIZE 时才会逐份推送。
+    state 记录上一次查询时看到的进度，由调用方在两次查询之间保存。
+    """
+    events = []
+    submission = Submission.objects.get(id=submission_id)
+    if submission.judge_status != state.get("status"):
+        state["status"] = submission.judge_status
+        events.append(("status", {"status": SubmissionSerializer().get_status(submission)}))
+    
+    results = list(TestCaseResult.objects.filter(submission_id=submission_id, id__gt=state.get("last_result_id", 0)).select_related('test_case').defer('output_blob').order_by('id'))
+    # 分片的结果是在编译结果之后保存的，查到了结果就一定编译通过了（读提交时可能还没看到编译结果）
+    compiled = True if results else submission.compiled
+    if compiled is not None and not state.get("compiled"):
+        state["compiled"] = True
+        events.append(("compiled", {"success": compiled}))
+    for result in results:
+        state["last_result_id"] = result.id
+        data = TestCaseResultSerializer(result).data
+        data["ordinal"] = result.test_case.ordinal
+        events.append(("result", data))
+    
+    finished = submission.judge_status == Submission.JudgeStatus.FINISHED
+    if finished:
+        events.append(("finished", SubmissionSerializer(submission).data))
+    return events, finished
+
+async def _submission_events(submission_id):
+    """依次产生判题过程中的事件，超时则产生 timeout；等待期间不占用线程"""
+    deadline = time.monotonic() + settings.JUDGE_STATUS_STREAM_TIMEOUT
+    state = {}
+    while True:
+        events, finished = await sync_to_async(_poll_submission_events)(submission_id, state)
+        for event in events:
+            yield event
+        if finished:
+            break
+        if time.monotonic() > deadline:
+            yield "timeout", {}
+            break
+        await asyncio.sleep(settings.JUDGE_STATUS_POLL_INTERVAL)
+
+def _format_submission_event(fmt, event, data):
+    if fmt == 'ndjson':
+        return json.dumps({"event": event, "data": data}, default=str) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _can_stream(request):
+    """
+    只有 ASGI 下才能推送事件：WSGI 下 Django 无法边生成边发送异步迭代器，
+    改用同步生成器的话每个打开的连接都会占用一个 worker 直到判完或超时，又回到了 worker 被占满的问题。
+    """
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+STREAM_UNSUPPORTED = "Streaming judge events requires an ASGI server, poll the submission status instead"
+
+def _stream_submission_events(submission_id, fmt):
+    async def lines():
+        async for event, data in _submission_events(submission_id):
+            yield _format_submission_event(fmt, event, data)
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson' if fmt == 'ndjson' else 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@async_api_view(['GET'])
+async def stream_submission_status(request, problem_id, submission_id):
+    if not _can_stream(request):
+        return JsonResponse({"error": STREAM_UNSUPPORTED}, status=status.HTTP_406_NOT_ACCEPTABLE)
+    await sync_to_async(get_object_or_404)(Submission, id=submission_id, problem_id=problem_id, user=request.user)
+    # 不能用 ?format=，它是 DRF 用来选择渲染器的参数
+    return _stream_submission_events(submission_id, request.GET.get('stream', 'sse'))
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_results(request, problem_id):
@@ -207,13 +297,76 @@ def get_results(request, problem_id):
     if submission_id:
         results = results.filter(submission_id=submission_id)
     
-    if order_by.lstrip('-') in ['test_case__ordinal']:
-        results = results.order_by(order_by)
+    if order_by.lstrip('-') not in ['test_case__ordinal']:
+        order_by = 'test_case__ordinal'
+    # 游标分页只能按本表的字段排序，所以把 ordinal 注解到结果上
+    order_by = order_by.replace('test_case__ordinal', 'ordinal')
+    ordering = (order_by, 'id')
+    results = results.annotate(ordinal=models.F('test_case__ordinal')).order_by(*ordering)
     
-    serializer = TestCaseResultSerializer(results, many=True)
+    full_output = 'full_output' in request.query_params
+    fields = TestCaseResultSerializer.parse_fields(request.query_params.get('fields'))
+    model_fields = TestCaseResultSerializer.get_model_fields(fields)
+    if full_output:
+        model_fields.append('output_blob')
+    results = results.only(*model_fields)
+    
+    # 排序要带上 id：不指定 submission_id 时很多结果的 ordinal 相同
+    paginator = _get_cursor_paginator(request, ordering)
+    if paginator:
+        page = paginator.paginate_queryset(results, request)
+        serializer = TestCaseResultSerializer(page, many=True, fields=fields, context={'full_output': full_output})
+        return paginator.get_paginated_response(serializer.data)
+    
+    serializer = TestCaseResultSerializer(results, many=True, fields=fields, context={'full_output': full_output})
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_judge_metrics(request):
+    return Response({
+        "nodes": CLIENT.status(),
+        "queue_size": JUDGE_QUEUE.qsize(),
+        "scheduler": SCHEDULER.stats(),
+        "compile_cache": COMPILE_CACHE.counter.stats(),
+        "verdict_cache": VERDICT_CACHE.counter.stats(),
+    }, status=status.HTTP_200_OK)
+
+
+class RejudgeJobView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, job_id=None):
+        if job_id:
+            job = get_object_or_404(RejudgeJob, id=job_id)
+            return Response(RejudgeJobSerializer(job).data, status=status.HTTP_200_OK)
+        jobs = RejudgeJob.objects.order_by('-created_at')[:50]
+        return Response(RejudgeJobSerializer(jobs, many=True).data, status=status.HTTP_200_OK)
+
+    def post(self, request, job_id=None):
+        if job_id:
+            # 继续一个失败了的任务，或者很久没有进展（处理它的进程已经退出）的运行中任务；同时只能有一个线程在跑同一个任务
+            job = get_object_or_404(RejudgeJob, id=job_id)
+            stale_before = timezone.now() - timedelta(seconds=settings.JUDGE_REJUDGE_STALE_TIMEOUT)
+            resumable = models.Q(status=RejudgeJob.Status.FAILED) | models.Q(status=RejudgeJob.Status.RUNNING, updated_at__lt=stale_before)
+            if not RejudgeJob.objects.filter(resumable, id=job.id).update(status=RejudgeJob.Status.RUNNING, updated_at=timezone.now()):
+                return Response({"error": f"Rejudge job is {job.status.lower()}, only failed jobs or running jobs without progress for "
+                                          f"{settings.JUDGE_REJUDGE_STALE_TIMEOUT} seconds can be resumed"}, status=status.HTTP_409_CONFLICT)
+            job.refresh_from_db()
+        else:
+            problem_ids = request.data.get('problem_ids', [])
+            problem_list_id = request.data.get('problem_list_id')
+            if not isinstance(problem_ids, list) or not all(isinstance(problem_id, int) for problem_id in problem_ids):
+                return Response({"error": "problem_ids must be a list of integers"}, status=status.HTTP_400_BAD_REQUEST)
+            if not problem_ids and not problem_list_id:
+                return Response({"error": "Either 'problem_ids' or 'problem_list_id' is required."}, status=status.HTTP_400_BAD_REQUEST)
+            job = create_rejudge_job(problem_ids=problem_ids, problem_list_id=problem_list_id, user=request.user)
+
+        start_rejudge_job(job)
+        return Response(RejudgeJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
 class ProblemMessageView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -277,46 +430,41 @@ class ProblemAskQuestionView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ProblemGetAnswerView(APIView):
-    permission_classes = [IsAuthenticated]
+class ProblemGetAnswerView(AsyncAPIView):
+    """原生 async 视图：在 ASGI 下等待大模型输出时不占用线程，数据库操作放到线程里做"""
     
-    def get(self, request, problem_id):
+    async def get(self, request, problem_id):
         CONTEXT_WINDOW = 8192
         RESERVED_ANSWER_LENGTH = 1024
         
-        problem = get_object_or_404(Problem, id=problem_id)
-        problem_conversation = get_object_or_404(ProblemConversation, problem=problem, conversation__user=request.user)
-        last_problem_message = ProblemMessage.objects.filter(problem_conversation=problem_conversation).order_by('-message__created_at').first()
+        problem_conversation, last_problem_message = await sync_to_async(self._get_conversation)(request.user, problem_id)
         if not last_problem_message:
-            return Response({"error": "No messages found for this problem conversation"}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse({"error": "No messages found for this problem conversation"}, status=status.HTTP_404_NOT_FOUND)
         
         try:
-            messages = self._get_context(problem_conversation, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
-            response = LLM_CLIENT.chat.completions.create(
-                model=MODEL,
-                messages=messages,
-                stream=True
-            )
+            messages = await sync_to_async(self._get_context)(problem_conversation, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
 
-            def stream_response():
-                chunks = []
-                for chunk in response:
-                    chunks.append(chunk)
-                    yield chunk.choices[0].delta.content
-
-                assistant_content = "".join([chunk.choices[0].delta.content for chunk in chunks])
-                last_chunk = chunks[-1]
-                usage = last_chunk.usage
-                ProblemMessage.create_message(
+            def save_answer(assistant_content, tokens, answer_status):
+                return ProblemMessage.create_message(
                     problem_conversation=problem_conversation,
                     role='assistant',
                     content=assistant_content,
-                    tokens=usage.completion_tokens
-                )
+                    tokens=tokens,
+                    status=answer_status
+                ).message
 
-            return StreamingHttpResponse(stream_response(), content_type='text/plain')
+            return StreamingHttpResponse(await stream_answer(request, messages, save_answer), content_type='text/plain')
+        except LLMBusyError as e:
+            return JsonResponse({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @staticmethod
+    def _get_conversation(user, problem_id):
+        problem = get_object_or_404(Problem, id=problem_id)
+        problem_conversation = get_object_or_404(ProblemConversation.objects.select_related('conversation'), problem=problem, conversation__user=user)
+        last_problem_message = ProblemMessage.objects.filter(problem_conversation=problem_conversation).order_by('-message__created_at').first()
+        return problem_conversation, last_problem_message
     
     @staticmethod
     def _get_context(problem_conversation, available_tokens):
@@ -328,8 +476,10 @@ class ProblemGetAnswerView(APIView):
         
         # 问题描述
         problem = problem_conversation.problem
-        problem_description = f"我正在做着`{problem.title}`这道编程题，题目描述如下：\n" + f'```\n{problem.description}\n```\n'
-        problem_description_tokens = Message.count_tokens(problem_description)
+        problem_prefix = f"我正在做着`{problem.title}`这道编程题，题目描述如下：\n" + '```\n'
+        problem_description = problem_prefix + f'{problem.description}\n```\n'
+        # 题目描述的 token 数在保存时已经算好，这里只需计算前后包装的部分
+        problem_description_tokens = Message.count_tokens(problem_prefix) + problem.get_description_tokens() + Message.count_tokens('\n```\n')
         available_tokens -= problem_description_tokens
         if available_tokens < 0:
             raise ValueError("Not enough tokens available for problem description")
@@ -337,7 +487,9 @@ class ProblemGetAnswerView(APIView):
         
         # 提问，及其代码和结果（如果有）
         message_prompts = []
-        problem_messages = ProblemMessage.objects.filter(problem_conversation=problem_conversation).order_by('-message__created_at')
+        # 代码和运行结果也占用 token，只按消息本身的 token 数取出的窗口一定包含所有能放下的消息
+        ids = get_window_ids(problem_conversation.conversation_id, available_tokens)
+        problem_messages = ProblemMessage.objects.filter(problem_conversation=problem_conversation, message_id__in=ids).select_related('message', 'relevant_submission').order_by('-message__created_at', '-message_id')
         for m in problem_messages:
             message_prompt = []
             if m.message.role == "assistant":
@@ -370,7 +522,7 @@ class ProblemGetAnswerView(APIView):
                         current_result = f"但是编译失败了，错误信息：\n" + f'```\n{submission.error_reason}\n```\n'
                     elif submission.success_count < submission.total_count:
                         current_result = f"但是有{submission.total_count - submission.success_count}个测试用例没有通过。\n"
-                        testcase_results = TestCaseResult.objects.filter(submission=submission).exclude(result=TestCaseResult.ResultCode.SUCCESS).order_by('test_case__ordinal')
+                        testcase_results = TestCaseResult.objects.filter(submission=submission).exclude(result=TestCaseResult.ResultCode.SUCCESS).select_related('test_case').defer('output_blob').order_by('test_case__ordinal')
                         for result in testcase_results:
                             if result.result == TestCaseResult.ResultCode.WRONG_ANSWER:
                                 current_result += f"\n## 测试用例{result.test_case.ordinal}的实际输出与预期不符\n" + "输入：\n" + f"```\n{result.test_case.input}\n```\n" + "预期输出：\n" + f"```\n{result.test_case.output}\n```\n" + "实际输出：\n" + f"```\n{result.output}\n```\n"
@@ -422,16 +574,14 @@ class ProblemGetRecommendationsView(APIView):
             RESERVED_ANSWER_LENGTH = 256
             messages = self._get_context(problem, conversation, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
             try:
-                response = LLM_CLIENT.chat.completions.create(
-                    model=MODEL,
-                    messages=messages,
-                    response_format={'type': 'json_object'},
-                )
+                response = LLM.chat(messages, response_format={'type': 'json_object'})
                 starters = response.choices[0].message.content
                 starters = json.loads(starters)
                 starters = "\n".join(starters)
                 conversation.starters = starters
                 conversation.save()
+            except LLMBusyError as e:
+                return Response({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
@@ -445,18 +595,22 @@ class ProblemGetRecommendationsView(APIView):
     @staticmethod
     def _get_context(problem, conversation, available_tokens):
         result = [{"role": "system", "content": PROMPT_RECOMMENDATIONS}]
-        prompt = f'# exercise:\n'
-        prompt += f'## {problem.title}\n'
-        prompt += f'```\n{problem.description}\n```\n\n'
-        prompt += f'# recent messages:\n'
+        prompt_prefix = f'# exercise:\n'
+        prompt_prefix += f'## {problem.title}\n'
+        prompt_prefix += f'```\n'
+        prompt_suffix = f'\n```\n\n'
+        prompt_suffix += f'# recent messages:\n'
+        prompt = prompt_prefix + problem.description + prompt_suffix
         conclusion = f'# conclusion:\nThat\'s all the content of the conversation, including the exercise\'s descriptiont, as well as the recent messages between the student and the teacher.\nNow, please generate 3 questions that are worth asking next, based on these content, especially the last question and answer.\n'
-        tokens = available_tokens - PROMPT_RECOMMENDATIONS_TOKENS - Message.count_tokens(prompt) - Message.count_tokens(conclusion)
+        prompt_tokens = Message.count_tokens(prompt_prefix) + problem.get_description_tokens() + Message.count_tokens(prompt_suffix)
+        tokens = available_tokens - PROMPT_RECOMMENDATIONS_TOKENS - prompt_tokens - Message.count_tokens(conclusion)
         if tokens < 0:
             raise ValueError("Not enough tokens available for basic prompt")
         
         student_overhead = Message.count_tokens(f'## student:\n```\n...\n```\n\n')
         teacher_overhead = Message.count_tokens(f'## teacher:\n```\n...\n```\n\n')
-        conversation_messages = Message.objects.filter(conversation=conversation).order_by('-created_at')
+        ids = get_window_ids(conversation.id, tokens)
+        conversation_messages = Message.objects.filter(id__in=ids).order_by('-created_at', '-id').only('role', 'content', 'tokens')
         context_messages = []
         for msg in conversation_messages:
             tokens -= msg.tokens
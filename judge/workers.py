@@ -0,0 +1,89 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .judging import judge_submission, reset_stale_submissions
+from .models import Submission
+from .scheduler import JudgeScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class JudgeQueue:
+    """
+    进程内的判题队列。
+    提交先以 Pending 状态写进数据库（持久化），再把 id 放进这个队列，
+    由若干个 worker 线程取出并调用判题机，请求线程不会被判题阻塞。
+    队列按调度通道排序（见 JudgeScheduler），临近截止的作业提交排在普通提交前面，同一通道内先进先出。
+    队列本身不持久化：worker 启动时会把数据库里遗留的 Pending 提交按提交顺序放回队列，
+    因此进程重启前还没判的提交不会丢；多个进程重复放入同一份提交也没关系，只有领取成功的 worker 会判。
+    服务器进程在 llmoj/wsgi.py、llmoj/asgi.py 里启动队列，管理命令和测试不会启动它。
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动 worker 线程，并在后台恢复上次进程退出时没判完的提交；每个进程只在第一次调用时生效"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            # 服务器先导入应用再 fork 出 worker 进程时（如 gunicorn --preload），子进程里没有这些线程，需要重新启动
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'judge-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            threading.Thread(target=self._run_recover, name='judge-recover', daemon=True).start()
+
+    def _run_recover(self):
+        # 在后台线程里查数据库，数据库暂时不可用时不影响服务器启动
+        try:
+            self._recover()
+        except Exception:
+            logger.exception("Failed to recover pending submissions")
+        finally:
+            close_old_connections()
+
+    def _recover(self):
+        reset_stale_submissions()
+        pending = Submission.objects.filter(judge_status=Submission.JudgeStatus.PENDING).order_by('created_at').values_list('id', flat=True)
+        for submission_id in pending.iterator():
+            self._queue.put((JudgeScheduler.GRADED, next(self._sequence), submission_id))
+
+    def _work(self):
+        while True:
+            _, _, submission_id = self._queue.get()
+            try:
+                close_old_connections()
+                judge_submission(submission_id)
+            except Exception:
+                logger.exception("Failed to judge submission %s", submission_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def enqueue(self, submission_id, lane=JudgeScheduler.GRADED):
+        # workers 为 0 时只入库，交给 run_judge_workers 命令去消费
+        if self.workers <= 0:
+            return
+        self.start()
+        self._queue.put((lane, next(self._sequence), submission_id))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+JUDGE_QUEUE = JudgeQueue(workers=settings.JUDGE_WORKERS)
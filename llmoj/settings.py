@@ -151,3 +151,85 @@ REST_FRAMEWORK = {
 # 文件上传相关配置
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# 判题相关配置
+# 每个进程内消费判题队列的 worker 线程数；设为 0 时只入库，由 `python manage.py run_judge_workers` 单独消费
+JUDGE_WORKERS = 4
+# 领取后超过这么多秒仍没有判完的提交，视为 worker 已经退出，启动 worker 时会放回队列重新判题
+JUDGE_STALE_TIMEOUT = 10 * 60
+# 与判题机之间的 HTTP 连接池大小，以及 (连接超时, 读超时)（秒）
+JUDGE_CLIENT_POOL_SIZE = 16
+JUDGE_CLIENT_TIMEOUT = (3, 60)
+# 多台判题机时，健康检查（ping）的间隔（秒），以及请求失败后换节点重试的次数
+JUDGE_HEALTH_CHECK_INTERVAL = 5
+JUDGE_DISPATCH_RETRIES = 1
+# 判题机测试用例目录（即挂载进 JudgeServer 容器的 /test_case，多台判题机需共享同一个目录）。
+# 配置后，保存题目时会把测试用例导出到这里，判题时只发送 test_case_id；为 None 时随每次请求发送测试用例
+JUDGE_TEST_CASE_DIR = None
+# 上传测试用例的限制：每道题最多的测试用例数、单个输入/输出文件的最大字节数、上传文件的最大字节数；
+# 导入导出时每批读写的测试用例数
+JUDGE_TEST_CASE_MAX_COUNT = 1000
+JUDGE_TEST_CASE_MAX_SIZE = 16 * 1024 * 1024
+JUDGE_TEST_CASE_MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+JUDGE_TEST_CASE_BATCH_SIZE = 100
+# 编译失败结果的缓存时间（秒）
+JUDGE_COMPILE_CACHE_TTL = 600
+# 同一份代码在同一版本测试用例下的判题结果的缓存时间（秒）
+JUDGE_VERDICT_CACHE_TTL = 24 * 60 * 60
+# 测试用例多于 JUDGE_SHARD_SIZE 个时，切成每份 JUDGE_SHARD_SIZE 个并发地分给多台判题机；为 None 时不分片
+JUDGE_SHARD_SIZE = None
+JUDGE_SHARD_WORKERS = 8
+# 运行/提交代码的限流：每个用户、每个班级各一个令牌桶，(桶容量, 每秒补充的令牌数)
+JUDGE_RATE_LIMITS = {
+    'user': (10, 0.2),
+    'class': (120, 4),
+}
+# 限流计数器的存放位置：单进程用 LocalBackend；多进程部署时用 CacheBackend，并把 CACHES 配置为共享缓存
+JUDGE_RATE_LIMIT_BACKEND = 'judge.ratelimit.LocalBackend'
+# 同时进行中的“运行代码”请求数上限，以及排队中的提交数上限，超出时返回 429
+JUDGE_MAX_IN_FLIGHT = 32
+JUDGE_MAX_QUEUE_DEPTH = 500
+# CacheBackend 下进行中请求的计数按这么多秒分段保存并自动过期，进程被杀掉时漏掉的名额最多两段时间后恢复；
+# 应大于一次运行代码的最长耗时
+JUDGE_IN_FLIGHT_TTL = 5 * 60
+# 测试用例结果中程序输出的保存策略：
+# 通过的测试用例是否保存输出；输出最多保存多少个字符；答案错误时 diff 的上下文行数；
+# 是否把超长的完整输出压缩后另存（get_results?full_output 时返回）
+JUDGE_KEEP_ACCEPTED_OUTPUT = False
+JUDGE_OUTPUT_MAX_LENGTH = 4096
+JUDGE_OUTPUT_DIFF_CONTEXT = 3
+JUDGE_OUTPUT_COMPRESS = False
+# 同时发往判题机的请求数上限（为 0 时不限制），超出时按“交互式运行 > 临近截止的作业提交 > 普通提交 > 批量重新判题”的顺序排队，
+# 同一优先级内按班级加权公平排队，JUDGE_SCHEDULER_CLASS_WEIGHTS 为 {班级 id: 权重}，默认权重为 1
+JUDGE_SCHEDULER_SLOTS = 16
+JUDGE_SCHEDULER_CLASS_WEIGHTS = {}
+# 距离作业截止时间不到这么多秒的提交优先判题
+JUDGE_DEADLINE_BOOST_WINDOW = 2 * 60 * 60
+# 批量重新判题时同时判题的提交数，以及每批的提交数（每判完一批记录一次进度）
+JUDGE_REJUDGE_CONCURRENCY = 4
+JUDGE_REJUDGE_BATCH_SIZE = 50
+# 运行中的重新判题任务超过这么多秒没有进展（处理它的进程多半已经退出）时，可以通过接口继续
+JUDGE_REJUDGE_STALE_TIMEOUT = 30 * 60
+# SSE 推送判题状态时轮询数据库的间隔与最长等待时间（秒）
+JUDGE_STATUS_POLL_INTERVAL = 0.5
+JUDGE_STATUS_STREAM_TIMEOUT = 120
+
+# 大语言模型相关配置
+# 单次请求的超时与建立连接的超时（秒）；流式响应时为相邻两段之间的最长间隔
+LLM_TIMEOUT = 60
+LLM_CONNECT_TIMEOUT = 5
+# 遇到 429、5xx 或连接错误时的重试次数，以及指数退避的初始值和上限（秒）
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BACKOFF = 0.5
+LLM_RETRY_BACKOFF_MAX = 8
+# 与模型服务之间的 HTTP 连接池大小
+LLM_POOL_SIZE = 32
+# 每个模型同时进行的请求数上限（为 0 时不限制），LLM_MODEL_CONCURRENCY 可以按模型名单独设置；
+# 排队超过 LLM_QUEUE_TIMEOUT 秒仍没有名额时返回 503
+LLM_CONCURRENCY = 16
+LLM_MODEL_CONCURRENCY = {}
+LLM_QUEUE_TIMEOUT = 10
+# token 计数的 LRU 缓存条目数（以内容的 hash 为键，不保存原文）
+LLM_TOKEN_CACHE_SIZE = 4096
+# 流式输出回答时，每隔这么多秒把已经生成的部分写入数据库；客户端断开或模型服务出错时保留已生成的部分
+LLM_ANSWER_CHECKPOINT_INTERVAL = 2
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llmoj.settings")
 
 application = get_wsgi_application()
+
+# 服务器进程启动时就开始消费判题队列，并恢复上次退出时没判完的提交。
+# runserver 只在实际处理请求的子进程里导入这个模块，自动重载的父进程和其他管理命令都不会启动队列。
+from judge.workers import JUDGE_QUEUE  # noqa: E402
+
+JUDGE_QUEUE.start()
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pdf", "0002_section_questions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="page",
+            name="content_tokens",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="section",
+            name="description_tokens",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.core.exceptions import ValidationError
 from django.db import transaction
 
 from chat.models import Conversation, Message
+from chat.tokenizer import TOKENIZER
 
 # Create your models here.
 class PDF(models.Model):
@@ -17,20 +18,44 @@ class Page(models.Model):
     pdf = models.ForeignKey(PDF, related_name='pages', on_delete=models.CASCADE)
     page_number = models.IntegerField()
     content = models.TextField()
+    content_tokens = models.IntegerField(default=0)  # content 的 token 数，保存时计算，用 get_content_tokens() 读取
 
     def __str__(self):
         return f'Page {self.page_number} of {self.pdf.title}'
 
+    def get_content_tokens(self):
+        """content 的 token 数；之前保存的页面还没有算过，第一次用到时计算并保存"""
+        if not self.content_tokens and self.content:
+            self.content_tokens = TOKENIZER.count_tokens(self.content)
+            Page.objects.filter(id=self.id).update(content_tokens=self.content_tokens)
+        return self.content_tokens
+
+    def save(self, *args, **kwargs):
+        self.content_tokens = TOKENIZER.count_tokens(self.content)
+        super().save(*args, **kwargs)
+
 class Section(models.Model):
     pdf = models.ForeignKey(PDF, related_name='sections', on_delete=models.CASCADE)
     start_page = models.IntegerField()
     end_page = models.IntegerField()
     title = models.CharField(max_length=255, default='')
     description = models.TextField()
+    description_tokens = models.IntegerField(default=0)  # description 的 token 数，保存时计算，用 get_description_tokens() 读取
     questions = models.TextField(default='')
     
     def __str__(self):
         return f'Section {self.title} of {self.pdf.title} (page {self.start_page}-{self.end_page})'
+
+    def get_description_tokens(self):
+        """description 的 token 数；之前保存的章节还没有算过，第一次用到时计算并保存"""
+        if not self.description_tokens and self.description:
+            self.description_tokens = TOKENIZER.count_tokens(self.description)
+            Section.objects.filter(id=self.id).update(description_tokens=self.description_tokens)
+        return self.description_tokens
+
+    def save(self, *args, **kwargs):
+        self.description_tokens = TOKENIZER.count_tokens(self.description)
+        super().save(*args, **kwargs)
     
     def clean(self):
         if self.start_page > self.end_page:
@@ -64,13 +89,14 @@ class PDFMessage(models.Model):
         return f'Message {self.message.id} in page {self.page.page_number if self.page else "N/A"} of section {self.section.title if self.section else "N/A"} of PDF {self.pdf_conversation.pdf.title}'
 
     @classmethod
-    def create_message(cls, pdf_conversation, role, content, tokens=0, page=None, section=None):
+    def create_message(cls, pdf_conversation, role, content, tokens=0, page=None, section=None, status=Message.Status.COMPLETE):
         with transaction.atomic():
             message = Message.objects.create(
                 conversation=pdf_conversation.conversation,
                 role=role,
                 content=content,
-                tokens=tokens
+                tokens=tokens,
+                status=status
             )
             pdf_message = cls.objects.create(
                 pdf_conversation=pdf_conversation,
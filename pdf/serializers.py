@@ -40,7 +40,7 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'user', 'role', 'content', 'created_at']
+        fields = ['id', 'conversation', 'user', 'role', 'content', 'status', 'created_at']
 
 class PDFMessageSerializer(serializers.ModelSerializer):
     message = MessageSerializer(read_only=True)
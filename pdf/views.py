@@ -6,25 +6,25 @@ from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.db import transaction, models
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse, StreamingHttpResponse
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
-from dotenv import load_dotenv
-from openai import OpenAI
 import pdfplumber
+from asgiref.sync import sync_to_async
 
 from .models import PDF, Page, Section, PDFConversation, PDFMessage
 from .serializers import PDFAnalysisSerializer, PDFMessageSerializer
 from chat.models import Message
+from chat.llm import LLM, LLMBusyError, stream_answer
+from chat.context import get_window_ids
+from chat.tokenizer import TOKENIZER
+from accounts.authentication import AsyncAPIView
 from accounts.permissions import IsTeacher, WritableIfIsTeacher
 
 # Create your views here.
-load_dotenv(override=True)
-CLIENT = OpenAI(api_key=os.getenv("API_KEY"), base_url=os.getenv("BASE_URL"))
-MODEL = os.getenv("MODEL")
 
 with open(os.path.join(os.path.dirname(__file__), './prompts/summarize.txt'), 'r', encoding='utf-8') as file:
     PROMPT_SUMMARIZE = file.read()
@@ -89,11 +89,10 @@ class PDFAnalysisView(APIView):
             {"role": "system", "content": PROMPT_SUMMARIZE},
             {"role": "user", "content": pdf_text}
         ]
-        response = CLIENT.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            response_format={'type': 'json_object'},
-        )
+        try:
+            response = LLM.chat(messages, response_format={'type': 'json_object'})
+        except LLMBusyError as e:
+            return Response({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         outline = response.choices[0].message.content
         try:
             sections = json.loads(outline)
@@ -103,19 +102,26 @@ class PDFAnalysisView(APIView):
         # 保存结果到数据库
         with transaction.atomic():
             pdf.pages.all().delete()
-            for i, page_text in enumerate(pages):
-                Page.objects.create(pdf=pdf, page_number=i + 1, content=page_text)
+            page_tokens = TOKENIZER.count_tokens_many(pages)
+            Page.objects.bulk_create([
+                Page(pdf=pdf, page_number=i + 1, content=page_text, content_tokens=page_tokens[i])
+                for i, page_text in enumerate(pages)
+            ])
             
             pdf.sections.all().delete()
-            for s in sections:
-                Section.objects.create(
+            section_tokens = TOKENIZER.count_tokens_many([s.get("description", "") for s in sections])
+            Section.objects.bulk_create([
+                Section(
                     pdf=pdf,
                     title=s.get("title", ""),
                     description=s.get("description", ""),
+                    description_tokens=section_tokens[i],
                     start_page=s.get("start_page"),
                     end_page=s.get("end_page"),
                     questions='\n'.join(s.get("questions", []))
                 )
+                for i, s in enumerate(sections)
+            ])
         
         return Response({"message": "PDF analyzed and sections saved successfully"}, status=status.HTTP_200_OK)
 
@@ -172,48 +178,43 @@ class PDFAskQuestionView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PDFGetAnswerView(APIView):
-    permission_classes = [IsAuthenticated]
+class PDFGetAnswerView(AsyncAPIView):
+    """原生 async 视图：在 ASGI 下等待大模型输出时不占用线程，数据库操作放到线程里做"""
     
-    def get(self, request, pdf_id):
+    async def get(self, request, pdf_id):
         CONTEXT_WINDOW = 8192
         RESERVED_ANSWER_LENGTH = 1024
         
-        pdf = get_object_or_404(PDF, id=pdf_id)
-        pdf_conversation = get_object_or_404(PDFConversation, pdf=pdf, conversation__user=request.user)
-        last_pdf_message = PDFMessage.objects.filter(pdf_conversation=pdf_conversation).order_by('-message__created_at').first()
+        pdf_conversation, last_pdf_message = await sync_to_async(self._get_conversation)(request.user, pdf_id)
         if not last_pdf_message:
-            return Response({"error": "No messages found for this PDF"}, status=status.HTTP_404_NOT_FOUND)
+            return JsonResponse({"error": "No messages found for this PDF"}, status=status.HTTP_404_NOT_FOUND)
 
         try:
-            messages = self._get_context(pdf_conversation.id, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
-            response = CLIENT.chat.completions.create(
-                model=MODEL,
-                messages=messages,
-                stream=True
-            )
+            messages = await sync_to_async(self._get_context)(pdf_conversation.id, CONTEXT_WINDOW - RESERVED_ANSWER_LENGTH)
 
-            def stream_response():
-                chunks = []
-                for chunk in response:
-                    chunks.append(chunk)
-                    yield chunk.choices[0].delta.content
-
-                assistant_content = "".join([chunk.choices[0].delta.content for chunk in chunks])
-                last_chunk = chunks[-1]
-                usage = last_chunk.usage
-                PDFMessage.create_message(
+            def save_answer(assistant_content, tokens, answer_status):
+                return PDFMessage.create_message(
                     pdf_conversation=pdf_conversation,
                     role='assistant',
                     content=assistant_content,
-                    tokens=usage.completion_tokens,
+                    tokens=tokens,
                     page=last_pdf_message.page,
-                    section=last_pdf_message.section
-                )
+                    section=last_pdf_message.section,
+                    status=answer_status
+                ).message
 
-            return StreamingHttpResponse(stream_response(), content_type='text/plain')
+            return StreamingHttpResponse(await stream_answer(request, messages, save_answer), content_type='text/plain')
+        except LLMBusyError as e:
+            return JsonResponse({"error": "AI assistant is busy", "details": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @staticmethod
+    def _get_conversation(user, pdf_id):
+        pdf = get_object_or_404(PDF, id=pdf_id)
+        pdf_conversation = get_object_or_404(PDFConversation.objects.select_related('conversation'), pdf=pdf, conversation__user=user)
+        last_pdf_message = PDFMessage.objects.select_related('page', 'section').filter(pdf_conversation=pdf_conversation).order_by('-message__created_at').first()
+        return pdf_conversation, last_pdf_message
     
     def _get_context(self, pdf_conversation_id, available_tokens):
         # system prompt
@@ -223,7 +224,7 @@ class PDFGetAnswerView(APIView):
         system_prompt = [{"role": "system", "content": PROMPT_ANSWER}]
         
         # 提问的prompt
-        pdf_messages = PDFMessage.objects.filter(pdf_conversation_id=pdf_conversation_id).order_by('-message__created_at')
+        pdf_messages = PDFMessage.objects.filter(pdf_conversation_id=pdf_conversation_id).select_related('message', 'page__pdf', 'section__pdf').order_by('-message__created_at', '-message_id')
         last_pdf_message = pdf_messages.first()
         if not last_pdf_message:
             raise ValueError("No messages found for this PDF conversation")
@@ -236,8 +237,10 @@ class PDFGetAnswerView(APIView):
         section_prompt = []
         section = last_pdf_message.section
         if section:
-            section_background = f"我正在看着《{section.pdf.title}》的“{section.title}”章节，这一章节的大概内容是：\n" + f'```\n{section.description}\n```\n'
-            section_background_tokens = Message.count_tokens(section_background)
+            section_prefix = f"我正在看着《{section.pdf.title}》的“{section.title}”章节，这一章节的大概内容是：\n" + '```\n'
+            section_background = section_prefix + f'{section.description}\n```\n'
+            # 章节描述的 token 数在保存时已经算好，这里只需计算前后包装的部分
+            section_background_tokens = Message.count_tokens(section_prefix) + section.get_description_tokens() + Message.count_tokens('\n```\n')
             available_tokens -= section_background_tokens
             if available_tokens >= 0:
                 section_prompt.append({"role": "user", "content": section_background})
@@ -246,15 +249,19 @@ class PDFGetAnswerView(APIView):
         page_prompt = []
         page = last_pdf_message.page
         if page and page.content:
-            page_background = f"更具体来说，我正在看着《{page.pdf.title}》的第{page.page_number}页，从这一页提取出来的文本如下：\n" + f'```\n{page.content}\n```\n'
-            page_background_tokens = Message.count_tokens(page_background)
+            page_prefix = f"更具体来说，我正在看着《{page.pdf.title}》的第{page.page_number}页，从这一页提取出来的文本如下：\n" + '```\n'
+            page_background = page_prefix + f'{page.content}\n```\n'
+            page_background_tokens = Message.count_tokens(page_prefix) + page.get_content_tokens() + Message.count_tokens('\n```\n')
             available_tokens -= page_background_tokens
             if available_tokens >= 0:
                 page_prompt.append({"role": "user", "content": page_background})
         
         # 历史问答记录
         history_prompts = []
-        for m in pdf_messages[1:]:
+        # 最后一条提问也在会话里，窗口要把它的 token 数算上
+        ids = get_window_ids(last_pdf_message.message.conversation_id, available_tokens + last_pdf_message.message.tokens) if available_tokens >= 0 else []
+        history_messages = PDFMessage.objects.filter(pdf_conversation_id=pdf_conversation_id, message_id__in=ids).exclude(id=last_pdf_message.id).select_related('message').order_by('-message__created_at', '-message_id')
+        for m in history_messages:
             available_tokens -= m.message.tokens
             if available_tokens < 0:
                 break